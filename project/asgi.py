@@ -2,6 +2,10 @@
 ASGI config for project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn project.asgi:application``) so
+long-lived streams such as the transcode progress events
+(``video.views.job_events``) and slow chunked uploads
+(``video.asgi.StreamingUploads``) do not each hold a worker thread.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +17,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from video.asgi import StreamingUploads  # noqa: E402 (needs the apps loaded above)
+
+application = StreamingUploads(django_application)
@@ -43,8 +43,8 @@ import django
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 # File Upload Settings
-DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440000  # 2.5GB in bytes
-FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440000  # 2.5GB in bytes
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB of non-file form data
+FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB; larger uploads are spooled to FILE_UPLOAD_TEMP_DIR
 FILE_UPLOAD_TEMP_DIR = '/tmp/django_uploads'  # Temporary directory for file uploads
 FILE_UPLOAD_PERMISSIONS = 0o644  # File permissions
 FILE_UPLOAD_DIRECTORY_PERMISSIONS = 0o755  # Directory permissions
@@ -75,8 +75,8 @@ STATICFILES_DIRS = [
 ALLOWED_HOSTS = ['202.169.232.239', 'localhost', '127.0.0.1']
 
 # File Upload Settings
-DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440000  # 2.5GB in bytes
-FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440000  # 2.5GB in bytes
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB of non-file form data
+FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB; larger uploads are spooled to FILE_UPLOAD_TEMP_DIR
 FILE_UPLOAD_TEMP_DIR = '/tmp/django_uploads'  # Temporary directory for file uploads
 FILE_UPLOAD_PERMISSIONS = 0o644  # File permissions
 FILE_UPLOAD_DIRECTORY_PERMISSIONS = 0o755  # Directory permissions
@@ -93,6 +93,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'rest_framework',
     'video'
 ]
 
@@ -181,6 +182,155 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/var/www/html/media'  # Local media directory for processed videos
 
+# Check uploads from the head of the stream, before the rest is received
+# (video.validation), and hash them while they stream in so duplicates can
+# skip transcoding
+FILE_UPLOAD_HANDLERS = [
+    'video.upload_handlers.ValidatingUploadHandler',
+    'video.upload_handlers.HashingMemoryFileUploadHandler',
+    'video.upload_handlers.HashingTemporaryFileUploadHandler',
+]
+
+# Chunked uploads (see video.views.upload_create)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Largest chunk accepted per PATCH request
+UPLOAD_SNIFF_BYTES = 4 * 1024 * 1024  # Head of each upload probed before the rest is accepted
+# Chunked uploads not appended to for this many seconds are abandoned: they
+# stop counting against admission limits, and transcode_worker (at start)
+# and `storage_lifecycle --apply` delete them
+UPLOAD_STALE_AFTER = 24 * 60 * 60
+
+# HLS delivery (video.media.serve_processed)
+# Set MEDIA_SENDFILE_HEADER = 'X-Accel-Redirect' (nginx, with an `internal`
+# location at MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT) or
+# 'X-Sendfile' (Apache mod_xsendfile) to let the web server send the bytes.
+MEDIA_SENDFILE_HEADER = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+HLS_PLAYLIST_MAX_AGE = 5  # Seconds; segments are cached as immutable
+
+# Shared by web and worker processes, so cache invalidation is seen by all of them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/tmp/django_cache',
+    }
+}
+CATALOGUE_PAGE_SIZE = 24  # Videos per page of /api/videos/
+CATALOGUE_CACHE_TIMEOUT = 300  # Seconds a rendered catalogue page is kept
+
+# Transcoding
+# Encodes run in `manage.py transcode_worker`, never on the request thread.
+TRANSCODE_WORKERS = os.cpu_count()  # Parallel encodes per worker command
+TRANSCODE_POLL_INTERVAL = 5  # Seconds between queue polls when idle
+# Split-and-merge encoding (video.parallel): sources longer than
+# TRANSCODE_PARALLEL_MIN_DURATION seconds are cut at keyframes into
+# TRANSCODE_CHUNKS slices encoded by TRANSCODE_CHUNK_WORKERS FFmpeg processes.
+# Set TRANSCODE_CHUNKS = 1 to always encode in a single process.
+TRANSCODE_CHUNKS = 4
+TRANSCODE_CHUNK_WORKERS = 4
+TRANSCODE_PARALLEL_MIN_DURATION = 60
+# FFmpeg processes that report no progress for this many seconds are killed
+TRANSCODE_STALL_TIMEOUT = 300
+# Jobs whose worker process dies are requeued until they have been tried this often
+TRANSCODE_MAX_ATTEMPTS = 3
+TRANSCODE_PROGRESS_INTERVAL = 2  # Seconds between progress writes to the job row
+# Passthrough (video.passthrough): H.264 sources players accept as they are
+# are segmented with stream copy instead of encoded. Set TRANSCODE_PASSTHROUGH
+# = False to always encode; Video.force_encode does it per video.
+TRANSCODE_PASSTHROUGH = True
+PASSTHROUGH_MAX_LEVEL = 42  # H.264 level times ten
+PASSTHROUGH_MAX_KEYFRAME_INTERVAL = 6  # Seconds; copied segments can only be cut at keyframes
+PASSTHROUGH_MAX_BITRATE_SCALE = 1.5  # Copy up to this multiple of the target rendition's bitrate
+# Poster, sprite sheets and thumbnails.vtt from the encode's own decode (video.thumbnails)
+TRANSCODE_THUMBNAILS = True
+# Most jobs of one kind running at once across all workers, so a bulk
+# `manage.py ingest_videos` backlog leaves room for fresh uploads
+TRANSCODE_KIND_LIMITS = {'ingest': 2, 'reprocess': 1}
+# Admission control (video.admission): encodes above these limits stay
+# queued. TRANSCODE_MAX_RUNNING counts every transcode_worker sharing
+# MEDIA_ROOT; the load limit is the one-minute load average per CPU.
+# None disables a limit.
+TRANSCODE_MAX_RUNNING = 4
+TRANSCODE_MAX_RUNNING_PER_USER = 2
+TRANSCODE_MAX_LOAD = 1.5
+# New uploads are refused before their body is received: with 503 above
+# this load per CPU, 429 once a user has this many uploads being received or
+# encoding, and 507 if MEDIA_ROOT would keep less than UPLOAD_MIN_FREE_BYTES
+# free after storing the source UPLOAD_SPACE_FACTOR times (source and renditions)
+UPLOAD_MAX_LOAD = 3.0
+UPLOAD_MAX_PENDING_PER_USER = 5
+UPLOAD_MIN_FREE_BYTES = 5 * 1024 * 1024 * 1024
+UPLOAD_SPACE_FACTOR = 2
+INGEST_PRIORITY = -10  # Job priority of bulk-ingested videos; uploads use 0
+REPROCESS_PRIORITY = -5  # Job priority of admin re-encodes
+# Output directories no video points at any more (e.g. replaced by a
+# re-encode) are deleted this many seconds after they were replaced
+TRANSCODE_OUTPUT_GRACE_PERIOD = 24 * 60 * 60
+# Umask of the encode processes: output files are created 0644 and
+# directories 0755, readable by the web server without a chmod pass
+TRANSCODE_UMASK = 0o022
+
+# VOD database sync (`manage.py sync_vod`, see video.vod_sync)
+VOD_SYNC_BATCH_SIZE = 100  # Outbox rows per multi-row INSERT
+VOD_SYNC_POOL_SIZE = 4  # Pooled MySQL connections per process
+VOD_SYNC_RETRY_DELAY = 30  # Seconds before the first retry, doubled per attempt
+VOD_SYNC_MAX_ATTEMPTS = 10  # Give up and mark the row failed after this many
+
+# Storage lifecycle (`manage.py storage_lifecycle`, see video.lifecycle)
+# Sources are deleted this many days after their last successful encode, or
+# re-encoded to a smaller H.264 mezzanine with SOURCE_RETENTION_ACTION =
+# 'compress' so they can still be reprocessed. None (the default) keeps
+# sources forever: nothing deletes them, not even the free space watermark,
+# until a retention period is set here.
+SOURCE_RETENTION_DAYS = None
+SOURCE_RETENTION_ACTION = 'delete'
+SOURCE_COMPRESS_CRF = 20
+# Adaptive outputs not played for this many days keep only the renditions
+# up to COLD_MAX_RENDITION. None (the default) keeps every rendition of
+# played and unplayed videos alike; the free space watermark below still
+# trims renditions down to COLD_MAX_RENDITION when the disk runs low
+COLD_AFTER_DAYS = None
+COLD_MAX_RENDITION = '720p'
+# Below this share of free space on MEDIA_ROOT's filesystem, sources and top
+# renditions of the least recently viewed videos are evicted early
+STORAGE_MIN_FREE_PERCENT = 10
+# Plays are counted in memory and written (with last_viewed_at) once per
+# interval, see video.viewcount
+VIEW_COUNT_FLUSH_INTERVAL = 30
+
+# Pipeline instrumentation (video.metrics)
+# Stages taking longer than this many seconds are logged as warnings and
+# flagged in the admin timeline
+PIPELINE_SLOW_STAGES = {
+    'upload': 600,
+    'store': 30,
+    'queue': 900,
+    'hash': 60,
+    'probe': 10,
+    'per_title': 300,
+    'encode': 1800,
+    'thumbnails': 60,
+    'publish': 10,
+    'vod_insert': 10,
+    'vod_sync': 300,
+}
+# Bearer token for scraping /metrics; staff sessions may read it without one
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# One JSON object per log line, so stage records keep their fields
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'video.log.JsonFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'video': {'handlers': ['console'], 'level': os.environ.get('VIDEO_LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -18,8 +18,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from video.media import serve_processed
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # HLS output gets range, conditional and cache headers (or an X-Accel-Redirect)
+    path(f"{settings.MEDIA_URL.strip('/')}/processed/<path:path>", serve_processed, name='processed_media'),
     path('', include('video.urls')),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
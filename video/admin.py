@@ -1,9 +1,17 @@
 from django.contrib import admin
-from django.utils.html import format_html
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html, format_html_join
 from django import forms
-from .models import Video
+from .jobs import queue_reprocess
+from .models import ChunkedUpload, EncodingProfile, PipelineStage, TranscodeJob, Video, VodSyncOutbox
+from .search import filter_matching
+from .upload_handlers import upload_error
 
 class VideoAdminForm(forms.ModelForm):
+    # Set by VideoAdmin.get_form when the upload handlers refused the file
+    upload_error = None
+
     class Meta:
         model = Video
         fields = '__all__'
@@ -13,14 +21,56 @@ class VideoAdminForm(forms.ModelForm):
             })
         }
 
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.upload_error:
+            # The file was refused while it streamed in, not left out
+            self._errors.pop('video', None)
+            self.add_error('video', self.upload_error)
+        return cleaned_data
+
+class TranscodeJobInline(admin.TabularInline):
+    model = TranscodeJob
+    extra = 0
+    can_delete = False
+    fields = ['status', 'progress', 'eta_seconds', 'attempts', 'created_at', 'started_at', 'finished_at', 'error']
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Video)
 class VideoAdmin(admin.ModelAdmin):
     form = VideoAdminForm
-    list_display = ['caption', 'video', 'target_resolution', 'processed_video_link']
-    readonly_fields = ['processed_video']
-    list_filter = ['target_resolution']
+    list_display = [
+        'caption', 'video', 'target_resolution', 'encoding_profile', 'status', 'view_count', 'processed_video_link'
+    ]
+    readonly_fields = [
+        'processed_video', 'status', 'duration', 'width', 'height', 'video_codec',
+        'audio_codec', 'bitrate', 'fps', 'audio_layout', 'encode_settings', 'poster_preview', 'thumbnails_vtt_url',
+        'timeline', 'source_state', 'source_bytes', 'output_bytes', 'encoded_at', 'last_viewed_at', 'view_count',
+        'uploaded_by'
+    ]
+    list_filter = ['target_resolution', 'encoding_profile', 'status', 'source_state']
+    search_fields = ['caption']
+    date_hierarchy = 'created_at'
+    inlines = [TranscodeJobInline]
     actions = ['reprocess_video']
     
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        form.upload_error = upload_error(request)
+        return form
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.uploaded_by = request.user
+        super().save_model(request, obj, form, change)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Full-text index instead of a LIKE scan over every caption
+        return filter_matching(queryset, search_term), False
+
     def processed_video_link(self, obj):
         if obj.processed_video:
             return format_html('<a href="{}" target="_blank">{}</a>', 
@@ -28,22 +78,156 @@ class VideoAdmin(admin.ModelAdmin):
                 obj.processed_video)
         return "-"
     processed_video_link.short_description = 'Processed Video'
+
+    def poster_preview(self, obj):
+        if obj.poster_url:
+            return format_html('<img src="{}" style="max-height: 180px">', obj.poster_url)
+        return "-"
+    poster_preview.short_description = 'Poster'
+
+    def timeline(self, obj):
+        """Pipeline stages of this video as bars on a shared time axis, slow and failed ones in red."""
+        stages = list(obj.stages.all()) if obj.pk else []
+        if not stages:
+            return "-"
+        begin = stages[0].started_at
+        span = max(
+            (s.started_at - begin).total_seconds() + s.duration for s in stages
+        ) or 1
+        rows = []
+        for s in stages:
+            offset = (s.started_at - begin).total_seconds()
+            rows.append((
+                s.stage,
+                f'{offset / span * 100:.2f}',
+                f'{max(s.duration / span * 100, 0.5):.2f}',
+                '#ba2121' if s.slow or s.status == PipelineStage.STATUS_FAILED else '#417690',
+                f'{s.duration:.2f}s' + (f' ({s.bytes_out // 1024 // 1024} MB out)' if s.bytes_out else ''),
+                s.error[:200],
+            ))
+        return format_html(
+            '<table style="width: 100%">{}</table>',
+            format_html_join(
+                '',
+                '<tr><td style="width: 7em">{}</td><td><div style="position: relative; height: 1em">'
+                '<div style="position: absolute; left: {}%; width: {}%; height: 100%; background: {}"></div>'
+                '</div></td><td style="width: 12em">{}</td><td>{}</td></tr>',
+                rows
+            )
+        )
+    timeline.short_description = 'Pipeline timeline'
     
     def reprocess_video(self, request, queryset):
-        for video in queryset:
-            # Clear the processed video URL to trigger reprocessing
-            video.processed_video = None
-            video.save()
-        self.message_user(request, f"{len(queryset)} videos queued for reprocessing.")
+        # The current output keeps playing until the new encode replaces it
+        queued = queue_reprocess(queryset)
+        skipped = queryset.count() - queued
+        message = f"{queued} videos queued for reprocessing."
+        if skipped:
+            message += f" {skipped} already had a job waiting or running, or no source file any more."
+        self.message_user(request, message)
     reprocess_video.short_description = "Reprocess selected videos"
 
     fieldsets = (
         (None, {
-            'fields': ('caption', 'video')
+            'fields': ('caption', 'video', 'uploaded_by')
         }),
         ('Processing Options', {
-            'fields': ('target_resolution', 'processed_video'),
+            'fields': (
+                'target_resolution', 'encoding_profile', 'force_encode', 'status', 'processed_video', 'poster_preview',
+                'thumbnails_vtt_url', 'encode_settings'
+            ),
             'classes': ('collapse',),
             'description': 'Select the target resolution for video processing. Changes require reprocessing the video.'
         }),
-    )
\ No newline at end of file
+        ('Source Metadata', {
+            'fields': ('duration', ('width', 'height'), ('video_codec', 'audio_codec'), 'bitrate', 'fps', 'audio_layout'),
+            'classes': ('collapse',),
+        }),
+        ('Pipeline', {
+            'fields': ('timeline',),
+            'classes': ('collapse',),
+        }),
+        ('Storage', {
+            'fields': (('source_state', 'source_bytes'), 'output_bytes', 'encoded_at', ('last_viewed_at', 'view_count')),
+            'classes': ('collapse',),
+            'description': 'Managed by `manage.py storage_lifecycle`.'
+        }),
+    )
+
+@admin.register(EncodingProfile)
+class EncodingProfileAdmin(admin.ModelAdmin):
+    list_display = ['name', 'preset', 'crf', 'maxrate_scale', 'audio_bitrate', 'container', 'per_title', 'is_default']
+    list_filter = ['per_title', 'preset', 'container']
+    fieldsets = (
+        (None, {
+            'fields': ('name', 'is_default', 'preset', 'crf', 'maxrate_scale', 'audio_bitrate')
+        }),
+        ('HLS Output', {
+            'fields': ('container', 'segment_duration'),
+        }),
+        ('Per-title Optimization', {
+            'fields': ('per_title', 'target_ssim', ('crf_min', 'crf_max'), ('sample_count', 'sample_duration')),
+            'description': 'When enabled, CRF and maxrate are chosen per video from short trial encodes of sampled scenes.'
+        }),
+    )
+
+@admin.register(TranscodeJob)
+class TranscodeJobAdmin(admin.ModelAdmin):
+    list_display = [
+        'video', 'kind', 'priority', 'status', 'progress_display', 'speed', 'eta_seconds', 'attempts', 'started_at',
+        'finished_at'
+    ]
+    list_filter = ['status', 'kind']
+    readonly_fields = [
+        'video', 'kind', 'status', 'progress_display', 'fps', 'speed', 'eta_seconds', 'progress_at', 'live_status',
+        'attempts', 'created_at', 'started_at', 'finished_at', 'error'
+    ]
+
+    def progress_display(self, obj):
+        return f'{obj.progress:.1f}%'
+    progress_display.short_description = 'Progress'
+
+    def live_status(self, obj):
+        if obj.status not in (Video.STATUS_QUEUED, Video.STATUS_RUNNING):
+            return "-"
+        return format_html(
+            '<a href="{}" target="_blank">JSON</a> | <a href="{}" target="_blank">Event stream</a>',
+            reverse('video:job_status', args=[obj.pk]),
+            reverse('video:job_events', args=[obj.pk])
+        )
+    live_status.short_description = 'Live status'
+
+
+@admin.register(PipelineStage)
+class PipelineStageAdmin(admin.ModelAdmin):
+    list_display = ['stage', 'video', 'job', 'started_at', 'duration', 'bytes_in', 'bytes_out', 'status', 'slow']
+    list_filter = ['stage', 'status', 'slow']
+    date_hierarchy = 'started_at'
+    list_select_related = ['video', 'job__video']
+    readonly_fields = [
+        'stage', 'video', 'job', 'started_at', 'duration', 'bytes_in', 'bytes_out', 'status', 'error', 'slow'
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ChunkedUpload)
+class ChunkedUploadAdmin(admin.ModelAdmin):
+    list_display = ['filename', 'user', 'offset', 'size', 'video', 'updated_at']
+    readonly_fields = ['id', 'user', 'filename', 'size', 'offset', 'video', 'created_at', 'updated_at']
+
+
+@admin.register(VodSyncOutbox)
+class VodSyncOutboxAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'video', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status']
+    readonly_fields = ['idempotency_key', 'video', 'payload', 'attempts', 'created_at', 'sent_at', 'last_error']
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        count = queryset.exclude(status=VodSyncOutbox.STATUS_SENT).update(
+            status=VodSyncOutbox.STATUS_PENDING, attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{count} rows queued for another sync attempt.")
+    retry_now.short_description = "Retry selected rows now"
@@ -0,0 +1,130 @@
+"""Admission control: how much work the box takes on at once.
+
+Encodes are started by ``video.jobs.claim_next_job`` only while fewer than
+TRANSCODE_MAX_RUNNING jobs run across every ``transcode_worker`` sharing
+MEDIA_ROOT, fewer than TRANSCODE_MAX_RUNNING_PER_USER of them belong to the
+uploader, and the load average per CPU is below TRANSCODE_MAX_LOAD. Work
+above the limits stays queued. Claims are serialized by an ``flock`` on
+``MEDIA_ROOT/.transcode_claim.lock``, so two workers cannot both take the
+last free slot.
+
+New uploads are turned away before their body is received (by
+``upload_create`` and ``video.upload_handlers.ValidatingUploadHandler``)
+when the load per CPU is above UPLOAD_MAX_LOAD, when the uploader already
+has UPLOAD_MAX_PENDING_PER_USER uploads or encodes pending, or when
+MEDIA_ROOT would be left with less than UPLOAD_MIN_FREE_BYTES free.
+"""
+import fcntl
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Count, F, Sum
+
+from .models import ChunkedUpload, TranscodeJob, Video
+from .uploads import stale_upload_cutoff
+
+CLAIM_LOCK_NAME = '.transcode_claim.lock'
+
+
+class AdmissionRejected(Exception):
+    """Raised when new work is refused; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=503, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def load_per_cpu():
+    """One-minute load average divided by the CPU count, or None where the OS has none."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return None
+
+
+@contextmanager
+def claim_lock():
+    """Hold the lock that serializes job claims across worker processes."""
+    path = Path(settings.MEDIA_ROOT) / CLAIM_LOCK_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def encode_deferred():
+    """Why no encode may start now, or None. Call with ``claim_lock`` held."""
+    limit = getattr(settings, 'TRANSCODE_MAX_RUNNING', None)
+    if limit is not None and TranscodeJob.objects.filter(status=Video.STATUS_RUNNING).count() >= limit:
+        return f'{limit} encodes running'
+    max_load, load = getattr(settings, 'TRANSCODE_MAX_LOAD', None), load_per_cpu()
+    if max_load is not None and load is not None and load > max_load:
+        return f'load {load:.2f} per CPU'
+    return None
+
+
+def saturated_users():
+    """Uploaders with TRANSCODE_MAX_RUNNING_PER_USER encodes running, as a ``values_list`` queryset."""
+    limit = getattr(settings, 'TRANSCODE_MAX_RUNNING_PER_USER', None)
+    if limit is None:
+        return []
+    return (
+        TranscodeJob.objects.filter(status=Video.STATUS_RUNNING, video__uploaded_by__isnull=False)
+        .order_by()
+        .values('video__uploaded_by')
+        .annotate(count=Count('pk'))
+        .filter(count__gte=limit)
+        .values_list('video__uploaded_by', flat=True)
+    )
+
+
+def _free_bytes(path):
+    path = Path(path)
+    while not path.exists():
+        path = path.parent
+    return shutil.disk_usage(path).free
+
+
+def check_upload(user, size):
+    """Raise ``AdmissionRejected`` unless a new upload of ``size`` bytes by ``user`` may start.
+
+    ``size`` may be None when the client did not announce it; the disk check
+    then assumes an upload of Video.MAX_VIDEO_SIZE_MB.
+    """
+    max_load, load = getattr(settings, 'UPLOAD_MAX_LOAD', None), load_per_cpu()
+    if max_load is not None and load is not None and load > max_load:
+        raise AdmissionRejected('The server is busy, please retry the upload later', 503, retry_after=60)
+
+    # Chunked uploads still coming in; abandoned ones are left to collect_stale_uploads
+    receiving = ChunkedUpload.objects.filter(video__isnull=True, updated_at__gte=stale_upload_cutoff())
+    limit = getattr(settings, 'UPLOAD_MAX_PENDING_PER_USER', None)
+    if limit is not None and user is not None and user.is_authenticated:
+        pending = (
+            Video.objects.filter(uploaded_by=user, status__in=[Video.STATUS_QUEUED, Video.STATUS_RUNNING]).count()
+            + receiving.filter(user=user).count()
+        )
+        if pending >= limit:
+            raise AdmissionRejected(
+                f'You already have {pending} uploads waiting to be received or encoded', 429, retry_after=300
+            )
+
+    size = size or Video.MAX_VIDEO_SIZE_MB * 1024 * 1024
+    # Bytes already promised to chunked uploads that are still coming in
+    promised = receiving.aggregate(
+        remaining=Sum(F('size') - F('offset'))
+    )['remaining'] or 0
+    # The source, plus its renditions on the same filesystem
+    needed = size * getattr(settings, 'UPLOAD_SPACE_FACTOR', 2) + promised
+    free = _free_bytes(settings.MEDIA_ROOT)
+    if free - needed < getattr(settings, 'UPLOAD_MIN_FREE_BYTES', 0):
+        raise AdmissionRejected('Not enough free disk space for this upload', 507)
+    temp_dir = settings.FILE_UPLOAD_TEMP_DIR
+    if temp_dir and _free_bytes(temp_dir) < size + promised:
+        raise AdmissionRejected('Not enough free space to receive this upload', 507)
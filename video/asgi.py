@@ -0,0 +1,97 @@
+"""Streaming chunk uploads for the ASGI application (``project.asgi``).
+
+Django's ASGI handler receives a request's whole body, spooling it to a
+temporary file, before the view runs: every chunk is written to disk twice
+and waits in the handler until the slowest client has sent all of it.
+``StreamingUploads`` wraps the Django application and takes over the PATCH
+requests of ``video:upload_detail``, appending each body message to the
+upload as it arrives. A slow upload then costs a coroutine and one buffered
+message, so one process holds hundreds of them. Every other request goes to
+Django unchanged.
+"""
+import io
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import aget_user
+from django.core import signals
+from django.core.handlers.asgi import get_script_prefix
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.urls import Resolver404, resolve, set_script_prefix
+
+from .models import ChunkedUpload
+from .views import receive_chunk
+
+UPLOAD_VIEW = 'video:upload_detail'
+
+
+class BodyReader:
+    """``await read(n)`` over the ``http.request`` messages of one ASGI request.
+
+    Returns up to ``n`` bytes as soon as any are available, and ``b''`` once
+    the body is complete or the client has disconnected.
+    """
+
+    def __init__(self, receive):
+        self.receive = receive
+        self.buffer = b''
+        self.finished = False
+        self.disconnected = False
+
+    async def __call__(self, n):
+        while not self.buffer and not self.finished:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                self.finished = self.disconnected = True
+            else:
+                self.buffer = message.get('body', b'')
+                self.finished = not message.get('more_body', False)
+        block, self.buffer = self.buffer[:n], self.buffer[n:]
+        return block
+
+
+class StreamingUploads:
+    """ASGI middleware streaming upload chunks to disk; ``app`` is Django's ``ASGIHandler``."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'PATCH':
+            return await self.app(scope, receive, send)
+        set_script_prefix(get_script_prefix(scope))
+        request, error = self.app.create_request(scope, io.BytesIO())
+        if request is None:
+            return await self.app.send_response(error, send)
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            match = None
+        if match is None or match.view_name != UPLOAD_VIEW:
+            return await self.app(scope, receive, send)
+
+        await signals.request_started.asend(sender=self.__class__, scope=scope)
+        try:
+            reader = BodyReader(receive)
+            response = await self.patch(request, match.kwargs['upload_id'], reader)
+            if not reader.disconnected:
+                await self.app.send_response(response, send)
+        finally:
+            await signals.request_finished.asend(sender=self.__class__)
+
+    async def patch(self, request, upload_id, read):
+        """What ``upload_detail`` with the project's session, CSRF and auth middleware would answer."""
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        )
+        rejected = CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+        if rejected:
+            return rejected
+        user = await aget_user(request)
+        if not (user.is_authenticated and user.is_staff):
+            return JsonResponse({'error': 'Staff login required'}, status=403)
+        upload = await ChunkedUpload.objects.filter(pk=upload_id, video__isnull=True).afirst()
+        if upload is None:
+            return JsonResponse({'error': 'Upload not found'}, status=404)
+        return await receive_chunk(request, upload, read)
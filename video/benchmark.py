@@ -0,0 +1,204 @@
+"""Transcode benchmarks on synthetic sources (``manage.py benchmark_transcode``).
+
+Sources are generated offline with FFmpeg's ``lavfi`` testsrc2/sine inputs
+and bit-exact flags, so every run on a machine encodes identical bytes. Each
+scenario runs the real upload path (``Video.save()`` then
+``transcode_video``) in a fresh process against a temporary MEDIA_ROOT,
+inside a transaction that is rolled back, and reports wall and CPU time,
+peak RSS of the largest FFmpeg process, realtime speed and output bitrate.
+"""
+import json
+import multiprocessing
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Metrics compared against a baseline, and which direction is better
+HIGHER_IS_WORSE = {'wall_s': True, 'cpu_s': True, 'peak_rss_mb': True, 'speed': False}
+# Media files of every HLS container (see video.ffmpeg.hls_args)
+SEGMENT_SUFFIXES = {'.ts', '.m4s', '.mp4'}
+
+
+class _Rollback(Exception):
+    pass
+
+
+def source_path(cache_dir, size, duration):
+    return Path(cache_dir) / f'testsrc_{size}_{duration}s.mp4'
+
+
+def generate_source(cache_dir, size, duration, fps=25):
+    """Create (once) a deterministic ``size`` test pattern with a sine tone, ``duration`` seconds long."""
+    path = source_path(cache_dir, size, duration)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_suffix('.part.mp4')
+    subprocess.run([
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={fps}:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'medium', '-crf', '18', '-g', str(fps * 2), '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k', '-shortest',
+        '-map_metadata', '-1', '-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact',
+        str(partial)
+    ], check=True)
+    partial.rename(path)
+    return path
+
+
+def ffmpeg_version():
+    try:
+        return subprocess.check_output(['ffmpeg', '-version'], text=True).splitlines()[0]
+    except (OSError, subprocess.SubprocessError):
+        return 'unknown'
+
+
+def _output_stats(stream_dir, duration):
+    """Total and per-rendition bitrate of the HLS segments in ``stream_dir``."""
+    sizes = {}
+    for segment in Path(stream_dir).rglob('*'):
+        if segment.suffix not in SEGMENT_SUFFIXES:
+            continue
+        rendition = segment.parent.name if segment.parent != Path(stream_dir) else 'main'
+        sizes[rendition] = sizes.get(rendition, 0) + segment.stat().st_size
+    total = sum(sizes.values())
+    return {
+        'output_bytes': total,
+        'bitrate_kbps': round(total * 8 / duration / 1000, 1),
+        'renditions_kbps': {name: round(size * 8 / duration / 1000, 1) for name, size in sorted(sizes.items())},
+    }
+
+
+def _run_scenario(source, duration, target_resolution, overrides):
+    """Run one encode in this (fresh) process and return its measurements."""
+    import django
+    django.setup()
+    from django.core.files import File
+    from django.db import transaction
+    from django.test.utils import override_settings
+
+    from .models import Video
+    from .transcode import transcode_video
+
+    media_root = tempfile.mkdtemp(prefix='transcode_bench_')
+    result = {}
+    try:
+        with override_settings(MEDIA_ROOT=media_root, **overrides):
+            try:
+                with transaction.atomic():
+                    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+                    own = resource.getrusage(resource.RUSAGE_SELF)
+                    started = time.perf_counter()
+
+                    with open(source, 'rb') as f:
+                        video = Video(caption='benchmark', target_resolution=target_resolution)
+                        video.video.save(Path(source).name, File(f), save=False)
+                        video.save()
+                    transcode_video(video)
+                    if video.status == Video.STATUS_DONE:
+                        raise RuntimeError('Benchmark source matched an existing video; nothing was encoded')
+
+                    wall = time.perf_counter() - started
+                    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+                    own_after = resource.getrusage(resource.RUSAGE_SELF)
+                    result = {
+                        'wall_s': round(wall, 3),
+                        'cpu_s': round(
+                            (children_after.ru_utime - children.ru_utime) + (children_after.ru_stime - children.ru_stime)
+                            + (own_after.ru_utime - own.ru_utime) + (own_after.ru_stime - own.ru_stime), 3
+                        ),
+                        # ru_maxrss is in KiB on Linux; this process is fresh, so it covers this encode only
+                        'peak_rss_mb': round(children_after.ru_maxrss / 1024, 1),
+                        'speed': round(duration / wall, 3),
+                        **_output_stats(Path(media_root, video.output_path()).parent, duration),
+                    }
+                    raise _Rollback()
+            except _Rollback:
+                pass
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+    return result
+
+
+def run_scenario(source, duration, target_resolution, overrides=None):
+    """Measure one encode in a child process, so peak RSS and CPU time are its own."""
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(_run_scenario, (str(source), duration, target_resolution, overrides or {}))
+
+
+def run_benchmarks(cache_dir, sizes, durations, targets, repeat=1, overrides=None, log=print):
+    """Run every size x duration x target scenario ``repeat`` times; return the report dict.
+
+    Each metric is the median over the repeats.
+    """
+    results = []
+    for size in sizes:
+        for duration in durations:
+            source = generate_source(cache_dir, size, duration)
+            for target in targets:
+                name = f'{size}_{duration}s_{target}'
+                runs = [run_scenario(source, duration, target, overrides) for _ in range(repeat)]
+                result = {'name': name, 'source_size': size, 'duration': duration, 'target': target, 'runs': repeat}
+                for key in runs[0]:
+                    if isinstance(runs[0][key], (int, float)):
+                        result[key] = statistics.median(run[key] for run in runs)
+                    else:
+                        result[key] = runs[-1][key]
+                log(f"{name}: {result['wall_s']:.2f}s wall, {result['cpu_s']:.2f}s CPU, "
+                    f"{result['peak_rss_mb']:.0f} MB, {result['speed']:.2f}x, {result['bitrate_kbps']:.0f} kb/s")
+                results.append(result)
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'machine': {
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpu_count': multiprocessing.cpu_count(),
+            'python': platform.python_version(),
+            'ffmpeg': ffmpeg_version(),
+        },
+        'overrides': overrides or {},
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Compare ``report`` against ``baseline`` by scenario name.
+
+    Returns ``(rows, regressions)``: one ``(name, metric, old, new, change)``
+    row per shared metric, and the subset that got worse by more than
+    ``tolerance`` (a fraction).
+    """
+    previous = {result['name']: result for result in baseline.get('results', [])}
+    rows, regressions = [], []
+    for result in report['results']:
+        old = previous.get(result['name'])
+        if old is None:
+            continue
+        for metric, higher_is_worse in HIGHER_IS_WORSE.items():
+            if not old.get(metric) or metric not in result:
+                continue
+            change = (result[metric] - old[metric]) / old[metric]
+            row = (result['name'], metric, old[metric], result[metric], change)
+            rows.append(row)
+            if (change if higher_is_worse else -change) > tolerance:
+                regressions.append(row)
+    return rows, regressions
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_report(report, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2) + '\n')
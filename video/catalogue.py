@@ -0,0 +1,39 @@
+"""Versioned cache for the public catalogue API.
+
+Every rendered page is cached under the current catalogue version. Saving or
+deleting a Video bumps the version (see ``video.signals``), which orphans all
+cached pages at once and changes every ETag.
+"""
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.utils import timezone
+
+VERSION_KEY = 'video:catalogue:version'
+
+
+def catalogue_version():
+    """``{'version': str, 'modified': datetime}`` of the current catalogue."""
+    current = cache.get(VERSION_KEY)
+    if current is None:
+        cache.add(VERSION_KEY, {'version': uuid.uuid4().hex, 'modified': timezone.now()}, None)
+        current = cache.get(VERSION_KEY)
+    return current
+
+
+def invalidate_catalogue():
+    cache.set(VERSION_KEY, {'version': uuid.uuid4().hex, 'modified': timezone.now()}, None)
+
+
+def page_cache_key(request):
+    url = hashlib.sha256(request.build_absolute_uri().encode()).hexdigest()
+    return f"video:catalogue:{catalogue_version()['version']}:{url}"
+
+
+def page_etag(request, *args, **kwargs):
+    return hashlib.sha256(page_cache_key(request).encode()).hexdigest()[:32]
+
+
+def page_last_modified(request, *args, **kwargs):
+    return catalogue_version()['modified']
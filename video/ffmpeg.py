@@ -0,0 +1,364 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TranscodeError(Exception):
+    """Raised when a video could not be turned into an HLS stream."""
+
+
+# Rendition ladder; 'original' gets the source size filled in at encode time
+RESOLUTION_SETTINGS = {
+    'original': {'size': None, 'bitrate': '4000k', 'bufsize': '8000k'},
+    '360p': {'size': '640x360', 'bitrate': '800k', 'bufsize': '1600k'},
+    '480p': {'size': '854x480', 'bitrate': '1200k', 'bufsize': '2400k'},
+    '720p': {'size': '1280x720', 'bitrate': '2500k', 'bufsize': '5000k'},
+    '1080p': {'size': '1920x1080', 'bitrate': '4000k', 'bufsize': '8000k'},
+}
+
+# HLS segment containers, see hls_args()
+CONTAINER_MPEGTS = 'mpegts'
+CONTAINER_FMP4 = 'fmp4'
+CONTAINER_SINGLE_FILE = 'single_file'
+
+# Encoder settings used when no EncodingProfile applies; see EncodingProfile.as_encoding()
+DEFAULT_ENCODING = {
+    'preset': 'veryfast', 'crf': 23, 'maxrate_scale': 1.0, 'audio_bitrate': '128k',
+    'container': CONTAINER_MPEGTS, 'segment_duration': 6,
+}
+
+# Scrub previews (see video.thumbnails): one SPRITE_TILE_SIZE thumbnail every
+# SPRITE_INTERVAL seconds, tiled SPRITE_COLUMNS x SPRITE_ROWS per sprite sheet
+SPRITE_INTERVAL = 5
+SPRITE_TILE_SIZE = '160x90'
+SPRITE_COLUMNS = 10
+SPRITE_ROWS = 10
+POSTER_HEIGHT = 720  # Upper bound; smaller sources keep their height
+POSTER_NAME = 'poster.jpg'
+
+# How much of FFmpeg's stderr is kept for error messages and log parsing
+LOG_TAIL_BYTES = 64 * 1024
+
+
+def segment_duration(encoding):
+    return encoding.get('segment_duration', DEFAULT_ENCODING['segment_duration'])
+
+
+def hls_args(encoding, segment_dir, playlist, segment_prefix='segment'):
+    """HLS muxer arguments writing ``playlist`` with its segments in ``segment_dir``.
+
+    The container decides the files: ``mpegts`` writes ``<prefix>_NNN.ts``,
+    ``fmp4`` (CMAF) an ``init.mp4`` plus ``<prefix>_NNN.m4s``, and
+    ``single_file`` one fragmented ``<prefix>.mp4`` per rendition that the
+    playlist addresses with EXT-X-BYTERANGE.
+    """
+    container = encoding.get('container', CONTAINER_MPEGTS)
+    segment_dir = Path(segment_dir)
+    args = ['-hls_time', str(segment_duration(encoding)), '-hls_list_size', '0']
+    if container == CONTAINER_SINGLE_FILE:
+        args.extend([
+            '-hls_flags', 'independent_segments+single_file', '-hls_segment_type', 'fmp4',
+            '-hls_segment_filename', str(segment_dir / f'{segment_prefix}.mp4')
+        ])
+    elif container == CONTAINER_FMP4:
+        args.extend([
+            '-hls_flags', 'independent_segments', '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', 'init.mp4',
+            '-hls_segment_filename', str(segment_dir / f'{segment_prefix}_%03d.m4s')
+        ])
+    else:
+        args.extend([
+            '-hls_flags', 'independent_segments', '-hls_segment_type', 'mpegts',
+            '-hls_segment_filename', str(segment_dir / f'{segment_prefix}_%03d.ts')
+        ])
+    return args + ['-f', 'hls', str(playlist)]
+
+
+def video_codec_args(encoding):
+    return [
+        '-c:v', 'libx264', '-preset', encoding['preset'], '-profile:v', 'main', '-level', '3.1', '-pix_fmt', 'yuv420p',
+        # A keyframe at every segment boundary, so segments come out at the configured length
+        '-force_key_frames', f'expr:gte(t,n_forced*{segment_duration(encoding)})'
+    ]
+
+
+def audio_codec_args(encoding):
+    return ['-c:a', 'aac', '-b:a', encoding['audio_bitrate'], '-ac', '2', '-ar', '44100']
+
+
+def scaled_rate(rate, scale):
+    """Scale an FFmpeg rate such as ``'2500k'``."""
+    return f"{max(1, round(int(rate.rstrip('k')) * scale))}k"
+
+
+def _scale_filter(size):
+    width, height = size.split('x')
+    return f'scale=w={width}:h={height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:color=black'
+
+
+def thumbnail_filters(poster_at=None):
+    """``(inputs, chains)`` for the thumbnail branches of a filter graph.
+
+    The caller feeds a copy of the decoded video into each label in
+    ``inputs`` and maps ``[thumbs_out]`` (and ``[poster]`` when ``poster_at``
+    is given) with ``thumbnail_outputs()``. Both branches emit their first
+    frame right away: a branch that holds frames back (such as ``tile``)
+    stalls every other output of the process until it produces something.
+    """
+    width, height = SPRITE_TILE_SIZE.split('x')
+    inputs = ['thumbs']
+    chains = [
+        f'[thumbs]fps=1/{SPRITE_INTERVAL},'
+        f'scale=w={width}:h={height}:force_original_aspect_ratio=decrease,'
+        f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:color=black[thumbs_out]'
+    ]
+    if poster_at is not None:
+        # The first frame, then the one at poster_at, which overwrites it
+        inputs.append('poster_in')
+        chains.append(
+            f"[poster_in]select='eq(selected_n,0)+eq(selected_n,1)*gte(t,{poster_at:.3f})',"
+            f"scale=-2:'min(ih,{POSTER_HEIGHT})'[poster]"
+        )
+    return inputs, chains
+
+
+def thumbnail_outputs(stream_dir, prefix='thumb', poster=False, duration=None):
+    """FFmpeg output arguments writing ``<prefix>_NNNNN.jpg`` thumbnails (and the poster) into ``stream_dir``."""
+    args = ['-map', '[thumbs_out]']
+    if duration is not None:
+        args.extend(['-t', f'{duration:.6f}'])
+    args.extend(['-q:v', '3', '-start_number', '0', '-f', 'image2', str(Path(stream_dir) / f'{prefix}_%05d.jpg')])
+    if poster:
+        args.extend(['-map', '[poster]', '-update', '1', '-q:v', '3', str(Path(stream_dir) / POSTER_NAME)])
+    return args
+
+
+def build_sprite_command(stream_dir, prefix='thumb', sheet_prefix='sprite'):
+    """FFmpeg command tiling ``<prefix>_NNNNN.jpg`` thumbnails into ``<sheet_prefix>_NNN.jpg`` sheets.
+
+    Only the small thumbnails are decoded, never the source.
+    """
+    return [
+        'ffmpeg', '-y',
+        '-framerate', '1', '-start_number', '0', '-i', str(Path(stream_dir) / f'{prefix}_%05d.jpg'),
+        '-vf', f'tile={SPRITE_COLUMNS}x{SPRITE_ROWS}',
+        '-q:v', '5', '-start_number', '0', '-f', 'image2',
+        str(Path(stream_dir) / f'{sheet_prefix}_%03d.jpg')
+    ]
+
+
+def abr_rungs(source_height):
+    """Ladder rungs at or below the source height, lowest first."""
+    rungs = [
+        name for name, res in RESOLUTION_SETTINGS.items()
+        if res['size'] and int(res['size'].split('x')[1]) <= source_height
+    ]
+    return rungs or ['360p']
+
+
+def build_single_command(source, stream_dir, target_resolution, original_width, original_height, encoding=None,
+                         start=None, duration=None, segment_prefix='segment', playlist_name='playlist.m3u8',
+                         thumbnail_prefix=None, poster_at=None):
+    """FFmpeg command for one rendition written to ``stream_dir/playlist.m3u8``.
+
+    ``start``/``duration`` restrict the encode to one slice of the source; the
+    output timestamps keep the slice's position in the full video. With a
+    ``thumbnail_prefix`` the same decode also writes scrub thumbnails, and a
+    poster taken ``poster_at`` seconds into the slice.
+    """
+    encoding = encoding or DEFAULT_ENCODING
+    res_setting = dict(RESOLUTION_SETTINGS[target_resolution])
+    if target_resolution == 'original':
+        res_setting['size'] = f'{original_width}x{original_height}'
+
+    ffmpeg_cmd = ['ffmpeg', '-y']
+    if start is not None:
+        ffmpeg_cmd.extend(['-ss', f'{start:.6f}'])
+    ffmpeg_cmd.extend(['-i', str(source)])
+    if duration is not None:
+        ffmpeg_cmd.extend(['-t', f'{duration:.6f}'])
+    if start:
+        ffmpeg_cmd.extend(['-output_ts_offset', f'{start:.6f}'])
+    ffmpeg_cmd.extend(['-threads', '2'] + video_codec_args(encoding))
+
+    # Add resolution-specific parameters if not keeping original
+    scale = _scale_filter(res_setting['size']) if target_resolution != 'original' else None
+    if thumbnail_prefix:
+        inputs, chains = thumbnail_filters(poster_at)
+        split = f"[0:v]split={1 + len(inputs)}[main]" + ''.join(f'[{label}]' for label in inputs)
+        ffmpeg_cmd.extend([
+            '-filter_complex', ';'.join([split, f'[main]{scale or "null"}[v]'] + chains),
+            '-map', '[v]', '-map', '0:a:0?'
+        ])
+    elif scale:
+        ffmpeg_cmd.extend(['-vf', scale])
+
+    # Add quality and audio settings
+    ffmpeg_cmd.extend([
+        '-maxrate', scaled_rate(res_setting['bitrate'], encoding['maxrate_scale']),
+        '-bufsize', scaled_rate(res_setting['bufsize'], encoding['maxrate_scale']),
+        '-crf', str(encoding['crf']),
+    ] + audio_codec_args(encoding))
+
+    # Add HLS settings
+    ffmpeg_cmd.extend(hls_args(encoding, stream_dir, Path(stream_dir) / playlist_name, segment_prefix))
+    if thumbnail_prefix:
+        ffmpeg_cmd.extend(thumbnail_outputs(stream_dir, thumbnail_prefix, poster_at is not None, duration))
+    return ffmpeg_cmd
+
+
+def build_remux_command(source, stream_dir, copy_audio, encoding=None):
+    """FFmpeg command segmenting ``source`` into ``stream_dir/playlist.m3u8`` without re-encoding its video.
+
+    Segments can only be cut at the source's keyframes, so their length
+    follows its GOP. Unless ``copy_audio``, the audio is encoded as usual.
+    """
+    encoding = encoding or DEFAULT_ENCODING
+    ffmpeg_cmd = ['ffmpeg', '-y', '-i', str(source), '-map', '0:v:0', '-map', '0:a:0?', '-c:v', 'copy']
+    ffmpeg_cmd.extend(['-c:a', 'copy'] if copy_audio else audio_codec_args(encoding))
+    ffmpeg_cmd.extend(hls_args(encoding, stream_dir, Path(stream_dir) / 'playlist.m3u8'))
+    return ffmpeg_cmd
+
+
+def build_thumbnail_command(source, stream_dir, poster_at=None):
+    """FFmpeg command writing only the scrub thumbnails (and poster) of ``source``.
+
+    For outputs that copy the video, so there is no encode to share a decode
+    with. Only keyframes are decoded.
+    """
+    inputs, chains = thumbnail_filters(poster_at)
+    split = f"[0:v]split={len(inputs)}" + ''.join(f'[{label}]' for label in inputs)
+    return (
+        ['ffmpeg', '-y', '-skip_frame', 'nokey', '-i', str(source), '-filter_complex', ';'.join([split] + chains)]
+        + thumbnail_outputs(stream_dir, poster=poster_at is not None)
+    )
+
+
+def build_abr_command(source, stream_dir, source_height, has_audio, encoding=None, thumbnails=False, poster_at=None):
+    """FFmpeg command that decodes ``source`` once and encodes every ladder rung.
+
+    Each rung lands in ``stream_dir/<rung>/playlist.m3u8`` and is listed in
+    ``stream_dir/master.m3u8``. With ``thumbnails`` the same decode also
+    writes scrub thumbnails and a poster next to the master playlist.
+    """
+    encoding = encoding or DEFAULT_ENCODING
+    rungs = abr_rungs(source_height)
+    inputs, chains = thumbnail_filters(poster_at) if thumbnails else ([], [])
+    split = f"[0:v]split={len(rungs) + len(inputs)}" + ''.join(f'[s{i}]' for i in range(len(rungs)))
+    split += ''.join(f'[{label}]' for label in inputs)
+    scales = [f"[s{i}]{_scale_filter(RESOLUTION_SETTINGS[rung]['size'])}[v{i}]" for i, rung in enumerate(rungs)]
+
+    ffmpeg_cmd = ['ffmpeg', '-y', '-i', str(source), '-filter_complex', ';'.join([split] + scales + chains)]
+    stream_map = []
+    for i, rung in enumerate(rungs):
+        ffmpeg_cmd.extend(['-map', f'[v{i}]'])
+        if has_audio:
+            ffmpeg_cmd.extend(['-map', '0:a:0'])
+        stream_map.append(f'v:{i},a:{i},name:{rung}' if has_audio else f'v:{i},name:{rung}')
+
+    ffmpeg_cmd.extend(video_codec_args(encoding) + ['-crf', str(encoding['crf'])])
+    for i, rung in enumerate(rungs):
+        ffmpeg_cmd.extend([
+            f'-maxrate:v:{i}', scaled_rate(RESOLUTION_SETTINGS[rung]['bitrate'], encoding['maxrate_scale']),
+            f'-bufsize:v:{i}', scaled_rate(RESOLUTION_SETTINGS[rung]['bufsize'], encoding['maxrate_scale']),
+        ])
+    if has_audio:
+        ffmpeg_cmd.extend(audio_codec_args(encoding))
+
+    ffmpeg_cmd.extend(['-master_pl_name', 'master.m3u8', '-var_stream_map', ' '.join(stream_map)])
+    ffmpeg_cmd.extend(hls_args(encoding, Path(stream_dir) / '%v', Path(stream_dir) / '%v' / 'playlist.m3u8'))
+    if thumbnails:
+        ffmpeg_cmd.extend(thumbnail_outputs(stream_dir, poster=poster_at is not None))
+    return ffmpeg_cmd
+
+
+def _parse_progress(block):
+    """``(seconds, fps, speed)`` from one ``-progress`` key=value block."""
+    def number(value):
+        try:
+            return float(value.rstrip('x'))
+        except (AttributeError, ValueError):
+            return None
+    out_time_us = number(block.get('out_time_us') or block.get('out_time_ms'))
+    return (out_time_us / 1e6 if out_time_us is not None else None), number(block.get('fps')), number(block.get('speed'))
+
+
+async def _watch_progress(process, on_progress, timeout, stall_timeout):
+    """Consume ``-progress pipe:1`` output until FFmpeg exits, enforcing both timeouts."""
+    deadline = time.monotonic() + timeout
+    block = {}
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TranscodeError("Video processing timed out")
+        try:
+            line = await asyncio.wait_for(process.stdout.readline(), min(stall_timeout, remaining))
+        except asyncio.TimeoutError:
+            if time.monotonic() >= deadline:
+                raise TranscodeError("Video processing timed out")
+            raise TranscodeError(f"Video processing stalled: no progress for {stall_timeout} seconds")
+        if not line:
+            return  # FFmpeg closed its end: it is exiting
+        key, _, value = line.decode(errors='replace').strip().partition('=')
+        block[key] = value
+        if key == 'progress':
+            if on_progress:
+                # Reporters write to the database, which must not happen on the event loop
+                await asyncio.to_thread(on_progress, *_parse_progress(block))
+            block = {}
+
+
+async def arun_ffmpeg(ffmpeg_cmd, timeout=7200, on_progress=None, stall_timeout=None):
+    """Run an FFmpeg command as an asyncio subprocess and return the tail of its stderr log.
+
+    Progress is read incrementally from ``-progress pipe:1`` and passed to
+    ``on_progress(seconds_done, fps, speed)`` (in a thread); stderr goes to a
+    temporary file rather than memory. Raises TranscodeError if FFmpeg fails,
+    runs longer than ``timeout`` or reports no progress for ``stall_timeout``
+    seconds. FFmpeg is killed if the awaiting task is cancelled.
+    """
+    stall_timeout = stall_timeout or getattr(settings, 'TRANSCODE_STALL_TIMEOUT', 300)
+    ffmpeg_cmd = [ffmpeg_cmd[0], '-progress', 'pipe:1', '-nostats'] + list(ffmpeg_cmd[1:])
+    logger.debug("Running FFmpeg command: %s", ' '.join(ffmpeg_cmd))
+
+    # Set up environment with necessary paths
+    env = os.environ.copy()
+    env['PATH'] = '/usr/local/bin:/usr/bin:/bin:' + env.get('PATH', '')
+
+    with tempfile.TemporaryFile() as log:
+        process = await asyncio.create_subprocess_exec(
+            *ffmpeg_cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=log,
+            env=env
+        )
+        try:
+            await _watch_progress(process, on_progress, timeout, stall_timeout)
+            await asyncio.wait_for(process.wait(), max(1, stall_timeout))
+        except (TranscodeError, asyncio.TimeoutError, asyncio.CancelledError) as e:
+            logger.warning("Killing FFmpeg process %s: %s", process.pid, str(e) or type(e).__name__)
+            process.kill()
+            await process.wait()
+            if isinstance(e, asyncio.TimeoutError):
+                raise TranscodeError("Video processing stalled while exiting")
+            raise
+
+        log.seek(0, os.SEEK_END)
+        log.seek(max(0, log.tell() - LOG_TAIL_BYTES))
+        stderr = log.read().decode(errors='replace')
+
+    if process.returncode != 0:
+        logger.error("FFmpeg returned %s: %s", process.returncode, stderr[-2000:])
+        raise TranscodeError(f"Video processing failed: {stderr}")
+    return stderr
+
+
+def run_ffmpeg(ffmpeg_cmd, timeout=7200, on_progress=None, stall_timeout=None):
+    """Blocking ``arun_ffmpeg`` for callers outside an event loop."""
+    return asyncio.run(arun_ffmpeg(ffmpeg_cmd, timeout, on_progress, stall_timeout))
@@ -0,0 +1,46 @@
+"""Streaming SHA-256 digests of source files, used to deduplicate uploads."""
+import hashlib
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Running digests of in-progress chunked uploads in this process: id -> (offset, hasher)
+_upload_hashers = {}
+
+
+def file_sha256(path):
+    """Digest of a file already on disk, read in HASH_BLOCK_SIZE blocks."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def upload_hasher(upload):
+    """The running digest of ``upload`` covering exactly its committed bytes.
+
+    Normally the hasher is fed as chunks arrive. When a resumed upload lands
+    on a process that has not seen it before, the committed prefix is read
+    back once to rebuild the digest.
+    """
+    offset, hasher = _upload_hashers.get(upload.pk, (None, None))
+    if offset != upload.offset:
+        hasher = hashlib.sha256()
+        if upload.offset:
+            with open(upload.temp_path, 'rb') as f:
+                remaining = upload.offset
+                while remaining:
+                    block = f.read(min(HASH_BLOCK_SIZE, remaining))
+                    if not block:
+                        break
+                    hasher.update(block)
+                    remaining -= len(block)
+    return hasher
+
+
+def remember_upload_hasher(upload, hasher):
+    _upload_hashers[upload.pk] = (upload.offset, hasher)
+
+
+def forget_upload_hasher(upload):
+    _upload_hashers.pop(upload.pk, None)
@@ -0,0 +1,148 @@
+"""Bulk ingest of source files already on the server (``manage.py ingest_videos``).
+
+Files are validated with the same rules as an upload (extension, size,
+duration), placed under MEDIA_ROOT/video/<yy>/ by hard link where possible,
+and inserted as ``Video`` rows with their encode jobs in one batch. Sources
+identical to an existing video reuse its output instead of being encoded.
+"""
+import os
+import shutil
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .hashing import file_sha256
+from .models import VALID_VIDEO_EXTENSIONS, TranscodeJob, Video
+from .probe import metadata_from_probe, probe_key, run_ffprobe
+from .search import index_videos
+
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+class IngestRejected(Exception):
+    """Raised when a source file fails validation."""
+
+
+def discover_sources(root):
+    """Video files under ``root``, by extension, in a stable order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1].lower() in VALID_VIDEO_EXTENSIONS:
+                yield Path(dirpath) / name
+
+
+def validate_source(path):
+    """Probe and hash ``path``; return its metadata or raise IngestRejected.
+
+    Safe to run in worker threads: it touches only the file, never the database.
+    """
+    size = path.stat().st_size
+    if size > Video.MAX_VIDEO_SIZE_MB * 1024 * 1024:
+        raise IngestRejected(f'Video size cannot exceed {Video.MAX_VIDEO_SIZE_MB}MB')
+    try:
+        metadata = metadata_from_probe(run_ffprobe(path))
+    except (subprocess.SubprocessError, ValueError, OSError) as e:
+        raise IngestRejected(f'Could not probe video: {e}')
+    if not metadata['width']:
+        raise IngestRejected('No video stream found')
+    if metadata['duration'] and metadata['duration'] > Video.MAX_DURATION_SECONDS:
+        raise IngestRejected('Video duration cannot exceed 10 minutes')
+    return {'path': path, 'size': size, 'sha256': file_sha256(path), 'metadata': metadata}
+
+
+def place_source(path, copy=False):
+    """Hard-link (or copy) ``path`` into MEDIA_ROOT/video/<yy>/ and return its storage name.
+
+    Destinations are created exclusively, so concurrent placements of files
+    with the same name never overwrite each other.
+    """
+    while True:
+        name = default_storage.get_available_name(f"video/{datetime.now().strftime('%y')}/{path.name}")
+        destination = Path(default_storage.path(name))
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            if not copy:
+                try:
+                    os.link(path, destination)
+                    return name
+                except FileExistsError:
+                    raise
+                except OSError:
+                    copy = True  # different filesystem, or links not supported
+            with open(path, 'rb') as src, open(destination, 'xb') as dst:
+                shutil.copyfileobj(src, dst, COPY_BLOCK_SIZE)
+            shutil.copystat(path, destination)
+            return name
+        except FileExistsError:
+            continue  # taken by a concurrent placement; pick another name
+
+
+def build_video(source, target_resolution, profile, settings_key):
+    """An unsaved ``Video`` for a validated source; ``settings_key`` is the profile's (see ``Video.settings_key``)."""
+    video = Video(
+        caption=source['path'].stem[:100],
+        target_resolution=target_resolution,
+        encoding_profile=profile,
+        settings_key=settings_key,
+        source_sha256=source['sha256'],
+        source_bytes=source['size'],
+        status=Video.STATUS_QUEUED,
+    )
+    for name, value in source['metadata'].items():
+        setattr(video, name, value)
+    return video
+
+
+def ingest_batch(sources, target_resolution, profile, priority, pool, copy=False):
+    """Save validated ``sources`` as videos and queue one ingest job per distinct source.
+
+    Sources with a finished encode of the same settings take over its output
+    and are never copied; those whose source is queued or running (in the
+    database or earlier in this batch) wait for it, as in ``Video.save()``.
+    New files are placed on ``pool``. Returns the saved videos.
+    """
+    videos, to_place, to_encode, seen = [], [], [], set()
+    settings_key = Video(encoding_profile=profile).current_settings_key()
+    for source in sources:
+        video = build_video(source, target_resolution, profile, settings_key)
+        original = video.find_duplicate()
+        if original:
+            video.video = original.video.name
+            video.reuse_output_of(original)
+        else:
+            to_place.append((video, source['path']))
+            key = video.output_key()
+            if key not in seen and not video.find_duplicate([Video.STATUS_QUEUED, Video.STATUS_RUNNING]):
+                to_encode.append(video)
+            seen.add(key)
+        videos.append(video)
+
+    names = pool.map(lambda path: place_source(path, copy), [path for _, path in to_place])
+    for (video, _), name in zip(to_place, names):
+        video.video = name
+        video.probe_key = probe_key(video.video.path)
+
+    try:
+        with transaction.atomic():
+            Video.objects.bulk_create(videos)
+            if any(video.pk is None for video, _ in to_place):
+                # Backends that cannot return primary keys from a bulk insert
+                placed = [video.video.name for video, _ in to_place]
+                pks = dict(Video.objects.filter(video__in=placed).values_list('video', 'pk'))
+                for video, _ in to_place:
+                    video.pk = pks[video.video.name]
+            TranscodeJob.objects.bulk_create([
+                TranscodeJob(video=video, kind=TranscodeJob.KIND_INGEST, priority=priority) for video in to_encode
+            ])
+            # bulk_create sends no post_save, so the captions are indexed here
+            index_videos(videos)
+    except Exception:
+        for video, _ in to_place:
+            default_storage.delete(video.video.name)
+        raise
+    return videos
@@ -0,0 +1,207 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .admission import claim_lock, encode_deferred, saturated_users
+from .metrics import record
+from .models import TranscodeJob, Video
+from .progress import ProgressReporter
+from .transcode import transcode_video
+
+logger = logging.getLogger(__name__)
+
+# Live progress of a claim, cleared when its job goes back on the queue so the
+# next claim is neither shown with the old numbers nor judged stale by them
+PROGRESS_RESET = {'progress': 0, 'fps': None, 'speed': None, 'eta_seconds': None, 'progress_at': None}
+
+
+def saturated_kinds():
+    """Job kinds that already have as many running jobs as TRANSCODE_KIND_LIMITS allows."""
+    limits = getattr(settings, 'TRANSCODE_KIND_LIMITS', {})
+    if not limits:
+        return []
+    running = dict(
+        TranscodeJob.objects.filter(status=Video.STATUS_RUNNING, kind__in=limits)
+        .order_by()
+        .values_list('kind')
+        .annotate(count=Count('pk'))
+    )
+    return [kind for kind, limit in limits.items() if running.get(kind, 0) >= limit]
+
+
+def claim_next_job():
+    """Atomically move the next queued job to running and return it, or None.
+
+    Jobs are taken by priority, then age, skipping kinds at their
+    TRANSCODE_KIND_LIMITS cap and uploaders at TRANSCODE_MAX_RUNNING_PER_USER.
+    Nothing is claimed while ``video.admission`` defers new encodes. Claims
+    are serialized by ``claim_lock``, so the limits hold across workers; the
+    conditional UPDATE keeps a job from being claimed twice without relying
+    on SELECT ... FOR UPDATE (unsupported on SQLite).
+    """
+    with claim_lock():
+        reason = encode_deferred()
+        if reason:
+            logger.debug("Deferring encodes: %s", reason)
+            return None
+        while True:
+            queued = (
+                TranscodeJob.objects.filter(status=Video.STATUS_QUEUED)
+                .exclude(kind__in=saturated_kinds())
+                .exclude(video__uploaded_by__in=saturated_users())
+            )
+            job = queued.order_by('-priority', 'created_at', 'pk').first()
+            if job is None:
+                return None
+            claimed = TranscodeJob.objects.filter(pk=job.pk, status=Video.STATUS_QUEUED).update(
+                status=Video.STATUS_RUNNING,
+                started_at=timezone.now(),
+                attempts=job.attempts + 1
+            )
+            if claimed:
+                Video.objects.filter(pk=job.video_id).update(status=Video.STATUS_RUNNING)
+                job.refresh_from_db()
+                return job
+
+
+def requeue_stale_jobs(older_than):
+    """Put jobs left running by a crashed worker back on the queue.
+
+    A job is stale when it has reported no progress (or, before its first
+    report, not started) within ``older_than`` seconds.
+    """
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    stale = TranscodeJob.objects.filter(
+        Q(progress_at__lt=cutoff) | Q(progress_at__isnull=True, started_at__lt=cutoff),
+        status=Video.STATUS_RUNNING
+    )
+    video_ids = list(stale.values_list('video_id', flat=True))
+    count = stale.update(status=Video.STATUS_QUEUED, started_at=None, **PROGRESS_RESET)
+    Video.objects.filter(pk__in=video_ids).update(status=Video.STATUS_QUEUED)
+    return count
+
+
+def requeue_job(job_id, error='', attempted=True):
+    """Hand a claimed job back to the queue because its worker process was lost. Returns its new status.
+
+    An ``attempted`` job that has used up TRANSCODE_MAX_ATTEMPTS fails
+    instead, so a source that crashes the encoder is not retried forever.
+    Otherwise the claim is undone without counting as an attempt.
+    """
+    job = TranscodeJob.objects.get(pk=job_id)
+    if job.status != Video.STATUS_RUNNING:
+        return job.status  # the outcome was recorded before the process went
+    if attempted and job.attempts >= getattr(settings, 'TRANSCODE_MAX_ATTEMPTS', 3):
+        finish_job(job, Video.STATUS_FAILED, error)
+        return Video.STATUS_FAILED
+    with transaction.atomic():
+        TranscodeJob.objects.filter(pk=job.pk, status=Video.STATUS_RUNNING).update(
+            status=Video.STATUS_QUEUED,
+            started_at=None,
+            error=error,
+            attempts=job.attempts if attempted else max(job.attempts - 1, 0),
+            **PROGRESS_RESET
+        )
+        Video.objects.filter(pk=job.video_id).update(status=Video.STATUS_QUEUED)
+    return Video.STATUS_QUEUED
+
+
+def run_job(job_id):
+    """Encode the video of an already claimed job and record the outcome."""
+    close_old_connections()
+    job = TranscodeJob.objects.select_related('video').get(pk=job_id)
+    video = job.video
+    record('queue', video, (job.started_at - job.created_at).total_seconds(), job.created_at, job)
+    try:
+        transcode_video(
+            video,
+            progress=ProgressReporter(job.pk, video.duration),
+            # Re-encodes go to a fresh directory; the current output stays playable until the swap
+            version=job.pk if job.kind == TranscodeJob.KIND_REPROCESS else None
+        )
+    except Exception as e:
+        logger.exception("Error processing video %s", video.pk)
+        status, error = Video.STATUS_FAILED, str(e)
+    else:
+        status, error = Video.STATUS_DONE, ''
+
+    finish_job(job, status, error)
+    close_old_connections()
+    return status
+
+
+def queue_reprocess(videos, priority=None):
+    """Queue a re-encode of each of ``videos`` that has a source and no queued or running job.
+
+    Videos without a playable output are queued one priority step ahead of
+    the rest. Returns the number of jobs created.
+    """
+    priority = priority if priority is not None else getattr(settings, 'REPROCESS_PRIORITY', -5)
+    jobs = []
+    with transaction.atomic():
+        # Videos whose source the storage lifecycle deleted cannot be encoded again
+        candidates = videos.exclude(source_state=Video.SOURCE_DELETED)
+        for video in candidates.exclude(jobs__status__in=[Video.STATUS_QUEUED, Video.STATUS_RUNNING]).distinct():
+            jobs.append(TranscodeJob(
+                video=video,
+                kind=TranscodeJob.KIND_REPROCESS,
+                priority=priority if video.processed_video else priority + 1
+            ))
+        TranscodeJob.objects.bulk_create(jobs)
+        Video.objects.filter(pk__in=[job.video_id for job in jobs]).update(status=Video.STATUS_QUEUED)
+    return len(jobs)
+
+
+def finish_job(job, status, error=''):
+    """Record the final state of ``job`` on the job row and on its video."""
+    progress = {'progress': 100, 'eta_seconds': 0} if status == Video.STATUS_DONE else {}
+    with transaction.atomic():
+        TranscodeJob.objects.filter(pk=job.pk).update(
+            status=status,
+            error=error,
+            finished_at=timezone.now(),
+            **progress
+        )
+        Video.objects.filter(pk=job.video_id).update(status=status)
+        resolve_duplicates(Video.objects.get(pk=job.video_id))
+
+
+def resolve_duplicates(video):
+    """Settle queued uploads of the same source that waited for ``video``'s encode.
+
+    On success they share its output; on failure the oldest of them gets its
+    own job and the rest keep waiting on that one.
+    """
+    if not video.source_sha256:
+        return
+    waiting = (
+        Video.objects
+        .filter(
+            source_sha256=video.source_sha256,
+            target_resolution=video.target_resolution,
+            encoding_profile=video.encoding_profile_id,
+            settings_key=video.settings_key,
+            force_encode=video.force_encode,
+            status=Video.STATUS_QUEUED
+        )
+        .exclude(pk=video.pk)
+        .exclude(jobs__status__in=[Video.STATUS_QUEUED, Video.STATUS_RUNNING])
+        .order_by('pk')
+    )
+    if video.status == Video.STATUS_DONE and video.processed_video:
+        for duplicate in waiting:
+            duplicate.reuse_output_of(video)
+            duplicate.save()
+    elif video.status == Video.STATUS_FAILED:
+        leader = waiting.first()
+        if leader:
+            last_job = video.jobs.order_by('-created_at').first()
+            TranscodeJob.objects.create(
+                video=leader,
+                kind=last_job.kind if last_job else TranscodeJob.KIND_UPLOAD,
+                priority=last_job.priority if last_job else 0
+            )
@@ -0,0 +1,300 @@
+"""Storage lifecycle: retention of sources and renditions (``manage.py storage_lifecycle``).
+
+Three policies free disk space once videos are encoded:
+
+* source retention: SOURCE_RETENTION_DAYS after the last successful encode
+  the source is deleted, or re-encoded to a smaller mezzanine with
+  SOURCE_RETENTION_ACTION = 'compress' so reprocessing stays possible.
+  Sources are kept forever while SOURCE_RETENTION_DAYS is None, the default;
+* cold renditions: adaptive outputs not played for COLD_AFTER_DAYS lose the
+  renditions above COLD_MAX_RENDITION, and their master playlist is
+  rewritten without them. Off while COLD_AFTER_DAYS is None, the default;
+* watermark: while less than STORAGE_MIN_FREE_PERCENT of the filesystem is
+  free, the same steps are taken early for the least recently viewed
+  videos until the shortfall is covered (sources only when a retention
+  period is set).
+
+Deduplicated videos share one source file and one output directory, so every
+action works on the whole group, and a source is only touched once every
+video using it has a finished encode.
+"""
+import logging
+import os
+import re
+import shutil
+from collections import namedtuple
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .ffmpeg import RESOLUTION_SETTINGS, run_ffmpeg
+from .metrics import tree_size
+from .models import Video
+
+logger = logging.getLogger(__name__)
+
+DELETE_SOURCE = 'delete_source'
+COMPRESS_SOURCE = 'compress_source'
+DROP_RENDITIONS = 'drop_renditions'
+
+# ``target`` is the source's storage name or the output directory relative to MEDIA_ROOT;
+# ``bytes`` is what the action frees (None when it cannot be known up front)
+Action = namedtuple('Action', ['kind', 'target', 'video_ids', 'bytes', 'reason'])
+
+STREAM_INF_RE = re.compile(r'RESOLUTION=\d+x(\d+)')
+
+
+def output_dir(video):
+    """Directory of ``video``'s HLS output relative to MEDIA_ROOT, or None."""
+    path = video.output_path()
+    return path.rsplit('/', 1)[0] if path else None
+
+
+def refresh_sizes(videos):
+    """Fill in ``source_bytes`` and ``output_bytes`` from disk. Returns the number of videos updated."""
+    media_root = Path(settings.MEDIA_ROOT)
+    sizes = {}
+    updated = 0
+    for video in videos.only('pk', 'video', 'processed_video', 'source_state').iterator():
+        source = media_root / video.video.name if video.video else None
+        source_bytes = source.stat().st_size if source and source.is_file() else None
+        directory = output_dir(video)
+        if directory not in sizes:
+            sizes[directory] = tree_size(media_root / directory) if directory else None
+        Video.objects.filter(pk=video.pk).update(source_bytes=source_bytes, output_bytes=sizes[directory])
+        updated += 1
+    return updated
+
+
+def disk_usage():
+    """``(total, free)`` bytes of the filesystem holding MEDIA_ROOT."""
+    usage = shutil.disk_usage(settings.MEDIA_ROOT)
+    return usage.total, usage.free
+
+
+def _source_groups():
+    """One row per source file whose videos all have a finished encode, least recently viewed first."""
+    return (
+        Video.objects.exclude(video='').exclude(source_state=Video.SOURCE_DELETED)
+        .order_by().values('video')
+        .annotate(
+            videos=Count('pk'),
+            unfinished=Count('pk', filter=~Q(status=Video.STATUS_DONE) | Q(processed_video__isnull=True) | Q(processed_video='')),
+            state=Max('source_state'),
+            size=Max('source_bytes'),
+            encoded=Max(Coalesce('encoded_at', 'created_at')),
+            viewed=Max(Coalesce('last_viewed_at', 'encoded_at', 'created_at')),
+        )
+        .filter(unfinished=0)
+        .order_by('viewed', '-size')
+    )
+
+
+def _output_groups():
+    """One row per adaptive output directory, least recently viewed first."""
+    return (
+        Video.objects.filter(status=Video.STATUS_DONE, processed_video__endswith='/master.m3u8')
+        .order_by().values('processed_video')
+        .annotate(viewed=Max(Coalesce('last_viewed_at', 'encoded_at', 'created_at')))
+        .order_by('viewed')
+    )
+
+
+def _droppable(stream_dir, max_height):
+    """Renditions of the master playlist in ``stream_dir`` taller than ``max_height``, and their size.
+
+    The lowest rendition is always kept.
+    """
+    master = stream_dir / 'master.m3u8'
+    if not master.is_file():
+        return [], 0
+    renditions = []
+    lines = master.read_text().splitlines()
+    for i, line in enumerate(lines):
+        match = STREAM_INF_RE.search(line) if line.startswith('#EXT-X-STREAM-INF') else None
+        if match and i + 1 < len(lines):
+            renditions.append((int(match.group(1)), lines[i + 1].split('/', 1)[0]))
+    drop = [name for height, name in renditions if height > max_height]
+    if drop and len(drop) == len(renditions):
+        drop = [name for height, name in sorted(renditions)[1:]]
+    return drop, sum(tree_size(stream_dir / name) for name in drop)
+
+
+def _cold_max_height():
+    size = RESOLUTION_SETTINGS[getattr(settings, 'COLD_MAX_RENDITION', '720p')]['size']
+    return int(size.split('x')[1])
+
+
+def _source_action(group, kind, reason):
+    ids = list(Video.objects.filter(video=group['video']).values_list('pk', flat=True))
+    return Action(kind, group['video'], ids, group['size'] if kind == DELETE_SOURCE else None, reason)
+
+
+def _rendition_action(group, max_height, reason):
+    directory = Video(processed_video=group['processed_video']).output_path().rsplit('/', 1)[0]
+    drop, size = _droppable(Path(settings.MEDIA_ROOT) / directory, max_height)
+    if not drop:
+        return None
+    ids = list(Video.objects.filter(processed_video=group['processed_video']).values_list('pk', flat=True))
+    return Action(DROP_RENDITIONS, directory, ids, size, reason)
+
+
+def plan(now=None):
+    """Actions the configured policies call for now, retention first, then watermark eviction."""
+    now = now or timezone.now()
+    actions, planned = [], set()
+    max_height = _cold_max_height()
+
+    retention = getattr(settings, 'SOURCE_RETENTION_DAYS', None)
+    if retention is not None:
+        kind = COMPRESS_SOURCE if getattr(settings, 'SOURCE_RETENTION_ACTION', 'delete') == 'compress' else DELETE_SOURCE
+        due = _source_groups().filter(encoded__lt=now - timedelta(days=retention))
+        if kind == COMPRESS_SOURCE:
+            due = due.filter(state=Video.SOURCE_ORIGINAL)
+        for group in due:
+            actions.append(_source_action(group, kind, f'encoded over {retention} days ago'))
+            planned.add(group['video'])
+
+    cold_after = getattr(settings, 'COLD_AFTER_DAYS', None)
+    if cold_after is not None:
+        for group in _output_groups().filter(viewed__lt=now - timedelta(days=cold_after)):
+            action = _rendition_action(group, max_height, f'not viewed for {cold_after} days')
+            if action:
+                actions.append(action)
+                planned.add(action.target)
+
+    # Watermark: free space counts what the actions above will free
+    total, free = disk_usage()
+    shortfall = total * getattr(settings, 'STORAGE_MIN_FREE_PERCENT', 10) / 100 - free
+    shortfall -= sum(action.bytes or 0 for action in actions)
+    if shortfall > 0:
+        # Sources are only evicted where deleting them was opted into
+        for group in _source_groups() if retention is not None else []:
+            if shortfall <= 0:
+                break
+            if group['video'] in planned or not group['size']:
+                continue
+            actions.append(_source_action(group, DELETE_SOURCE, 'free space below watermark'))
+            shortfall -= group['size']
+        for group in _output_groups():
+            if shortfall <= 0:
+                break
+            action = _rendition_action(group, max_height, 'free space below watermark')
+            if action and action.target not in planned:
+                actions.append(action)
+                shortfall -= action.bytes
+    return actions
+
+
+def _lock_source_group(name):
+    """The videos using source ``name``, locked, or None if one of them still needs the file."""
+    videos = list(Video.objects.select_for_update().filter(video=name))
+    if not videos or any(
+        v.status != Video.STATUS_DONE or not v.processed_video or v.source_state == Video.SOURCE_DELETED
+        for v in videos
+    ):
+        return None
+    return videos
+
+
+def delete_source(name):
+    """Delete source file ``name`` if every video using it is encoded. Returns the bytes freed."""
+    path = Path(settings.MEDIA_ROOT) / name
+    with transaction.atomic():
+        if _lock_source_group(name) is None:
+            return 0
+        # Marked first: a crash in between leaves a stray file, never a video pointing at a missing source
+        Video.objects.filter(video=name).update(source_state=Video.SOURCE_DELETED, source_bytes=None)
+    size = path.stat().st_size if path.is_file() else 0
+    path.unlink(missing_ok=True)
+    logger.info("Deleted source %s (%d bytes)", name, size)
+    return size
+
+
+def compress_source(name):
+    """Re-encode source ``name`` to a smaller H.264/AAC mezzanine. Returns the bytes freed.
+
+    The original is only replaced if the result is smaller; either way the
+    group is marked compressed so it is not tried again. Sources that are
+    already mezzanines are left alone.
+    """
+    if Video.objects.filter(video=name).exclude(source_state=Video.SOURCE_ORIGINAL).exists():
+        return 0
+    media_root = Path(settings.MEDIA_ROOT)
+    path = media_root / name
+    stem = path.with_name(f'{path.stem}_mezz').relative_to(media_root).as_posix()
+    partial = Path(default_storage.path(default_storage.get_available_name(f'{stem}.part.mp4')))
+    run_ffmpeg([
+        'ffmpeg', '-y', '-i', str(path), '-map', '0:v:0', '-map', '0:a:0?',
+        '-c:v', 'libx264', '-preset', 'slow', '-crf', str(getattr(settings, 'SOURCE_COMPRESS_CRF', 20)),
+        '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-b:a', '192k', '-movflags', '+faststart', str(partial)
+    ])
+    old_size, new_size = path.stat().st_size, partial.stat().st_size
+    with transaction.atomic():
+        videos = _lock_source_group(name)
+        if videos is None or any(v.source_state != Video.SOURCE_ORIGINAL for v in videos):
+            partial.unlink(missing_ok=True)
+            return 0
+        if new_size >= old_size:
+            partial.unlink()
+            Video.objects.filter(video=name).update(source_state=Video.SOURCE_COMPRESSED)
+            return 0
+        # Never over another file that happens to have the mezzanine's name
+        target = default_storage.get_available_name(f'{stem}.mp4')
+        os.rename(partial, default_storage.path(target))
+        Video.objects.filter(video=name).update(
+            video=target, source_state=Video.SOURCE_COMPRESSED, source_bytes=new_size, probe_key=''
+        )
+    path.unlink(missing_ok=True)
+    logger.info("Compressed source %s from %d to %d bytes", name, old_size, new_size)
+    return old_size - new_size
+
+
+def drop_renditions(directory, max_height=None):
+    """Remove the renditions of output ``directory`` taller than ``max_height``. Returns the bytes freed.
+
+    The master playlist is rewritten (atomically) before any segment is
+    deleted, so new players only ever see renditions that exist.
+    """
+    stream_dir = Path(settings.MEDIA_ROOT) / directory
+    drop, size = _droppable(stream_dir, max_height or _cold_max_height())
+    if not drop:
+        return 0
+    master = stream_dir / 'master.m3u8'
+    rewritten, pending = [], None
+    for line in master.read_text().splitlines():
+        if line.startswith('#EXT-X-STREAM-INF'):
+            pending = line
+            continue
+        if pending is not None:
+            # The URI line following an #EXT-X-STREAM-INF tag names the rendition
+            if line.split('/', 1)[0] not in drop:
+                rewritten.extend([pending, line])
+            pending = None
+            continue
+        rewritten.append(line)
+    partial = master.with_name('master.m3u8.part')
+    partial.write_text('\n'.join(rewritten).rstrip('\n') + '\n')
+    os.replace(partial, master)
+    for name in drop:
+        shutil.rmtree(stream_dir / name, ignore_errors=True)
+
+    url = f"{settings.MEDIA_URL.rstrip('/')}/{directory}/master.m3u8"
+    Video.objects.filter(processed_video=url, output_bytes__isnull=False).update(output_bytes=F('output_bytes') - size)
+    logger.info("Dropped renditions %s of %s (%d bytes)", ', '.join(drop), directory, size)
+    return size
+
+
+def apply(action):
+    """Carry out one planned ``Action``. Returns the bytes freed."""
+    if action.kind == DELETE_SOURCE:
+        return delete_source(action.target)
+    if action.kind == COMPRESS_SOURCE:
+        return compress_source(action.target)
+    return drop_renditions(action.target)
@@ -0,0 +1,84 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from video.benchmark import compare, load_report, run_benchmarks, save_report
+from video.models import Video
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the transcode pipeline on synthetic sources and compare against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='640x360,1280x720,1920x1080',
+            help='Comma-separated source frame sizes'
+        )
+        parser.add_argument('--durations', default='10,60', help='Comma-separated source durations in seconds')
+        parser.add_argument(
+            '--targets', default='360p,720p,abr',
+            help='Comma-separated target resolutions (%s)' % ', '.join(value for value, _ in Video.RESOLUTION_CHOICES)
+        )
+        parser.add_argument('--quick', action='store_true', help='Only 1280x720, 10 s, 720p')
+        parser.add_argument('--repeat', type=int, default=1, help='Runs per scenario; the median is reported')
+        parser.add_argument(
+            '--cache-dir', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'sources'),
+            help='Where generated sources are kept between runs'
+        )
+        parser.add_argument(
+            '--output', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'latest.json'),
+            help='Where to write the JSON report'
+        )
+        parser.add_argument(
+            '--baseline', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'),
+            help='Report to compare against, if it exists'
+        )
+        parser.add_argument('--update-baseline', action='store_true', help='Store this run as the new baseline')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.10,
+            help='Fractional slowdown tolerated before a metric counts as a regression'
+        )
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error on regressions')
+
+    def handle(self, *args, **options):
+        if options['quick']:
+            sizes, durations, targets = ['1280x720'], [10], ['720p']
+        else:
+            sizes = options['sizes'].split(',')
+            durations = [int(d) for d in options['durations'].split(',')]
+            targets = options['targets'].split(',')
+        unknown = set(targets) - {value for value, _ in Video.RESOLUTION_CHOICES}
+        if unknown:
+            raise CommandError(f"Unknown target resolutions: {', '.join(sorted(unknown))}")
+
+        report = run_benchmarks(
+            options['cache_dir'], sizes, durations, targets, repeat=max(1, options['repeat']), log=self.stdout.write
+        )
+        save_report(report, options['output'])
+        self.stdout.write(f"Report written to {options['output']}")
+
+        baseline_path = Path(options['baseline'])
+        if options['update_baseline']:
+            save_report(report, baseline_path)
+            self.stdout.write(self.style.SUCCESS(f'Baseline updated: {baseline_path}'))
+            return
+        if not baseline_path.exists():
+            self.stdout.write('No baseline to compare against; store one with --update-baseline')
+            return
+
+        baseline = load_report(baseline_path)
+        if baseline.get('machine') != report['machine']:
+            self.stdout.write(self.style.WARNING('Baseline was recorded on a different machine or FFmpeg build'))
+        rows, regressions = compare(report, baseline, options['tolerance'])
+        for name, metric, old, new, change in rows:
+            line = f'{name:<28} {metric:<12} {old:>10.3f} -> {new:>10.3f} ({change:+.1%})'
+            self.stdout.write(self.style.ERROR(line) if (name, metric, old, new, change) in regressions else line)
+
+        if regressions:
+            message = f'{len(regressions)} metrics regressed by more than {options["tolerance"]:.0%}'
+            if options['fail_on_regression']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
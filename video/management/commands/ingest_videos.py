@@ -0,0 +1,128 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from video.ingest import IngestRejected, discover_sources, ingest_batch, validate_source
+from video.models import EncodingProfile, Video
+
+
+class Command(BaseCommand):
+    help = 'Validate every video file under a directory and queue them for transcoding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory searched recursively for source videos')
+        parser.add_argument(
+            '--target-resolution', default='720p', choices=[value for value, _ in Video.RESOLUTION_CHOICES]
+        )
+        parser.add_argument('--profile', help='Name of the EncodingProfile to use (default: the default profile)')
+        parser.add_argument(
+            '--workers', type=int, default=min(8, os.cpu_count() or 1),
+            help='Files probed, hashed and placed in parallel'
+        )
+        parser.add_argument('--batch-size', type=int, default=100, help='Videos inserted per transaction')
+        parser.add_argument(
+            '--priority', type=int, default=getattr(settings, 'INGEST_PRIORITY', -10),
+            help='Priority of the queued jobs; uploads use 0'
+        )
+        parser.add_argument('--copy', action='store_true', help='Always copy sources instead of hard-linking them')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only; write nothing')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Skip files recorded as ingested in the state file by an earlier run'
+        )
+        parser.add_argument(
+            '--state-file',
+            help='JSON-lines record of ingested files (default: .ingest_state.jsonl in the directory)'
+        )
+
+    def handle(self, *args, **options):
+        root = Path(options['directory']).resolve()
+        if not root.is_dir():
+            raise CommandError(f'{root} is not a directory')
+        profile = None
+        if options['profile']:
+            profile = EncodingProfile.objects.filter(name=options['profile']).first()
+            if profile is None:
+                raise CommandError(f"Unknown encoding profile {options['profile']!r}")
+
+        state_path = Path(options['state_file'] or root / '.ingest_state.jsonl')
+        done = self.load_state(state_path) if options['resume'] else set()
+        paths = [path for path in discover_sources(root) if str(path) not in done]
+        self.stdout.write(f'Found {len(paths)} files to ingest' + (f' ({len(done)} skipped)' if done else ''))
+
+        dry_run = options['dry_run']
+        counts = {'queued': 0, 'duplicate': 0, 'rejected': 0}
+        total_bytes = 0
+        started = time.monotonic()
+        state = None if dry_run else open(state_path, 'a' if options['resume'] else 'w')
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+                for i in range(0, len(paths), options['batch_size']):
+                    batch = paths[i:i + options['batch_size']]
+                    sources = []
+                    for path, result in zip(batch, pool.map(self.validate, batch)):
+                        if isinstance(result, IngestRejected):
+                            counts['rejected'] += 1
+                            self.stderr.write(f'Rejected {path}: {result}')
+                            if state:
+                                state.write(json.dumps({'path': str(path), 'result': 'rejected', 'error': str(result)}) + '\n')
+                        else:
+                            sources.append(result)
+                            total_bytes += result['size']
+                    if dry_run:
+                        counts['queued'] += len(sources)
+                        continue
+                    if not sources:
+                        continue
+
+                    videos = ingest_batch(
+                        sources, options['target_resolution'], profile, options['priority'], pool, options['copy']
+                    )
+                    for source, video in zip(sources, videos):
+                        result = 'duplicate' if video.status == Video.STATUS_DONE else 'queued'
+                        counts[result] += 1
+                        state.write(json.dumps({'path': str(source['path']), 'result': result, 'video': video.pk}) + '\n')
+                    state.flush()
+                    self.stdout.write(f'Ingested {min(i + len(batch), len(paths))}/{len(paths)} files')
+        finally:
+            if state:
+                state.close()
+
+        elapsed = time.monotonic() - started
+        processed = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would queue' if dry_run else 'Queued'} {counts['queued']}, "
+            f"{counts['duplicate']} duplicates, {counts['rejected']} rejected "
+            f"in {elapsed:.1f}s: {processed / elapsed if elapsed else 0:.1f} files/s, "
+            f"{total_bytes / 1024 / 1024 / elapsed if elapsed else 0:.1f} MB/s"
+        ))
+
+    @staticmethod
+    def validate(path):
+        try:
+            return validate_source(path)
+        except IngestRejected as e:
+            return e
+        except OSError as e:
+            return IngestRejected(str(e))
+
+    @staticmethod
+    def load_state(state_path):
+        """Paths an earlier run already turned into videos; rejected files are retried."""
+        if not state_path.exists():
+            return set()
+        done = set()
+        with open(state_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # partial line from an interrupted run
+                if entry.get('result') in ('queued', 'duplicate'):
+                    done.add(entry['path'])
+        return done
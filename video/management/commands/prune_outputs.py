@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from video.transcode import prune_unreferenced_outputs
+
+
+class Command(BaseCommand):
+    help = 'Delete HLS output directories that no video points at any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int,
+            default=getattr(settings, 'TRANSCODE_OUTPUT_GRACE_PERIOD', 24 * 60 * 60),
+            help='Only delete directories replaced at least this many seconds ago'
+        )
+
+    def handle(self, *args, **options):
+        removed = prune_unreferenced_outputs(options['older_than'])
+        self.stdout.write(f'Removed {removed} output directories')
@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Q
+
+from video.lifecycle import COMPRESS_SOURCE, apply, disk_usage, plan, refresh_sizes
+from video.models import Video
+from video.uploads import collect_stale_uploads
+
+
+def _size(n):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(n) < 1024:
+            return f'{n:.1f} {unit}'
+        n /= 1024
+    return f'{n:.1f} TB'
+
+
+class Command(BaseCommand):
+    help = 'Report reclaimable storage under the retention policies, and optionally reclaim it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apply', action='store_true', help='Carry out the planned actions')
+        parser.add_argument(
+            '--refresh-sizes', action='store_true',
+            help='Recount source and output bytes from disk first (for videos without them, or all with --all)'
+        )
+        parser.add_argument('--all', action='store_true', help='With --refresh-sizes, recount every video')
+
+    def handle(self, *args, **options):
+        if options['refresh_sizes']:
+            videos = Video.objects.all()
+            if not options['all']:
+                videos = videos.filter(
+                    Q(source_bytes__isnull=True, source_state__in=[Video.SOURCE_ORIGINAL, Video.SOURCE_COMPRESSED])
+                    | Q(output_bytes__isnull=True, processed_video__isnull=False)
+                )
+            self.stdout.write(f'Recounted sizes of {refresh_sizes(videos)} videos')
+
+        # Deduplicated videos share files, so each file is counted once
+        sources = (
+            Video.objects.exclude(source_state=Video.SOURCE_DELETED).order_by().values('video')
+            .annotate(size=Max('source_bytes'))
+        )
+        outputs = (
+            Video.objects.exclude(processed_video__isnull=True).exclude(processed_video='').order_by()
+            .values('processed_video').annotate(size=Max('output_bytes'))
+        )
+        total, free = disk_usage()
+        self.stdout.write(f"Sources: {len(sources)} files, {_size(sum(s['size'] or 0 for s in sources))}")
+        self.stdout.write(f"Outputs: {len(outputs)} directories, {_size(sum(o['size'] or 0 for o in outputs))}")
+        self.stdout.write(f'Free: {_size(free)} of {_size(total)} ({free / total:.1%})')
+
+        if options['apply']:
+            discarded = collect_stale_uploads()
+            if discarded:
+                self.stdout.write(f'Discarded {discarded} abandoned chunked uploads')
+
+        actions = plan()
+        if not actions:
+            self.stdout.write(self.style.SUCCESS('Nothing to reclaim'))
+            return
+        summary = {}
+        for action in actions:
+            count, size = summary.get((action.kind, action.reason), (0, 0))
+            summary[(action.kind, action.reason)] = (count + 1, size + (action.bytes or 0))
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {action.kind} {action.target} (videos {action.video_ids}): {action.reason}')
+        for (kind, reason), (count, size) in summary.items():
+            estimate = 'unknown' if kind == COMPRESS_SOURCE else _size(size)
+            self.stdout.write(f'{kind:<16} {count:>6} items {estimate:>12}  {reason}')
+        self.stdout.write(f"Reclaimable: {_size(sum(action.bytes or 0 for action in actions))}"
+                          + (' (plus compression savings)' if any(a.bytes is None for a in actions) else ''))
+
+        if not options['apply']:
+            self.stdout.write('Run with --apply to reclaim it')
+            return
+        freed = 0
+        for action in actions:
+            try:
+                freed += apply(action)
+            except Exception as e:
+                self.stderr.write(f'{action.kind} {action.target} failed: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Freed {_size(freed)}'))
@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from video.vod_sync import drain_outbox
+
+
+class Command(BaseCommand):
+    help = 'Drain the VOD sync outbox into the external multimedia table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=getattr(settings, 'VOD_SYNC_BATCH_SIZE', 100),
+            help='Outbox rows sent per INSERT'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=10,
+            help='Seconds to sleep when nothing is due'
+        )
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = drain_outbox(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'Synced {sent} rows, {failed} failed')
+            if sent == options['batch_size']:
+                continue  # more may be waiting
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,118 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from video.jobs import claim_next_job, finish_job, requeue_job, requeue_stale_jobs, run_job
+from video.models import TranscodeJob, Video
+from video.staging import apply_umask, collect_staging
+from video.transcode import prune_unreferenced_outputs
+from video.uploads import collect_stale_uploads
+
+
+def _init_worker():
+    # Connections inherited from the parent must never be shared with it
+    django.setup()
+    connections.close_all()
+    # Encoder output is created with its final permissions
+    apply_umask()
+
+
+class Command(BaseCommand):
+    help = 'Run queued video transcode jobs in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            default=getattr(settings, 'TRANSCODE_WORKERS', None) or os.cpu_count(),
+            help='Number of encodes to run in parallel (default: TRANSCODE_WORKERS or CPU count)'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float,
+            default=getattr(settings, 'TRANSCODE_POLL_INTERVAL', 5),
+            help='Seconds to sleep when the queue is empty'
+        )
+        parser.add_argument(
+            '--stale-after', type=int, default=30 * 60,
+            help='Requeue running jobs that have reported no progress for this many seconds'
+        )
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is drained')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        requeued = requeue_stale_jobs(options['stale_after'])
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale jobs')
+        collected = collect_staging(options['stale_after'])
+        if collected:
+            self.stdout.write(f'Removed {collected} abandoned staging directories')
+        discarded = collect_stale_uploads()
+        if discarded:
+            self.stdout.write(f'Discarded {discarded} abandoned chunked uploads')
+        pruned = prune_unreferenced_outputs(getattr(settings, 'TRANSCODE_OUTPUT_GRACE_PERIOD', 24 * 60 * 60))
+        if pruned:
+            self.stdout.write(f'Removed {pruned} superseded output directories')
+
+        self.stdout.write(f'Transcode worker started with {workers} processes')
+        connections.close_all()
+        running = {}
+        pool = self.start_pool(workers)
+        try:
+            while True:
+                while len(running) < workers:
+                    job = claim_next_job()
+                    if job is None:
+                        break
+                    try:
+                        future = pool.submit(run_job, job.pk)
+                    except BrokenProcessPool:
+                        # Not started: the claim is handed back without counting as an attempt
+                        requeue_job(job.pk, attempted=False)
+                        pool = self.restart_pool(pool, running, workers)
+                        continue
+                    running[future] = job.pk
+                    self.stdout.write(f'Started job {job.pk} for video {job.video_id}')
+
+                if not running:
+                    # Jobs held back by admission control still count as work left
+                    if options['once'] and not TranscodeJob.objects.filter(status=Video.STATUS_QUEUED).exists():
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future not in running:
+                        continue  # settled by restart_pool
+                    try:
+                        status = future.result()
+                    except BrokenProcessPool:
+                        # A worker process died (OOM kill, crash in native code) and took the pool down
+                        pool = self.restart_pool(pool, running, workers)
+                        continue
+                    except Exception as e:
+                        status = Video.STATUS_FAILED
+                        finish_job(TranscodeJob.objects.get(pk=running[future]), status, f'Worker crashed: {e}')
+                    self.stdout.write(f'Job {running.pop(future)} {status}')
+        except KeyboardInterrupt:
+            self.stdout.write('Shutting down, waiting for running encodes...')
+        finally:
+            pool.shutdown(wait=True)
+
+    def start_pool(self, workers):
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+    def restart_pool(self, pool, running, workers):
+        """Requeue the jobs of a broken ``pool`` (failing those out of attempts) and return a new pool."""
+        for job_id in running.values():
+            status = requeue_job(job_id, 'Worker process died')
+            self.stdout.write(f'Job {job_id} {status} after its worker process died')
+        running.clear()
+        pool.shutdown(wait=False, cancel_futures=True)
+        self.stdout.write('Restarting the worker processes')
+        return self.start_pool(workers)
@@ -0,0 +1,145 @@
+"""Serving of processed HLS output (playlists, segments) under MEDIA_URL/processed/.
+
+With MEDIA_SENDFILE_HEADER configured the file is handed to the front web
+server (``X-Accel-Redirect`` for nginx, ``X-Sendfile`` for Apache/lighttpd)
+and no Python worker stays busy during the transfer. Otherwise whole files go
+out through ``FileResponse``, which WSGI servers such as gunicorn send with
+``os.sendfile``, and single byte ranges are streamed from a seek.
+"""
+import mimetypes
+import os
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_http_methods
+
+from .viewcount import count_view
+
+PLAYLIST_EXTENSIONS = {'.m3u8'}
+CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+    '.vtt': 'text/vtt',
+}
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def _cache_control(path):
+    if path.suffix in PLAYLIST_EXTENSIONS:
+        return f"public, max-age={getattr(settings, 'HLS_PLAYLIST_MAX_AGE', 5)}"
+    # Segments are never rewritten in place, so they may be cached forever
+    return 'public, max-age=31536000, immutable'
+
+
+def _parse_range(header, size):
+    """``(start, end)`` inclusive for a single satisfiable byte range, None to ignore it, or False."""
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _range_applies(request, etag, last_modified):
+    """Whether a Range request may be answered with part of the file, going by its If-Range.
+
+    If-Range holds the validator of the copy the client already has part of:
+    a strong ETag (a weak one never matches) or an exact Last-Modified date.
+    When it no longer matches, the whole file is sent instead.
+    """
+    if_range = request.headers.get('If-Range', '').strip()
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(STREAM_BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+@require_http_methods(['GET', 'HEAD'])
+def serve_processed(request, path):
+    root = Path(settings.MEDIA_ROOT) / 'processed'
+    try:
+        full_path = Path(safe_join(root, path))
+    except Exception:
+        raise Http404('Not found')
+    if not full_path.is_file():
+        raise Http404('Not found')
+    if full_path.suffix in PLAYLIST_EXTENSIONS and request.method == 'GET':
+        count_view(path)
+
+    stat = full_path.stat()
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        'Cache-Control': _cache_control(full_path),
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+    }
+
+    # If-None-Match (weak comparison, "*"), If-Modified-Since, If-Match and If-Unmodified-Since
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    content_type = CONTENT_TYPES.get(full_path.suffix) or mimetypes.guess_type(full_path.name)[0] or 'application/octet-stream'
+    sendfile_header = getattr(settings, 'MEDIA_SENDFILE_HEADER', None)
+
+    if sendfile_header == 'X-Accel-Redirect':
+        # nginx serves the internal location itself, including Range requests
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = f"{settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/')}/processed/{path}"
+    elif sendfile_header:
+        response = HttpResponse(content_type=content_type)
+        response[sendfile_header] = str(full_path)
+    else:
+        byte_range = None
+        if 'Range' in request.headers and _range_applies(request, etag, int(stat.st_mtime)):
+            byte_range = _parse_range(request.headers['Range'], stat.st_size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                _read_range(full_path, start, length) if request.method == 'GET' else [],
+                status=206,
+                content_type=content_type
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            response['Content-Length'] = str(length)
+        else:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+
+    for name, value in headers.items():
+        response[name] = value
+    return response
@@ -0,0 +1,142 @@
+"""Per-stage timing of the upload -> probe -> encode -> sync pipeline.
+
+Each stage is wrapped in ``stage()``, which stores a ``PipelineStage`` row
+(duration, bytes in and out, failure reason), logs one structured record on
+the ``video.pipeline`` logger and logs a warning when the stage took longer
+than its PIPELINE_SLOW_STAGES threshold. ``prometheus_text()`` aggregates
+the rows for the ``/metrics`` endpoint.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+logger = logging.getLogger('video.pipeline')
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600)
+
+
+class StageTimer:
+    """Handle yielded by ``stage()``; set ``bytes_out`` (or ``video``) before the block ends."""
+
+    def __init__(self, name, video=None, job=None, bytes_in=None):
+        self.name = name
+        self.video = video
+        self.job = job
+        self.bytes_in = bytes_in
+        self.bytes_out = None
+
+
+@contextmanager
+def stage(name, video=None, job=None, bytes_in=None):
+    """Time the enclosed block as pipeline stage ``name``; failures are recorded and re-raised."""
+    timer = StageTimer(name, video, job, bytes_in)
+    started_at = timezone.now()
+    started = time.perf_counter()
+    try:
+        yield timer
+    except Exception as e:
+        record(name, timer.video, time.perf_counter() - started, started_at, timer.job, timer.bytes_in,
+               timer.bytes_out, error=str(e) or type(e).__name__)
+        raise
+    record(name, timer.video, time.perf_counter() - started, started_at, timer.job, timer.bytes_in, timer.bytes_out)
+
+
+def record(name, video=None, duration=0.0, started_at=None, job=None, bytes_in=None, bytes_out=None, error=''):
+    """Store and log one finished stage; for stages timed elsewhere (e.g. queue wait)."""
+    threshold = getattr(settings, 'PIPELINE_SLOW_STAGES', {}).get(name)
+    slow = threshold is not None and duration > threshold
+    video_id = getattr(video, 'pk', video)
+    job_id = getattr(job, 'pk', job)
+    status = 'failed' if error else 'ok'
+    logger.log(
+        logging.WARNING if slow or error else logging.INFO,
+        'Stage %s %s for video %s in %.3fs%s', name, status, video_id, duration,
+        f' (slower than {threshold}s)' if slow else '',
+        extra={
+            'event': 'pipeline_stage', 'stage': name, 'video_id': video_id, 'job_id': job_id,
+            'duration': round(duration, 3), 'bytes_in': bytes_in, 'bytes_out': bytes_out,
+            'status': status, 'error': error, 'slow': slow,
+        }
+    )
+    if transaction.get_connection().in_atomic_block and transaction.get_rollback():
+        return  # the surrounding transaction is already broken; the log line has to do
+    try:
+        with transaction.atomic():
+            apps.get_model('video', 'PipelineStage').objects.create(
+                video_id=video_id, job_id=job_id, stage=name, started_at=started_at or timezone.now(),
+                duration=duration, bytes_in=bytes_in, bytes_out=bytes_out, status=status, error=error, slow=slow
+            )
+    except DatabaseError:
+        logger.exception('Could not store pipeline stage %s', name)
+
+
+def tree_size(path):
+    """Total size in bytes of the files under ``path``."""
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    ) if Path(path).is_dir() else 0
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def prometheus_text():
+    """Pipeline, queue and outbox metrics in the Prometheus text exposition format."""
+    PipelineStage = apps.get_model('video', 'PipelineStage')
+    TranscodeJob = apps.get_model('video', 'TranscodeJob')
+    VodSyncOutbox = apps.get_model('video', 'VodSyncOutbox')
+
+    buckets = {f'le_{i}': Count('pk', filter=Q(duration__lte=bound)) for i, bound in enumerate(DURATION_BUCKETS)}
+    stages = (
+        PipelineStage.objects.order_by().values('stage')
+        .annotate(
+            count=Count('pk'), seconds=Sum('duration'), bytes_in=Sum('bytes_in'), bytes_out=Sum('bytes_out'),
+            failed=Count('pk', filter=Q(status='failed')), slow=Count('pk', filter=Q(slow=True)),
+            **buckets
+        )
+        .order_by('stage')
+    )
+
+    lines = [
+        '# HELP video_pipeline_stage_seconds Duration of pipeline stages.',
+        '# TYPE video_pipeline_stage_seconds histogram',
+    ]
+    counters = {'failed': [], 'slow': [], 'bytes_in': [], 'bytes_out': []}
+    for row in stages:
+        for i, bound in enumerate(DURATION_BUCKETS):
+            lines.append(f"video_pipeline_stage_seconds_bucket{_labels(stage=row['stage'], le=bound)} {row[f'le_{i}']}")
+        lines.append(f"video_pipeline_stage_seconds_bucket{_labels(stage=row['stage'], le='+Inf')} {row['count']}")
+        lines.append(f"video_pipeline_stage_seconds_sum{_labels(stage=row['stage'])} {row['seconds'] or 0:.3f}")
+        lines.append(f"video_pipeline_stage_seconds_count{_labels(stage=row['stage'])} {row['count']}")
+        for key in counters:
+            counters[key].append(f"{_labels(stage=row['stage'])} {row[key] or 0}")
+
+    for key, help_text in [
+        ('failed', 'Pipeline stages that raised an error.'),
+        ('slow', 'Pipeline stages slower than their PIPELINE_SLOW_STAGES threshold.'),
+        ('bytes_in', 'Bytes read by pipeline stages.'),
+        ('bytes_out', 'Bytes written by pipeline stages.'),
+    ]:
+        name = f'video_pipeline_stage_{key}_total'
+        lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} counter'])
+        lines.extend(f'{name}{sample}' for sample in counters[key])
+
+    lines.extend(['# HELP video_transcode_jobs Transcode jobs by status and kind.', '# TYPE video_transcode_jobs gauge'])
+    for row in TranscodeJob.objects.order_by().values('status', 'kind').annotate(count=Count('pk')).order_by('status', 'kind'):
+        lines.append(f"video_transcode_jobs{_labels(status=row['status'], kind=row['kind'])} {row['count']}")
+
+    lines.extend(['# HELP video_vod_sync_outbox VOD sync outbox rows by status.', '# TYPE video_vod_sync_outbox gauge'])
+    for row in VodSyncOutbox.objects.order_by().values('status').annotate(count=Count('pk')).order_by('status'):
+        lines.append(f"video_vod_sync_outbox{_labels(status=row['status'])} {row['count']}")
+    return '\n'.join(lines) + '\n'
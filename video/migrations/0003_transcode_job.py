@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:13
+
+import django.db.models.deletion
+import video.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0002_video_processed_video'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='status',
+            field=models.CharField(blank=True, choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], help_text='State of the latest transcode job', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='target_resolution',
+            field=models.CharField(choices=[('original', 'Keep Original Resolution'), ('360p', '360p (640x360)'), ('480p', '480p (854x480)'), ('720p', '720p (1280x720)'), ('1080p', '1080p (1920x1080)')], default='720p', help_text='Target resolution for video processing', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='processed_video',
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='video',
+            field=video.models.VideoFileField(help_text='Supported formats: MP4, MKV, AVI, MOV, WEBM', upload_to='video/%y', validators=[video.models.validate_video_extension], verbose_name='Video File'),
+        ),
+        migrations.CreateModel(
+            name='TranscodeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='video.video')),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0003_transcode_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='video',
+            name='target_resolution',
+            field=models.CharField(choices=[('original', 'Keep Original Resolution'), ('360p', '360p (640x360)'), ('480p', '480p (854x480)'), ('720p', '720p (1280x720)'), ('1080p', '1080p (1920x1080)'), ('abr', 'Adaptive (every rendition up to the source resolution)')], default='720p', help_text='Target resolution for video processing', max_length=10),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0007_vod_sync_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='source_sha256',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='SHA-256 of the source file, used to skip re-encoding duplicates', max_length=64),
+        ),
+    ]
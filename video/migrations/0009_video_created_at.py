@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:23
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0008_source_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
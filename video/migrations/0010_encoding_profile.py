@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_default_profile(apps, schema_editor):
+    EncodingProfile = apps.get_model('video', 'EncodingProfile')
+    # Same settings the encoder used before profiles existed
+    EncodingProfile.objects.get_or_create(
+        name='Standard (veryfast, CRF 23)',
+        defaults={'preset': 'veryfast', 'crf': 23, 'maxrate_scale': 1.0, 'audio_bitrate': '128k', 'is_default': True}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0009_video_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EncodingProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('preset', models.CharField(choices=[('ultrafast', 'ultrafast'), ('superfast', 'superfast'), ('veryfast', 'veryfast'), ('faster', 'faster'), ('fast', 'fast'), ('medium', 'medium'), ('slow', 'slow'), ('slower', 'slower'), ('veryslow', 'veryslow')], default='veryfast', max_length=10)),
+                ('crf', models.PositiveSmallIntegerField(default=23, help_text='Constant rate factor (lower is better quality)')),
+                ('maxrate_scale', models.FloatField(default=1.0, help_text='Multiplier applied to the per-resolution maxrate/bufsize caps')),
+                ('audio_bitrate', models.CharField(default='128k', max_length=10)),
+                ('is_default', models.BooleanField(default=False, help_text='Used for videos without a profile')),
+                ('per_title', models.BooleanField(default=False, help_text='Run short trial encodes on sampled scenes and pick the highest CRF that reaches the target SSIM')),
+                ('target_ssim', models.FloatField(default=0.97)),
+                ('crf_min', models.PositiveSmallIntegerField(default=18)),
+                ('crf_max', models.PositiveSmallIntegerField(default=30)),
+                ('sample_count', models.PositiveSmallIntegerField(default=3)),
+                ('sample_duration', models.PositiveSmallIntegerField(default=4, help_text='Seconds per sampled scene')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='encode_settings',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='encoding_profile',
+            field=models.ForeignKey(blank=True, help_text='Encoder settings; the default profile is used when empty', null=True, on_delete=django.db.models.deletion.SET_NULL, to='video.encodingprofile'),
+        ),
+        migrations.RunPython(create_default_profile, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0010_encoding_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcodejob',
+            name='eta_seconds',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transcodejob',
+            name='fps',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transcodejob',
+            name='progress',
+            field=models.FloatField(default=0, help_text='Percent of the source duration encoded'),
+        ),
+        migrations.AddField(
+            model_name='transcodejob',
+            name='progress_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transcodejob',
+            name='speed',
+            field=models.FloatField(blank=True, help_text='Seconds of video encoded per second', null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0011_transcode_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcodejob',
+            name='kind',
+            field=models.CharField(choices=[('upload', 'Upload'), ('ingest', 'Bulk ingest')], default='upload', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='transcodejob',
+            name='priority',
+            field=models.SmallIntegerField(default=0, help_text='Higher runs first'),
+        ),
+    ]
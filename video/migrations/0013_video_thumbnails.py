@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0012_transcode_job_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='poster_url',
+            field=models.URLField(blank=True, editable=False, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='thumbnails_vtt_url',
+            field=models.URLField(blank=True, editable=False, max_length=500, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0013_video_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transcodejob',
+            name='kind',
+            field=models.CharField(choices=[('upload', 'Upload'), ('ingest', 'Bulk ingest'), ('reprocess', 'Reprocess')], default='upload', max_length=10),
+        ),
+    ]
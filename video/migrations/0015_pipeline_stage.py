@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0014_reprocess_job_kind'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineStage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=20)),
+                ('started_at', models.DateTimeField()),
+                ('duration', models.FloatField(help_text='Seconds')),
+                ('bytes_in', models.BigIntegerField(blank=True, null=True)),
+                ('bytes_out', models.BigIntegerField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('ok', 'OK'), ('failed', 'Failed')], default='ok', max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('slow', models.BooleanField(default=False, help_text='Took longer than its PIPELINE_SLOW_STAGES threshold')),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stages', to='video.transcodejob')),
+                ('video', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stages', to='video.video')),
+            ],
+            options={
+                'ordering': ['started_at'],
+                'indexes': [models.Index(fields=['stage', 'started_at'], name='video_pipel_stage_3fc8e4_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0015_pipeline_stage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='encoded_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='last_viewed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='output_bytes',
+            field=models.BigIntegerField(blank=True, editable=False, help_text='All renditions together', null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='source_bytes',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='source_state',
+            field=models.CharField(blank=True, choices=[('', 'Original'), ('compressed', 'Compressed'), ('deleted', 'Deleted')], editable=False, max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='processed_video',
+            field=models.URLField(blank=True, db_index=True, max_length=500, null=True),
+        ),
+    ]
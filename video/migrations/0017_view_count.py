@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0016_storage_lifecycle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='view_count',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text='Plays of the output, counted by video.viewcount'),
+        ),
+    ]
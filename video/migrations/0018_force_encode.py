@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0017_view_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='force_encode',
+            field=models.BooleanField(default=False, help_text='Always re-encode, even when the source could be copied into the stream as it is'),
+        ),
+    ]
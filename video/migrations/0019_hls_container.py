@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:07
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0018_force_encode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encodingprofile',
+            name='container',
+            field=models.CharField(choices=[('mpegts', 'MPEG-TS segments'), ('fmp4', 'Fragmented MP4 (CMAF) segments'), ('single_file', 'One fragmented MP4 per rendition, addressed by byte range')], default='mpegts', help_text='Segment format of the HLS output; only MPEG-TS output is encoded in parallel slices', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='encodingprofile',
+            name='segment_duration',
+            field=models.PositiveSmallIntegerField(default=6, help_text='Target seconds per HLS segment', validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
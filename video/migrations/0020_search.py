@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:10
+
+from django.db import OperationalError, migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return  # video.search falls back to substring matching
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE video_search USING fts5(caption, tokenize = 'unicode61 remove_diacritics 2')")
+        except OperationalError:
+            return  # SQLite built without FTS5
+        cursor.execute('INSERT INTO video_search(rowid, caption) SELECT id, caption FROM video_video')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS video_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0019_hls_container'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['created_at'], name='video_video_created_5b5d6f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['status', 'created_at'], name='video_video_status_2b54de_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['target_resolution', 'created_at'], name='video_video_target__7fed7a_idx'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
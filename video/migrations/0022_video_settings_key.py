@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0021_uploaded_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='settings_key',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+    ]
@@ -1,15 +1,30 @@
 from django.db import models, transaction
+import hashlib
+import json
+import logging
 import subprocess
 import os
-import mysql.connector
+import uuid
+from pathlib import Path
 from django.conf import settings
-from datetime import datetime
+from django.utils import timezone
 from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
 from django.forms import forms
 from django.utils.translation import gettext_lazy as _
-from pathlib import Path
-import shutil
-from project.vod_settings import VOD_DB
+from .ffmpeg import DEFAULT_ENCODING
+from .metrics import stage
+from .probe import PROBE_FIELDS, metadata_from_probe, probe_key, probe_video, run_ffprobe, run_ffprobe_head
+
+logger = logging.getLogger(__name__)
+
+VALID_VIDEO_EXTENSIONS = ['.mp4', '.mkv', '.avi', '.mov', '.webm']
+
+
+def encoding_key(encoding):
+    """Short digest of encoder settings: equal settings, equal key."""
+    return hashlib.sha256(json.dumps(encoding, sort_keys=True).encode()).hexdigest()[:12]
+
 
 class VideoFileField(models.FileField):
     def __init__(self, *args, **kwargs):
@@ -19,17 +34,90 @@ class VideoFileField(models.FileField):
         data = super(VideoFileField, self).clean(*args, **kwargs)
         if data:
             ext = os.path.splitext(data.name)[1].lower()
-            valid_extensions = ['.mp4', '.mkv', '.avi', '.mov', '.webm']
-            if ext not in valid_extensions:
+            if ext not in VALID_VIDEO_EXTENSIONS:
                 raise forms.ValidationError(_('Please upload a valid video file. Supported formats: MP4, MKV, AVI, MOV, WEBM'))
         return data
 
 def validate_video_extension(value):
     ext = os.path.splitext(value.name)[1]
-    valid_extensions = ['.mp4', '.mkv', '.avi', '.mov', '.webm']
-    if ext.lower() not in valid_extensions:
+    if ext.lower() not in VALID_VIDEO_EXTENSIONS:
         raise ValidationError('Unsupported file format. Please upload a video file (MP4, MKV, AVI, MOV, or WEBM)')
 
+class EncodingProfile(models.Model):
+    """Named libx264 settings that can be selected per video."""
+
+    PRESET_CHOICES = [(p, p) for p in [
+        'ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow'
+    ]]
+    CONTAINER_CHOICES = [
+        ('mpegts', 'MPEG-TS segments'),
+        ('fmp4', 'Fragmented MP4 (CMAF) segments'),
+        ('single_file', 'One fragmented MP4 per rendition, addressed by byte range'),
+    ]
+
+    name = models.CharField(max_length=100, unique=True)
+    preset = models.CharField(max_length=10, choices=PRESET_CHOICES, default='veryfast')
+    crf = models.PositiveSmallIntegerField(default=23, help_text='Constant rate factor (lower is better quality)')
+    maxrate_scale = models.FloatField(
+        default=1.0,
+        help_text='Multiplier applied to the per-resolution maxrate/bufsize caps'
+    )
+    audio_bitrate = models.CharField(max_length=10, default='128k')
+    container = models.CharField(
+        max_length=12,
+        choices=CONTAINER_CHOICES,
+        default='mpegts',
+        help_text='Segment format of the HLS output; only MPEG-TS output is encoded in parallel slices'
+    )
+    segment_duration = models.PositiveSmallIntegerField(
+        default=6, validators=[MinValueValidator(1)], help_text='Target seconds per HLS segment'
+    )
+    is_default = models.BooleanField(default=False, help_text='Used for videos without a profile')
+
+    per_title = models.BooleanField(
+        default=False,
+        help_text='Run short trial encodes on sampled scenes and pick the highest CRF that reaches the target SSIM'
+    )
+    target_ssim = models.FloatField(default=0.97)
+    crf_min = models.PositiveSmallIntegerField(default=18)
+    crf_max = models.PositiveSmallIntegerField(default=30)
+    sample_count = models.PositiveSmallIntegerField(default=3)
+    sample_duration = models.PositiveSmallIntegerField(default=4, help_text='Seconds per sampled scene')
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        if self.crf_min > self.crf_max:
+            raise ValidationError('crf_min cannot be greater than crf_max')
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self.is_default:
+                EncodingProfile.objects.filter(is_default=True).exclude(pk=self.pk).update(is_default=False)
+            super().save(*args, **kwargs)
+
+    def as_encoding(self):
+        """Settings in the form taken by the ``video.ffmpeg`` command builders."""
+        return {
+            'preset': self.preset,
+            'crf': self.crf,
+            'maxrate_scale': self.maxrate_scale,
+            'audio_bitrate': self.audio_bitrate,
+            'container': self.container,
+            'segment_duration': self.segment_duration,
+        }
+
+    def settings_key(self):
+        """``encoding_key`` of everything in this profile that shapes the output."""
+        settings = self.as_encoding()
+        if self.per_title:
+            settings['per_title'] = [
+                self.target_ssim, self.crf_min, self.crf_max, self.sample_count, self.sample_duration
+            ]
+        return encoding_key(settings)
+
+
 class Video(models.Model):
     RESOLUTION_CHOICES = [
         ('original', 'Keep Original Resolution'),
@@ -37,9 +125,32 @@ class Video(models.Model):
         ('480p', '480p (854x480)'),
         ('720p', '720p (1280x720)'),
         ('1080p', '1080p (1920x1080)'),
+        ('abr', 'Adaptive (every rendition up to the source resolution)'),
+    ]
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    # What the storage lifecycle (video.lifecycle) has done to the source file
+    SOURCE_ORIGINAL = ''
+    SOURCE_COMPRESSED = 'compressed'
+    SOURCE_DELETED = 'deleted'
+    SOURCE_STATE_CHOICES = [
+        (SOURCE_ORIGINAL, 'Original'),
+        (SOURCE_COMPRESSED, 'Compressed'),
+        (SOURCE_DELETED, 'Deleted'),
     ]
 
     MAX_VIDEO_SIZE_MB = 2500  # Maximum video size in MB (2.5GB)
+    MAX_DURATION_SECONDS = 600  # 10 minutes
     
     caption = models.CharField(max_length=100)
     video = VideoFileField(
@@ -48,13 +159,82 @@ class Video(models.Model):
         help_text='Supported formats: MP4, MKV, AVI, MOV, WEBM',
         verbose_name='Video File'
     )
-    processed_video = models.URLField(max_length=500, null=True, blank=True)  # Changed to URLField
+    processed_video = models.URLField(max_length=500, null=True, blank=True, db_index=True)  # Changed to URLField
+    # Scrub previews written next to the playlist by the same encode (see video.thumbnails)
+    poster_url = models.URLField(max_length=500, null=True, blank=True, editable=False)
+    thumbnails_vtt_url = models.URLField(max_length=500, null=True, blank=True, editable=False)
     target_resolution = models.CharField(
         max_length=10, 
         choices=RESOLUTION_CHOICES,
         default='720p',
         help_text='Target resolution for video processing'
     )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        blank=True,
+        help_text='State of the latest transcode job'
+    )
+    encoding_profile = models.ForeignKey(
+        EncodingProfile,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        help_text='Encoder settings; the default profile is used when empty'
+    )
+    encode_settings = models.JSONField(null=True, blank=True, editable=False)
+    # encoding_key of the profile settings the output is (to be) encoded with, see output_key()
+    settings_key = models.CharField(max_length=12, blank=True, editable=False)
+    uploaded_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        related_name='videos',
+        help_text='Counted against the per-user limits of video.admission'
+    )
+    force_encode = models.BooleanField(
+        default=False,
+        help_text='Always re-encode, even when the source could be copied into the stream as it is'
+    )
+
+    # Source metadata, filled once per file version by video.probe.probe_video
+    duration = models.FloatField(null=True, blank=True, help_text='Seconds')
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    video_codec = models.CharField(max_length=32, blank=True)
+    audio_codec = models.CharField(max_length=32, blank=True)
+    bitrate = models.BigIntegerField(null=True, blank=True, help_text='Bits per second')
+    fps = models.FloatField(null=True, blank=True)
+    audio_layout = models.CharField(max_length=32, blank=True)
+    probe_data = models.JSONField(null=True, blank=True, editable=False)
+    probe_key = models.CharField(max_length=600, blank=True, editable=False)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Storage accounting and lifecycle state, see video.lifecycle
+    source_bytes = models.BigIntegerField(null=True, blank=True, editable=False)
+    output_bytes = models.BigIntegerField(null=True, blank=True, editable=False, help_text='All renditions together')
+    source_state = models.CharField(max_length=10, choices=SOURCE_STATE_CHOICES, blank=True, editable=False)
+    encoded_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_viewed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    view_count = models.PositiveBigIntegerField(
+        default=0, editable=False, help_text='Plays of the output, counted by video.viewcount'
+    )
+    source_sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        editable=False,
+        help_text='SHA-256 of the source file, used to skip re-encoding duplicates'
+    )
+
+    class Meta:
+        # Catalogue and admin filters; caption search goes through video.search
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['target_resolution', 'created_at']),
+        ]
 
     def clean(self):
         if self.video:
@@ -62,214 +242,256 @@ class Video(models.Model):
             if self.video.size > self.MAX_VIDEO_SIZE_MB * 1024 * 1024:
                 raise ValidationError(f'Video size cannot exceed {self.MAX_VIDEO_SIZE_MB}MB')
             
-            if not os.path.exists(self.video.path):
-                return  # Skip duration check if file doesn't exist yet
-
-            # Get video duration using FFprobe
             try:
-                cmd = [
-                    'ffprobe',
-                    '-v', 'error',
-                    '-show_entries', 'format=duration',
-                    '-of', 'default=noprint_wrappers=1:nokey=1',
-                    str(self.video.path)
-                ]
-                duration = float(subprocess.check_output(cmd, text=True, stderr=subprocess.PIPE).strip())
-                
-                if duration > 600:  # 10 minutes
-                    raise ValidationError('Video duration cannot exceed 10 minutes')
+                if self.video._committed and os.path.exists(self.video.path):
+                    # Probe once; the result is cached on the model for the encode
+                    probe_video(self)
+                elif self.probe_data is None:
+                    # Not in MEDIA_ROOT yet: probe the upload where it was received;
+                    # save() keys the result to the stored file
+                    upload = self.video.file
+                    if hasattr(upload, 'temporary_file_path'):
+                        data = run_ffprobe(upload.temporary_file_path())
+                    elif upload.size <= settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+                        upload.seek(0)
+                        data = run_ffprobe_head(upload.read())
+                        upload.seek(0)
+                    else:
+                        return
+                    for name, value in metadata_from_probe(data).items():
+                        setattr(self, name, value)
             except (subprocess.SubprocessError, ValueError, OSError) as e:
-                print(f"Warning: Could not check video duration: {e}")
+                logger.warning("Could not check video duration: %s", e)
+                return
+
+            if self.duration and self.duration > self.MAX_DURATION_SECONDS:
+                raise ValidationError('Video duration cannot exceed 10 minutes')
 
     def __str__(self):
         return self.caption
 
+    def output_path(self):
+        """Path of the current playlist relative to MEDIA_ROOT, from ``processed_video``."""
+        media_url = settings.MEDIA_URL.rstrip('/') + '/'
+        if not self.processed_video or not self.processed_video.startswith(media_url):
+            return None
+        return self.processed_video[len(media_url):]
+
+    def output_key(self):
+        """Content-addressed name of the HLS output: same source + same settings = same output."""
+        key = f'{self.source_sha256[:16]}_{self.target_resolution}'
+        if self.encoding_profile_id:
+            key = f'{key}_p{self.encoding_profile_id}'
+        if self.settings_key:
+            key = f'{key}_s{self.settings_key}'
+        return f'{key}_e' if self.force_encode else key
+
+    def current_settings_key(self):
+        """``settings_key`` for the settings an encode of this video would use now."""
+        profile = self.encoding_profile or EncodingProfile.objects.filter(is_default=True).first()
+        return profile.settings_key() if profile else encoding_key(DEFAULT_ENCODING)
+
+    def find_duplicate(self, statuses=None):
+        """Another video with the same source digest and encode settings, if any."""
+        if not self.source_sha256:
+            return None
+        duplicates = Video.objects.filter(
+            source_sha256=self.source_sha256,
+            target_resolution=self.target_resolution,
+            encoding_profile=self.encoding_profile_id,
+            settings_key=self.settings_key,
+            force_encode=self.force_encode,
+            status__in=statuses or [self.STATUS_DONE]
+        ).exclude(pk=self.pk)
+        if not statuses:
+            duplicates = duplicates.exclude(processed_video__isnull=True).exclude(processed_video='')
+        return duplicates.order_by('pk').first()
+
+    def reuse_output_of(self, original):
+        """Share ``original``'s source file and HLS output instead of storing and encoding a copy.
+
+        If the lifecycle already deleted ``original``'s source, this upload's
+        file is kept as the group's source instead.
+        """
+        if original.source_state == self.SOURCE_DELETED and self.video:
+            self.source_bytes = self.video.size
+        else:
+            if self.video.name != original.video.name:
+                if self.video._committed:
+                    self.video.storage.delete(self.video.name)  # already on disk, e.g. from a chunked upload
+                self.video = original.video.name
+            self.source_bytes = original.source_bytes
+            self.source_state = original.source_state
+        self.processed_video = original.processed_video
+        self.poster_url = original.poster_url
+        self.thumbnails_vtt_url = original.thumbnails_vtt_url
+        self.encode_settings = original.encode_settings
+        self.output_bytes = original.output_bytes
+        self.encoded_at = original.encoded_at
+        self.status = self.STATUS_DONE
+        for field in PROBE_FIELDS:
+            setattr(self, field, getattr(original, field))
+
     def save(self, *args, **kwargs):
         if self._state.adding:  # Only process new videos
-            self.clean()  # Validate before processing
-            with transaction.atomic():
-                super().save(*args, **kwargs)
-                
-                if self.video and not self.processed_video:
-                    try:
-                        # Ensure the video file exists
-                        if not os.path.exists(self.video.path):
-                            raise ValidationError("Video file not found")
-
-                        # Create necessary directories in web folder
-                        year = datetime.now().strftime('%y')
-                        media_root = Path(settings.MEDIA_ROOT)
-                        web_output_dir = media_root / 'processed' / year
-                        web_output_dir.mkdir(parents=True, exist_ok=True)
-                        
-                        # Create a directory for the HLS segments
-                        base_name = Path(self.video.name).stem
-                        stream_dir = web_output_dir / f"stream_{base_name}"
-                        stream_dir.mkdir(parents=True, exist_ok=True)
-                        
-                        # Set up HLS playlist and segment paths
-                        playlist_name = "playlist.m3u8"
-                        segment_pattern = "segment_%03d.ts"
-                        output_playlist = stream_dir / playlist_name
-                        output_segment = stream_dir / segment_pattern
-                        
-                        # Get video resolution using FFprobe
-                        probe_cmd = [
-                            'ffprobe',
-                            '-v', 'error',
-                            '-select_streams', 'v:0',
-                            '-show_entries', 'stream=width,height',
-                            '-of', 'csv=p=0',
-                            str(self.video.path)
-                        ]
-                        try:
-                            original_resolution = subprocess.check_output(probe_cmd, text=True).strip().split(',')
-                            original_width, original_height = map(int, original_resolution)
-                        except Exception as e:
-                            print(f"Error getting video resolution: {e}")
-                            original_width, original_height = 1280, 720  # Default to 720p if can't detect
-                        
-                        # Get resolution settings based on target_resolution
-                        resolution_settings = {
-                            'original': {'size': f'{original_width}x{original_height}', 'bitrate': '4000k', 'bufsize': '8000k'},
-                            '360p': {'size': '640x360', 'bitrate': '800k', 'bufsize': '1600k'},
-                            '480p': {'size': '854x480', 'bitrate': '1200k', 'bufsize': '2400k'},
-                            '720p': {'size': '1280x720', 'bitrate': '2500k', 'bufsize': '5000k'},
-                            '1080p': {'size': '1920x1080', 'bitrate': '4000k', 'bufsize': '8000k'},
-                        }
-                        
-                        res_setting = resolution_settings[self.target_resolution]
-
-                        # Prepare base FFmpeg command
-                        ffmpeg_cmd = ['ffmpeg', '-y', '-i', str(self.video.path)]
-                        
-                        # Add video codec settings
-                        ffmpeg_cmd.extend([
-                            '-threads', '2',
-                            '-c:v', 'libx264',
-                            '-preset', 'veryfast',
-                            '-profile:v', 'main',
-                            '-level', '3.1'
-                        ])
-
-                        # Add resolution-specific parameters if not keeping original
-                        if self.target_resolution != 'original':
-                            width, height = res_setting["size"].split('x')
-                            ffmpeg_cmd.extend([
-                                '-vf', f'scale=w={width}:h={height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:color=black'
-                            ])
-                        
-                        # Add quality and audio settings
-                        ffmpeg_cmd.extend([
-                            '-maxrate', res_setting['bitrate'],
-                            '-bufsize', res_setting['bufsize'],
-                            '-crf', '23',
-                            '-c:a', 'aac',
-                            '-b:a', '128k',
-                            '-ac', '2',
-                            '-ar', '44100'
-                        ])
-                        
-                        # Add HLS settings
-                        ffmpeg_cmd.extend([
-                            '-hls_time', '6',
-                            '-hls_list_size', '0',
-                            '-hls_flags', 'independent_segments',
-                            '-hls_segment_type', 'mpegts',
-                            '-hls_segment_filename', str(output_segment),
-                            '-f', 'hls',
-                            str(output_playlist)
-                        ])
-                        
-                        print(f"Running FFmpeg command: {' '.join(ffmpeg_cmd)}")
-                        
-                        # Run FFmpeg process with proper error handling
-                        # Set up environment with necessary paths
-                        env = os.environ.copy()
-                        env['PATH'] = '/usr/local/bin:/usr/bin:/bin:' + env.get('PATH', '')
-                        
-                        process = subprocess.Popen(
-                            ffmpeg_cmd,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            text=True,
-                            env=env
-                        )
-                        
-                        try:
-                            print("FFmpeg process started...")
-                            stdout, stderr = process.communicate(timeout=7200)  # 2 hours timeout
-                            
-                            if process.returncode == 0:
-                                print("FFmpeg process completed successfully")
-                                # Set the processed_video URL using the media URL
-                                relative_path = f'processed/{year}/stream_{base_name}/{playlist_name}'
-                                self.processed_video = f"{settings.MEDIA_URL.rstrip('/')}/{relative_path}"
-                                super().save(update_fields=['processed_video'])
-                                
-                                # Ensure web server can read the files
-                                os.system(f'chmod -R 755 {stream_dir}')
-                                
-                                # Update VOD database
-                                try:
-                                    conn = mysql.connector.connect(
-                                        host=VOD_DB['host'],
-                                        port=VOD_DB['port'],
-                                        database=VOD_DB['database'],
-                                        user=VOD_DB['user'],
-                                        password=VOD_DB['password']
-                                    )
-                                    
-                                    cursor = conn.cursor()
-                                    
-                                    # Insert into multimedia table
-                                    insert_query = """
-                                        INSERT INTO multimedia 
-                                        (judul, link, status, created_at, updated_at, kategori_id, views)
-                                        VALUES (%s, %s, %s, %s, %s, %s, %s)
-                                    """
-                                    
-                                    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                                    
-                                    cursor.execute(insert_query, (
-                                        self.caption,  # judul
-                                        f"http://202.169.232.239:8047/media/{relative_path}",  # link
-                                        'Aktif',  # status
-                                        current_time,  # created_at
-                                        current_time,  # updated_at
-                                        2,  # kategori_id (default to 2 - adjust as needed)
-                                        0  # views
-                                    ))
-                                    
-                                    conn.commit()
-                                    print("Successfully synced with VOD database")
-                                    
-                                except mysql.connector.Error as err:
-                                    print(f"Error updating VOD database: {err}")
-                                finally:
-                                    if 'conn' in locals() and conn.is_connected():
-                                        cursor.close()
-                                        conn.close()
-                                
-                            else:
-                                print(f"FFmpeg Error: Process returned {process.returncode}")
-                                print(f"Error details: {stderr}")
-                                if stream_dir.exists():
-                                    shutil.rmtree(stream_dir)
-                                raise ValidationError(f"Video processing failed: {stderr}")
-                                
-                        except subprocess.TimeoutExpired:
-                            print("FFmpeg process timed out, killing process...")
-                            process.kill()
-                            if stream_dir.exists():
-                                shutil.rmtree(stream_dir)
-                            raise ValidationError("Video processing timed out")
-                            
-                    except Exception as e:
-                        print(f"Error processing video: {str(e)}")
-                        stream_dir = web_output_dir / f"stream_{base_name}"
-                        if stream_dir.exists():
-                            shutil.rmtree(stream_dir)
-                        raise ValidationError(f"Video processing error: {str(e)}")
+            # Validation, the probe and moving the file into MEDIA_ROOT, timed as one stage
+            with stage('store', bytes_in=self.video.size if self.video else None) as timer:
+                self.clean()  # Validate before processing
+                if not self.source_sha256:
+                    # Computed while the upload streamed in (see video.upload_handlers)
+                    self.source_sha256 = getattr(self.video.file, 'sha256', '') if self.video and not self.video._committed else ''
+                if self.video and self.source_bytes is None:
+                    self.source_bytes = self.video.size
+                if not self.settings_key:
+                    self.settings_key = self.current_settings_key()
+                with transaction.atomic():
+                    if self.video and not self.processed_video:
+                        original = self.find_duplicate()
+                        if original:
+                            self.reuse_output_of(original)
+                        else:
+                            self.status = self.STATUS_QUEUED
+                    super().save(*args, **kwargs)
+                    timer.video = self
+                    if self.probe_data is not None and not self.probe_key and self.video:
+                        # Probed by clean() before the file was stored: cache it for the encode
+                        self.probe_key = probe_key(self.video.path)
+                        Video.objects.filter(pk=self.pk).update(probe_key=self.probe_key)
+
+                    # Encoding happens in the transcode worker, not on the request thread.
+                    # An identical source already being encoded is waited for instead (see video.jobs).
+                    if self.status == self.STATUS_QUEUED and not self.find_duplicate([self.STATUS_QUEUED, self.STATUS_RUNNING]):
+                        TranscodeJob.objects.create(video=self)
         else:
-            super().save(*args, **kwargs)
\ No newline at end of file
+            super().save(*args, **kwargs)
+
+
+class TranscodeJob(models.Model):
+    """A queued HLS encode, picked up by ``manage.py transcode_worker``.
+
+    Jobs are claimed by descending ``priority``, then age; TRANSCODE_KIND_LIMITS
+    caps how many jobs of one ``kind`` may run at once.
+    """
+
+    KIND_UPLOAD = 'upload'
+    KIND_INGEST = 'ingest'
+    KIND_REPROCESS = 'reprocess'
+    KIND_CHOICES = [
+        (KIND_UPLOAD, 'Upload'),
+        (KIND_INGEST, 'Bulk ingest'),
+        (KIND_REPROCESS, 'Reprocess'),
+    ]
+
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=KIND_UPLOAD)
+    priority = models.SmallIntegerField(default=0, help_text='Higher runs first')
+    status = models.CharField(
+        max_length=10,
+        choices=Video.STATUS_CHOICES,
+        default=Video.STATUS_QUEUED,
+        db_index=True
+    )
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Live encoder progress, written by video.progress.ProgressReporter
+    progress = models.FloatField(default=0, help_text='Percent of the source duration encoded')
+    fps = models.FloatField(null=True, blank=True)
+    speed = models.FloatField(null=True, blank=True, help_text='Seconds of video encoded per second')
+    eta_seconds = models.PositiveIntegerField(null=True, blank=True)
+    progress_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f'{self.video} ({self.get_status_display()})'
+
+
+class ChunkedUpload(models.Model):
+    """A resumable upload being appended chunk by chunk under FILE_UPLOAD_TEMP_DIR."""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    video = models.OneToOneField(Video, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.offset}/{self.size})'
+
+    @property
+    def temp_path(self):
+        return Path(settings.FILE_UPLOAD_TEMP_DIR) / 'chunked' / f'{self.id}.part'
+
+    @property
+    def is_complete(self):
+        return self.offset >= self.size
+
+
+class VodSyncOutbox(models.Model):
+    """A pending write to the external VOD ``multimedia`` table.
+
+    Rows are created in the same transaction as the encode result and drained
+    in batches by ``manage.py sync_vod``.
+    """
+
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    video = models.ForeignKey(Video, null=True, blank=True, on_delete=models.SET_NULL, related_name='vod_syncs')
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.payload.get('link')} ({self.get_status_display()})"
+
+
+class PipelineStage(models.Model):
+    """One timed step of a video's way through the pipeline, recorded by ``video.metrics.stage``."""
+
+    STATUS_OK = 'ok'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_OK, 'OK'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    video = models.ForeignKey(Video, null=True, blank=True, on_delete=models.CASCADE, related_name='stages')
+    job = models.ForeignKey(TranscodeJob, null=True, blank=True, on_delete=models.SET_NULL, related_name='stages')
+    stage = models.CharField(max_length=20)
+    started_at = models.DateTimeField()
+    duration = models.FloatField(help_text='Seconds')
+    bytes_in = models.BigIntegerField(null=True, blank=True)
+    bytes_out = models.BigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_OK)
+    error = models.TextField(blank=True)
+    slow = models.BooleanField(default=False, help_text='Took longer than its PIPELINE_SLOW_STAGES threshold')
+
+    class Meta:
+        ordering = ['started_at']
+        indexes = [models.Index(fields=['stage', 'started_at'])]
+
+    def __str__(self):
+        return f'{self.stage} {self.duration:.2f}s ({self.get_status_display()})'
@@ -0,0 +1,168 @@
+"""Split-and-merge encoding: cut the source at keyframes and encode the slices in parallel.
+
+Every slice is encoded by its own FFmpeg process into ``chunk_NNN.m3u8`` with
+its output timestamps offset to the slice's start, then the slice playlists
+are stitched into one ``playlist.m3u8`` with continuous segment numbering.
+"""
+import asyncio
+import logging
+import math
+import subprocess
+from pathlib import Path
+
+from django.conf import settings
+
+from .ffmpeg import (
+    CONTAINER_MPEGTS, DEFAULT_ENCODING, TranscodeError, arun_ffmpeg, build_single_command, segment_duration
+)
+from .thumbnails import build_sprites, poster_time
+
+logger = logging.getLogger(__name__)
+
+
+def use_parallel_encode(duration, encoding=None):
+    """Whether a source of ``duration`` seconds is worth splitting.
+
+    Only MPEG-TS output is split: its slice playlists can be concatenated.
+    """
+    if (encoding or DEFAULT_ENCODING).get('container', CONTAINER_MPEGTS) != CONTAINER_MPEGTS:
+        return False
+    chunks = getattr(settings, 'TRANSCODE_CHUNKS', 1)
+    min_duration = getattr(settings, 'TRANSCODE_PARALLEL_MIN_DURATION', 60)
+    return chunks > 1 and duration is not None and duration >= min_duration
+
+
+def keyframe_times(path):
+    """Times of the video keyframes in ``path``, read from packet flags without decoding.
+
+    The times are seconds from the start of the file (its ``start_time``),
+    which is what FFmpeg's ``-ss`` and ``-t`` count from, rather than the raw
+    presentation timestamps: an MPEG-TS capture may well start at 1.4 s or
+    at 10000 s.
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags:format=start_time',
+        '-of', 'csv',
+        str(path)
+    ]
+    times, start = [], 0.0
+    for line in subprocess.check_output(cmd, text=True).splitlines():
+        section, _, fields = line.partition(',')
+        if section == 'format':
+            start = float(fields) if fields not in ('', 'N/A') else 0.0
+        elif section == 'packet':
+            pts, _, flags = fields.partition(',')
+            if 'K' in flags and pts not in ('', 'N/A'):
+                times.append(float(pts))
+    return sorted(t - start for t in times)
+
+
+def split_points(keyframes, duration, chunks, min_chunk=DEFAULT_ENCODING['segment_duration']):
+    """Slice boundaries ``[0, k1, ..., duration]`` with every inner boundary on a keyframe.
+
+    Boundaries that would leave a slice shorter than one HLS segment are dropped.
+    """
+    bounds = [0.0]
+    for i in range(1, chunks):
+        target = duration * i / chunks
+        nearest = min(keyframes, key=lambda t: abs(t - target), default=None)
+        if nearest is None:
+            break
+        if nearest - bounds[-1] >= min_chunk and duration - nearest >= min_chunk:
+            bounds.append(nearest)
+    bounds.append(duration)
+    return bounds
+
+
+def merge_playlists(stream_dir, chunk_count, playlist_name='playlist.m3u8'):
+    """Stitch ``chunk_NNN.m3u8`` playlists into one, renaming segments to ``segment_NNN.ts``."""
+    stream_dir = Path(stream_dir)
+    entries = []
+    for i in range(chunk_count):
+        chunk_playlist = stream_dir / f'chunk_{i:03d}.m3u8'
+        extinf = None
+        for line in chunk_playlist.read_text().splitlines():
+            if line.startswith('#EXTINF:'):
+                extinf = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line and not line.startswith('#'):
+                entries.append((extinf, line))
+        chunk_playlist.unlink()
+
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:6',
+        f'#EXT-X-TARGETDURATION:{math.ceil(max(d for d, _ in entries))}',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-INDEPENDENT-SEGMENTS',
+    ]
+    for number, (extinf, name) in enumerate(entries):
+        segment = f'segment_{number:03d}.ts'
+        (stream_dir / name).rename(stream_dir / segment)
+        lines.extend([f'#EXTINF:{extinf:.6f},', segment])
+    lines.append('#EXT-X-ENDLIST')
+    (stream_dir / playlist_name).write_text('\n'.join(lines) + '\n')
+
+
+async def _encode_slices(commands, workers, progress):
+    """Run ``commands`` as concurrent FFmpeg subprocesses, at most ``workers`` at a time.
+
+    The first failure kills the slices still running.
+    """
+    limit = asyncio.Semaphore(max(1, workers))
+
+    async def encode(i, cmd):
+        async with limit:
+            await arun_ffmpeg(cmd, on_progress=progress.callback(i) if progress else None)
+
+    tasks = [asyncio.create_task(encode(i, cmd)) for i, cmd in enumerate(commands)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def parallel_encode(source, stream_dir, target_resolution, original_width, original_height, duration, encoding=None,
+                    progress=None, thumbnails=False):
+    """Encode ``source`` in keyframe-aligned slices on TRANSCODE_CHUNK_WORKERS processes.
+
+    ``progress`` (a ``video.progress.ProgressReporter``) receives each slice's
+    updates under the slice's index. With ``thumbnails`` every slice writes
+    its own scrub thumbnails and sprite sheets, the first slice the poster,
+    and one ``thumbnails.vtt`` covers them all.
+    """
+    chunks = getattr(settings, 'TRANSCODE_CHUNKS', 1)
+    workers = getattr(settings, 'TRANSCODE_CHUNK_WORKERS', chunks)
+
+    try:
+        keyframes = keyframe_times(source)
+    except (subprocess.SubprocessError, OSError) as e:
+        raise TranscodeError(f"Could not read keyframes: {e}")
+    bounds = split_points(keyframes, duration, chunks, segment_duration(encoding or DEFAULT_ENCODING))
+
+    commands = []
+    for i, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        last = i == len(bounds) - 2
+        commands.append(build_single_command(
+            source, stream_dir, target_resolution, original_width, original_height, encoding,
+            start=start,
+            duration=None if last else end - start,
+            segment_prefix=f'chunk_{i:03d}',
+            playlist_name=f'chunk_{i:03d}.m3u8',
+            thumbnail_prefix=f'thumb_{i:03d}' if thumbnails else None,
+            poster_at=min(poster_time(duration), (end - start) / 2) if thumbnails and i == 0 else None
+        ))
+
+    logger.info("Encoding %d slices with %d workers", len(commands), workers)
+    asyncio.run(_encode_slices(commands, workers, progress))
+
+    merge_playlists(stream_dir, len(commands))
+    if thumbnails:
+        build_sprites(stream_dir, [
+            (f'thumb_{i:03d}', start, end - start) for i, (start, end) in enumerate(zip(bounds, bounds[1:]))
+        ])
@@ -0,0 +1,108 @@
+"""Passthrough: segment compatible sources into HLS without re-encoding the video.
+
+A source whose video stream already is what players accept from the encoder
+(8-bit 4:2:0 H.264 Main/High up to PASSTHROUGH_MAX_LEVEL, progressive, not
+rotated, no larger and not much more bitrate-hungry than the target
+rendition, with a keyframe at least every PASSTHROUGH_MAX_KEYFRAME_INTERVAL
+seconds) is cut into segments with ``-c:v copy``. The audio is copied too
+when it is mono or stereo AAC-LC, and re-encoded otherwise. Such a job is
+bound by disk I/O rather than CPU. Adaptive (``abr``) targets always encode,
+since the lower rungs need scaling anyway, and ``Video.force_encode`` opts a
+single video out.
+"""
+import logging
+import subprocess
+
+from django.conf import settings
+
+from .ffmpeg import RESOLUTION_SETTINGS
+from .parallel import keyframe_times
+
+logger = logging.getLogger(__name__)
+
+COPY = 'copy'  # video and audio copied
+COPY_VIDEO = 'copy_video'  # video copied, audio encoded
+
+H264_PROFILES = {'Constrained Baseline', 'Main', 'High'}
+
+
+def _rotation(stream):
+    """Display rotation of a video stream in degrees; a copy into MPEG-TS would drop it."""
+    for side_data in stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            return int(side_data['rotation']) % 360
+    try:
+        return int(stream.get('tags', {}).get('rotate', 0)) % 360
+    except ValueError:
+        return 0
+
+
+def _max_keyframe_interval(path, start, duration):
+    """Longest stretch of ``path`` without a keyframe, in seconds."""
+    keyframes = keyframe_times(path)
+    if not keyframes or keyframes[0] - start > 0.1:
+        return float('inf')  # the stream does not open on a keyframe: a copied first segment would not decode
+    times = keyframes + [start + duration]
+    return max(b - a for a, b in zip(times, times[1:]))
+
+
+def video_incompatibility(video, stream):
+    """Why the video stream of ``video`` cannot be copied to its target, or None if it can."""
+    if stream.get('codec_name') != 'h264':
+        return f"codec {stream.get('codec_name') or 'unknown'}"
+    if stream.get('profile') not in H264_PROFILES:
+        return f"H.264 profile {stream.get('profile')}"
+    if not 0 < int(stream.get('level') or 0) <= getattr(settings, 'PASSTHROUGH_MAX_LEVEL', 42):
+        return f"H.264 level {stream.get('level')}"
+    if stream.get('pix_fmt') != 'yuv420p':
+        return f"pixel format {stream.get('pix_fmt')}"
+    if stream.get('field_order') not in (None, 'progressive', 'unknown'):
+        return 'interlaced'
+    if _rotation(stream):
+        return f'rotated {_rotation(stream)} degrees'
+
+    rendition = RESOLUTION_SETTINGS[video.target_resolution]
+    if rendition['size']:
+        width, height = map(int, rendition['size'].split('x'))
+        if (video.width or 0) > width or (video.height or 0) > height:
+            return f'{video.width}x{video.height} is larger than {rendition["size"]}'
+    bitrate = int(stream.get('bit_rate') or video.bitrate or 0)
+    scale = getattr(settings, 'PASSTHROUGH_MAX_BITRATE_SCALE', 1.5)
+    if scale is not None and bitrate > int(rendition['bitrate'].rstrip('k')) * 1000 * scale:
+        return f'{bitrate // 1000} kb/s is above the {rendition["bitrate"]}b/s rendition'
+    return None
+
+
+def audio_copyable(stream):
+    return stream.get('codec_name') == 'aac' and stream.get('profile') == 'LC' and 0 < int(stream.get('channels') or 0) <= 2
+
+
+def passthrough_mode(video):
+    """COPY, COPY_VIDEO or None (full encode) for ``video``, whose probe data is loaded."""
+    if video.force_encode or not getattr(settings, 'TRANSCODE_PASSTHROUGH', True):
+        return None
+    if video.target_resolution == 'abr' or not (video.probe_data and video.duration):
+        return None
+    streams = video.probe_data.get('streams', [])
+    video_stream = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio_stream = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    if video_stream is None:
+        return None
+
+    reason = video_incompatibility(video, video_stream)
+    if reason is None:
+        try:
+            # keyframe_times counts from the start of the file, which may precede the video stream
+            start = float(video_stream.get('start_time') or 0) - float(
+                video.probe_data.get('format', {}).get('start_time') or 0
+            )
+            interval = _max_keyframe_interval(video.video.path, start, video.duration)
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            reason = f'keyframes unreadable: {e}'
+        else:
+            if interval > getattr(settings, 'PASSTHROUGH_MAX_KEYFRAME_INTERVAL', 6):
+                reason = f'keyframe interval {interval:.1f}s'
+    if reason:
+        logger.info("Encoding video %s: %s", video.pk, reason)
+        return None
+    return COPY if audio_stream is None or audio_copyable(audio_stream) else COPY_VIDEO
@@ -0,0 +1,88 @@
+"""Per-title encoding: pick CRF and maxrate for one source from short trial encodes.
+
+A few scenes are sampled evenly across the source and trial-encoded at
+candidate CRFs. Quality is SSIM against the equally scaled source, averaged
+over the samples, and it falls as CRF rises, so a binary search finds the
+highest CRF (smallest output) that still reaches the profile's target. The
+maxrate cap is then tightened to what that CRF actually needed, so static
+content does not reserve the bitrate that fast motion requires.
+"""
+import os
+import re
+import tempfile
+
+from .ffmpeg import _scale_filter, run_ffmpeg, video_codec_args
+
+SSIM_RE = re.compile(r'SSIM .*All:([0-9.]+)')
+
+# Headroom above the sampled bitrate when deriving the maxrate cap
+MAXRATE_HEADROOM = 1.5
+
+
+def sample_offsets(duration, count, sample_duration):
+    """Start times of ``count`` samples spread evenly over the source."""
+    if duration <= sample_duration:
+        return [0.0]
+    span = duration - sample_duration
+    return [span * (i + 1) / (count + 1) for i in range(count)]
+
+
+def trial_encode(source, offset, sample_duration, crf, encoding, size, workdir):
+    """Encode one sample at ``crf`` and return ``(bits_per_second, ssim)``."""
+    output = os.path.join(workdir, f'trial_{offset:.0f}_{crf}.mp4')
+    scale = ['-vf', _scale_filter(size)] if size else []
+    run_ffmpeg(
+        ['ffmpeg', '-y', '-ss', f'{offset:.3f}', '-t', str(sample_duration), '-i', str(source), '-an']
+        + scale + video_codec_args(encoding) + ['-crf', str(crf), output]
+    )
+    bitrate = os.path.getsize(output) * 8 / sample_duration
+
+    reference = f'[1:v]{_scale_filter(size)}[ref]' if size else '[1:v]null[ref]'
+    log = run_ffmpeg([
+        'ffmpeg', '-i', output,
+        '-ss', f'{offset:.3f}', '-t', str(sample_duration), '-i', str(source),
+        '-lavfi', f'{reference};[0:v][ref]ssim', '-f', 'null', '-'
+    ])
+    match = SSIM_RE.search(log or '')
+    return bitrate, float(match.group(1)) if match else 0.0
+
+
+def choose_encoding(source, duration, profile, size, reference_bitrate):
+    """Return ``profile``'s encoding with CRF and maxrate_scale tuned for ``source``.
+
+    ``size`` is the output frame size (``'WxH'``, or None to keep the source
+    size) and ``reference_bitrate`` the ladder's maxrate in bits per second for
+    that size.
+    """
+    encoding = profile.as_encoding()
+    offsets = sample_offsets(duration, profile.sample_count, profile.sample_duration)
+    # A source shorter than one sample is encoded whole; its bitrate is over what it lasts
+    sample_duration = min(profile.sample_duration, duration)
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix='per_title_') as workdir:
+        def measure(crf):
+            if crf not in results:
+                trials = [trial_encode(source, o, sample_duration, crf, encoding, size, workdir) for o in offsets]
+                results[crf] = (
+                    sum(b for b, _ in trials) / len(trials),
+                    sum(q for _, q in trials) / len(trials),
+                )
+            return results[crf]
+
+        low, high = profile.crf_min, profile.crf_max
+        best = low
+        while low <= high:
+            crf = (low + high) // 2
+            if measure(crf)[1] >= profile.target_ssim:
+                best, low = crf, crf + 1
+            else:
+                high = crf - 1
+        bitrate, ssim = measure(best)
+
+    encoding['crf'] = best
+    encoding['maxrate_scale'] = round(
+        min(profile.maxrate_scale, max(0.25, bitrate * MAXRATE_HEADROOM / reference_bitrate)), 3
+    )
+    encoding['per_title'] = {'ssim': round(ssim, 4), 'sample_bitrate': int(bitrate)}
+    return encoding
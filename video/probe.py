@@ -0,0 +1,98 @@
+import json
+import os
+import subprocess
+
+# Video fields filled from one ffprobe run
+PROBE_FIELDS = [
+    'duration', 'width', 'height', 'video_codec', 'audio_codec',
+    'bitrate', 'fps', 'audio_layout', 'probe_data', 'probe_key',
+]
+
+
+def probe_key(path):
+    """Cache key for a source file: its path, size and modification time."""
+    st = os.stat(path)
+    return f'{path}:{st.st_size}:{st.st_mtime_ns}'
+
+
+def run_ffprobe(path):
+    """Return ffprobe's ``-show_format -show_streams`` output for ``path`` as a dict."""
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_format',
+        '-show_streams',
+        '-of', 'json',
+        str(path)
+    ]
+    return json.loads(subprocess.check_output(cmd, text=True, stderr=subprocess.PIPE))
+
+
+def run_ffprobe_head(data, timeout=30):
+    """ffprobe's view of the first bytes of a file, fed on stdin; {} if it could not read them.
+
+    ffprobe stops reading once it has the headers, so a head cut off in the
+    middle of the media data still probes like the whole file.
+    """
+    cmd = ['ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json', '-i', 'pipe:0']
+    result = subprocess.run(cmd, input=data, capture_output=True, timeout=timeout)
+    try:
+        return json.loads(result.stdout or '{}')
+    except ValueError:
+        return {}
+
+
+def _parse_rate(rate):
+    num, _, den = (rate or '').partition('/')
+    try:
+        return float(num) / float(den or 1) or None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def metadata_from_probe(data):
+    """Map ffprobe JSON onto the Video metadata fields."""
+    streams = data.get('streams', [])
+    video_stream = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    audio_stream = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+    fmt = data.get('format', {})
+
+    def number(value, cast):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        'duration': number(fmt.get('duration'), float),
+        'width': number(video_stream.get('width'), int),
+        'height': number(video_stream.get('height'), int),
+        'video_codec': video_stream.get('codec_name', ''),
+        'audio_codec': audio_stream.get('codec_name', ''),
+        'bitrate': number(fmt.get('bit_rate'), int),
+        'fps': _parse_rate(video_stream.get('avg_frame_rate')) or _parse_rate(video_stream.get('r_frame_rate')),
+        'audio_layout': audio_stream.get('channel_layout') or (
+            f"{audio_stream['channels']}ch" if audio_stream.get('channels') else ''
+        ),
+        'probe_data': data,
+    }
+
+
+def probe_video(video):
+    """Fill ``video``'s metadata fields from its source file, probing at most once per file version.
+
+    The probe is skipped when ``video.probe_key`` still matches the file's
+    path, size and mtime. Fresh results are written back for saved videos.
+    Returns True if ffprobe ran.
+    """
+    key = probe_key(video.video.path)
+    if video.probe_key == key:
+        return False
+
+    fields = metadata_from_probe(run_ffprobe(video.video.path))
+    fields['probe_key'] = key
+    for name, value in fields.items():
+        setattr(video, name, value)
+    if video.pk:
+        type(video).objects.filter(pk=video.pk).update(**fields)
+    return True
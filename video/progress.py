@@ -0,0 +1,60 @@
+"""Live encode progress: FFmpeg ``-progress`` updates folded into the job row.
+
+One reporter serves every FFmpeg process of a job, so the slices of a
+parallel encode are summed into a single percentage. Database writes are
+throttled to one per TRANSCODE_PROGRESS_INTERVAL seconds.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import TranscodeJob
+
+
+class ProgressReporter:
+    def __init__(self, job_id, duration=None, interval=None):
+        self.job_id = job_id
+        self.duration = duration
+        self.interval = interval if interval is not None else getattr(settings, 'TRANSCODE_PROGRESS_INTERVAL', 2)
+        self._lock = threading.Lock()
+        self._done = {}
+        self._rates = {}
+        self._last_write = 0.0
+
+    def callback(self, key=0):
+        """An ``on_progress`` callable for ``run_ffmpeg`` that reports under ``key``."""
+        def on_progress(seconds, fps, speed):
+            self.update(key, seconds, fps, speed)
+        return on_progress
+
+    def update(self, key, seconds, fps, speed):
+        with self._lock:
+            if seconds is not None:
+                self._done[key] = max(0.0, seconds)
+            self._rates[key] = (fps, speed)
+            now = time.monotonic()
+            if now - self._last_write < self.interval:
+                return
+            self._last_write = now
+            fields = self._fields()
+        TranscodeJob.objects.filter(pk=self.job_id).update(**fields)
+
+    def finish(self):
+        """Drop per-process rates once every FFmpeg process has exited."""
+        with self._lock:
+            self._rates.clear()
+            fields = self._fields()
+        TranscodeJob.objects.filter(pk=self.job_id).update(**fields)
+
+    def _fields(self):
+        done = sum(self._done.values())
+        fps = sum(f for f, _ in self._rates.values() if f) or None
+        speed = sum(s for _, s in self._rates.values() if s) or None
+        fields = {'fps': fps, 'speed': speed, 'eta_seconds': None, 'progress_at': timezone.now()}
+        if self.duration:
+            fields['progress'] = round(min(100.0, done * 100 / self.duration), 1)
+            if speed:
+                fields['eta_seconds'] = int(max(0.0, self.duration - done) / speed)
+        return fields
@@ -0,0 +1,87 @@
+"""Full-text search over video captions.
+
+On SQLite the captions are indexed in the FTS5 table ``video_search`` (rowid =
+video id), created by migration 0020 and kept current by ``video.signals``
+and ``video.ingest``. Matches are ranked by bm25. On other databases, or a
+SQLite built without FTS5, search falls back to a case-insensitive substring
+match, newest first.
+"""
+import re
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'video_search'
+WORD_RE = re.compile(r'\w+')
+
+# Database alias -> whether FTS_TABLE exists there
+_enabled = {}
+
+
+def fts_enabled(using='default'):
+    if using not in _enabled:
+        connection = connections[using]
+        _enabled[using] = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _enabled[using]
+
+
+def fts_query(text):
+    """FTS5 query matching every word of ``text`` as a prefix, or None if it has no words.
+
+    Words are quoted, so user input never reaches the FTS5 query syntax.
+    """
+    words = WORD_RE.findall(text)
+    return ' '.join(f'"{word}"*' for word in words) or None
+
+
+def index_videos(videos, using='default'):
+    """Add or refresh the captions of ``videos`` (saved ``Video`` instances) in the index."""
+    rows = [(video.pk, video.caption) for video in videos if video.pk is not None]
+    if not rows or not fts_enabled(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk, _ in rows])
+        cursor.executemany(f'INSERT INTO {FTS_TABLE}(rowid, caption) VALUES (%s, %s)', rows)
+
+
+def unindex_video(pk, using='default'):
+    if fts_enabled(using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+
+
+def filter_matching(queryset, text):
+    """``queryset`` narrowed to videos whose caption matches ``text``, in its own order."""
+    query = fts_query(text)
+    if query is None:
+        return queryset
+    if not fts_enabled(queryset.db):
+        return queryset.filter(caption__icontains=text.strip())
+    return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [query]))
+
+
+def search(queryset, text, offset=0, limit=20):
+    """``(total, videos)``: one page of the videos in ``queryset`` matching ``text``, best match first.
+
+    Without search words the page is the newest videos of ``queryset``.
+    """
+    query = fts_query(text)
+    if query is None or not fts_enabled(queryset.db):
+        matches = filter_matching(queryset, text).order_by('-created_at', '-pk')
+        return matches.count(), list(matches[offset:offset + limit])
+
+    # The FTS table drives the query: the queryset's filters are checked per match by primary key
+    subquery, params = (
+        queryset.filter(pk=RawSQL(f'{FTS_TABLE}.rowid', ())).order_by().values('pk').query.sql_with_params()
+    )
+    where = f'{FTS_TABLE} MATCH %s AND EXISTS ({subquery})'
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'SELECT count(*) FROM {FTS_TABLE} WHERE {where}', [query, *params])
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {where} ORDER BY rank LIMIT %s OFFSET %s',
+            [query, *params, limit, offset]
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+    videos = queryset.in_bulk(ids)
+    return total, [videos[pk] for pk in ids if pk in videos]
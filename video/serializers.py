@@ -0,0 +1,16 @@
+from rest_framework import serializers
+
+from .models import Video
+
+# Everything a player needs to list and start a video
+CATALOGUE_FIELDS = [
+    'id', 'caption', 'processed_video', 'poster_url', 'thumbnails_vtt_url', 'target_resolution', 'duration', 'width',
+    'height', 'created_at'
+]
+
+
+class CatalogueVideoSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Video
+        fields = CATALOGUE_FIELDS
+        read_only_fields = CATALOGUE_FIELDS
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalogue import invalidate_catalogue
+from .models import Video
+from .search import index_videos, unindex_video
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def video_changed(sender, **kwargs):
+    invalidate_catalogue()
+
+
+@receiver(post_save, sender=Video)
+def index_caption(sender, instance, using, update_fields=None, **kwargs):
+    # Pipeline saves name their fields; only those touching the caption need the index
+    if update_fields is None or 'caption' in update_fields:
+        index_videos([instance], using)
+
+
+@receiver(post_delete, sender=Video)
+def unindex_caption(sender, instance, using, **kwargs):
+    unindex_video(instance.pk, using)
@@ -0,0 +1,119 @@
+"""Staged HLS output: encode out of sight, then publish with one rename.
+
+Encodes write into a private directory under ``MEDIA_ROOT/processed/.staging``,
+on the same filesystem as the published outputs, so finishing an encode is a
+single ``os.rename`` and players never see a half-written playlist. A
+published directory is never replaced: if the target already exists, the
+encode is published next to it under a name of its own, and the video row
+is pointed there. Files get
+their final permissions when FFmpeg creates them, from the worker's
+TRANSCODE_UMASK, instead of a ``chmod -R`` over the finished tree.
+"""
+import errno
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+STAGING_DIR_NAME = '.staging'
+
+
+def staging_root():
+    return Path(settings.MEDIA_ROOT) / 'processed' / STAGING_DIR_NAME
+
+
+def apply_umask():
+    """Set the process umask so encoder output is created world-readable; see TRANSCODE_UMASK."""
+    os.umask(getattr(settings, 'TRANSCODE_UMASK', 0o022))
+
+
+def publish(staging_dir, final_dir):
+    """Move a finished ``staging_dir`` to ``final_dir`` with a rename; returns where it went.
+
+    If ``final_dir`` already holds an earlier encode of the same
+    content-addressed output, which players may be reading, it is left
+    alone and the new output goes to ``<final_dir>_<suffix>`` instead, the
+    suffix being the staging directory's unique one.
+    """
+    final_dir = Path(final_dir)
+    try:
+        os.rename(staging_dir, final_dir)
+        return final_dir
+    except OSError as e:
+        if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+            raise
+    versioned = final_dir.with_name(f"{final_dir.name}_{Path(staging_dir).name.rsplit('.', 1)[1]}")
+    os.rename(staging_dir, versioned)
+    return versioned
+
+
+class staged_output:
+    """Context manager yielding a fresh staging directory, published if the block succeeds.
+
+    ``final_dir`` is where the output is wanted; after the block it is
+    where ``publish`` actually put it. On an exception the staging
+    directory is removed and nothing is published.
+    """
+
+    def __init__(self, final_dir):
+        self.final_dir = Path(final_dir)
+        self.staging_dir = None
+
+    def __enter__(self):
+        root = staging_root()
+        root.mkdir(parents=True, exist_ok=True)
+        self.staging_dir = Path(tempfile.mkdtemp(dir=root, prefix=f'{self.final_dir.name}.'))
+        # mkdtemp creates the directory private (0700); open it up to what the umask allows
+        os.chmod(self.staging_dir, 0o777 & ~getattr(settings, 'TRANSCODE_UMASK', 0o022))
+        return self.staging_dir
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            return False
+        self.final_dir = publish(self.staging_dir, self.final_dir)
+        return False
+
+
+def _last_modified(path):
+    """Newest mtime of ``path`` and everything below it."""
+    newest = path.stat().st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                newest = max(newest, os.stat(os.path.join(root, name)).st_mtime)
+            except FileNotFoundError:
+                pass
+    return newest
+
+
+def collect_staging(older_than):
+    """Delete staging directories left by crashed encodes. Returns how many were removed.
+
+    Other workers may share MEDIA_ROOT, so only directories in which nothing
+    has been written for ``older_than`` seconds are treated as abandoned.
+    """
+    root = staging_root()
+    if not root.is_dir():
+        return 0
+    cutoff = time.time() - older_than
+    removed = 0
+    for staging_dir in root.iterdir():
+        try:
+            if _last_modified(staging_dir) > cutoff:
+                continue
+        except FileNotFoundError:
+            continue  # published or cleaned up meanwhile
+        logger.info("Removing abandoned staging directory %s", staging_dir)
+        if staging_dir.is_dir():
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        else:
+            staging_dir.unlink(missing_ok=True)
+        removed += 1
+    return removed
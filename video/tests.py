@@ -1,3 +1,1297 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import signals
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import close_old_connections
+from django.middleware.csrf import _get_new_csrf_string
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from mysql.connector import DataError, InterfaceError
+
+from .admission import AdmissionRejected, check_upload
+from .asgi import StreamingUploads
+from .benchmark import compare
+from .ffmpeg import (
+    CONTAINER_FMP4, CONTAINER_SINGLE_FILE, DEFAULT_ENCODING, TranscodeError, _parse_progress, _watch_progress,
+    abr_rungs, build_abr_command, hls_args
+)
+from .jobs import claim_next_job, requeue_job, requeue_stale_jobs, resolve_duplicates
+from .lifecycle import DELETE_SOURCE, compress_source, plan
+from .media import _parse_range, serve_processed
+from .metrics import record
+from .models import ChunkedUpload, EncodingProfile, TranscodeJob, Video, VodSyncOutbox
+from .parallel import keyframe_times, merge_playlists, split_points
+from .per_title import choose_encoding
+from .probe import probe_video
+from .search import fts_enabled, fts_query, index_videos, search
+from .staging import collect_staging, publish, staged_output, staging_root
+from .thumbnails import THUMBNAILS_VTT_NAME, build_sprites, poster_time
+from .transcode import SUPERSEDED_MARKER, prune_unreferenced_outputs, transcode_video
+from .uploads import UploadOffsetConflict, append_chunk, collect_stale_uploads
+from .validation import AVI, MATROSKA, MP4, sniff_container, validate_head
+from .viewcount import SINKS, ViewCounter, _flush_vod, count_view
+from .vod_sync import drain_outbox
+
+
+def mp4_box(kind, payload=b''):
+    return (8 + len(payload)).to_bytes(4, 'big') + kind + payload
+
+
+FTYP = mp4_box(b'ftyp', b'isom\x00\x00\x02\x00isomiso2avc1mp41')
+MOOV = mp4_box(b'moov', mp4_box(b'mvhd', bytes(100)))
+MDAT = mp4_box(b'mdat', bytes(1000))
+PROBED = {
+    'format': {'duration': '30.0'},
+    'streams': [{'codec_type': 'video', 'codec_name': 'h264', 'width': 640, 'height': 360}],
+}
+
+
+def saved_video(**fields):
+    # bulk_create skips Video.save(), which would validate and queue a file that is not there
+    fields = dict({'caption': 'clip', 'video': 'video/26/clip.mp4'}, **fields)
+    return Video.objects.bulk_create([Video(**fields)])[0]
+
+
+@mock.patch('video.validation.run_ffprobe_head', return_value=PROBED)
+class ValidateHeadTests(SimpleTestCase):
+    def test_sniff_container(self, probe):
+        self.assertEqual(sniff_container(FTYP + MOOV), MP4)
+        self.assertEqual(sniff_container(b'\x1a\x45\xdf\xa3' + bytes(20)), MATROSKA)
+        self.assertEqual(sniff_container(b'RIFF\x00\x00\x00\x00AVI LIST'), AVI)
+        self.assertIsNone(sniff_container(b'<html><body>not a video</body>'))
+
+    def test_faststart_head_is_probed(self, probe):
+        head = FTYP + MOOV + MDAT[:500]
+        self.assertEqual(validate_head(head)['duration'], 30.0)
+        probe.assert_called_once_with(head)
+
+    def test_moov_at_end_of_complete_file_is_probed(self, probe):
+        data = FTYP + MDAT + MOOV
+        self.assertEqual(validate_head(data, complete=True)['video_codec'], 'h264')
+        probe.assert_called_once_with(data)
+
+    def test_moov_at_end_of_truncated_head_is_undecided(self, probe):
+        self.assertIsNone(validate_head(FTYP + MDAT[:500]))
+        probe.assert_not_called()
+
+    def test_truncated_moov_is_undecided(self, probe):
+        self.assertIsNone(validate_head(FTYP + MOOV[:50]))
+        probe.assert_not_called()
+
+    def test_unknown_container_is_rejected(self, probe):
+        with self.assertRaisesMessage(ValidationError, 'Unsupported file format'):
+            validate_head(b'%PDF-1.7' + bytes(100), complete=True)
+        probe.assert_not_called()
+
+    def test_unreadable_video_is_rejected(self, probe):
+        probe.return_value = {}
+        with self.assertRaisesMessage(ValidationError, 'not a readable video'):
+            validate_head(b'\x1a\x45\xdf\xa3' + bytes(100))
+
+    def test_over_long_video_is_rejected(self, probe):
+        probe.return_value = dict(PROBED, format={'duration': '3600'})
+        with self.assertRaisesMessage(ValidationError, 'cannot exceed 10 minutes'):
+            validate_head(FTYP + MOOV)
+
+
+class UploadProbeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def test_probe_of_received_upload_is_kept_for_the_encode(self):
+        upload = SimpleUploadedFile('clip.mp4', FTYP + MOOV + MDAT, content_type='video/mp4')
+        with override_settings(MEDIA_ROOT=self.media_root), \
+                mock.patch('video.models.run_ffprobe_head', return_value=PROBED) as probe:
+            video = Video(caption='clip', video=upload)
+            video.full_clean()
+            video.save()
+            probe.assert_called_once()
+            video.refresh_from_db()
+            self.assertEqual(video.duration, 30.0)
+            self.assertTrue(video.probe_key)
+            with mock.patch('video.probe.run_ffprobe') as full_probe:
+                self.assertFalse(probe_video(video))
+                full_probe.assert_not_called()
+
+    def test_over_long_upload_is_rejected_by_clean(self):
+        upload = SimpleUploadedFile('clip.mp4', FTYP + MDAT + MOOV, content_type='video/mp4')
+        with mock.patch('video.models.run_ffprobe_head', return_value=dict(PROBED, format={'duration': '3600'})):
+            with self.assertRaisesMessage(ValidationError, 'cannot exceed 10 minutes'):
+                Video(caption='clip', video=upload).clean()
+
+
+class AbandonedUploadTests(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        settings = override_settings(
+            FILE_UPLOAD_TEMP_DIR=self.temp_dir, MEDIA_ROOT=self.temp_dir, UPLOAD_MAX_LOAD=None,
+            UPLOAD_MAX_PENDING_PER_USER=1, UPLOAD_MIN_FREE_BYTES=0, UPLOAD_STALE_AFTER=3600
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create(username='editor', is_staff=True)
+
+    def abandoned_upload(self, size=10):
+        upload = ChunkedUpload.objects.create(user=self.user, filename='a.mp4', size=size)
+        ChunkedUpload.objects.filter(pk=upload.pk).update(updated_at=timezone.now() - timedelta(hours=2))
+        upload.temp_path.parent.mkdir(parents=True, exist_ok=True)
+        upload.temp_path.write_bytes(b'partial')
+        return upload
+
+    def test_abandoned_uploads_do_not_count_against_limits(self):
+        self.abandoned_upload(size=10 ** 15)
+        check_upload(self.user, 10)
+        ChunkedUpload.objects.create(user=self.user, filename='b.mp4', size=10)
+        with self.assertRaises(AdmissionRejected) as rejected:
+            check_upload(self.user, 10)
+        self.assertEqual(rejected.exception.status, 429)
+
+    def test_collect_stale_uploads_removes_rows_and_partial_files(self):
+        upload = self.abandoned_upload()
+        live = ChunkedUpload.objects.create(user=self.user, filename='b.mp4', size=10)
+        self.assertEqual(collect_stale_uploads(), 1)
+        self.assertFalse(upload.temp_path.exists())
+        self.assertEqual(list(ChunkedUpload.objects.all()), [live])
+
+
+class ResolveDuplicatesTests(TestCase):
+    def video(self, **fields):
+        return saved_video(source_sha256='ab' * 32, **fields)
+
+    def test_waiting_upload_with_other_force_encode_is_not_served(self):
+        original = self.video(status=Video.STATUS_DONE, processed_video='/media/processed/ab/playlist.m3u8')
+        copied_ok = self.video(status=Video.STATUS_QUEUED)
+        must_encode = self.video(status=Video.STATUS_QUEUED, force_encode=True)
+
+        resolve_duplicates(original)
+        copied_ok.refresh_from_db()
+        must_encode.refresh_from_db()
+        self.assertEqual(copied_ok.processed_video, original.processed_video)
+        self.assertEqual(must_encode.status, Video.STATUS_QUEUED)
+        self.assertIsNone(must_encode.processed_video)
+
+
+@override_settings(
+    TRANSCODE_MAX_RUNNING=None, TRANSCODE_MAX_RUNNING_PER_USER=None, TRANSCODE_MAX_LOAD=None,
+    TRANSCODE_KIND_LIMITS={'ingest': 1}, TRANSCODE_MAX_ATTEMPTS=2
+)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def job(self, **fields):
+        return TranscodeJob.objects.create(video=saved_video(status=Video.STATUS_QUEUED), **fields)
+
+    def test_jobs_are_claimed_by_priority_then_age(self):
+        old, urgent, new = self.job(), self.job(priority=5), self.job()
+        self.assertEqual([claim_next_job().pk for _ in range(3)], [urgent.pk, old.pk, new.pk])
+        self.assertIsNone(claim_next_job())
+        urgent.refresh_from_db()
+        self.assertEqual((urgent.status, urgent.attempts), (Video.STATUS_RUNNING, 1))
+        self.assertEqual(urgent.video.status, Video.STATUS_RUNNING)
+
+    def test_kind_limit_holds_back_jobs(self):
+        first = self.job(kind=TranscodeJob.KIND_INGEST)
+        self.job(kind=TranscodeJob.KIND_INGEST)
+        self.assertEqual(claim_next_job().pk, first.pk)
+        self.assertIsNone(claim_next_job())
+
+    def test_global_limit_defers_claims(self):
+        self.job()
+        self.job()
+        with override_settings(TRANSCODE_MAX_RUNNING=1):
+            self.assertIsNotNone(claim_next_job())
+            self.assertIsNone(claim_next_job())
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = self.job()
+        claim_next_job()
+        TranscodeJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(60), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.video.status), (Video.STATUS_QUEUED, Video.STATUS_QUEUED))
+
+    def test_requeued_job_starts_over_without_old_progress(self):
+        job = self.job()
+        claim_next_job()
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        TranscodeJob.objects.filter(pk=job.pk).update(
+            started_at=an_hour_ago, progress=40, fps=25, speed=1.2, eta_seconds=90, progress_at=an_hour_ago
+        )
+        self.assertEqual(requeue_stale_jobs(60), 1)
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.progress, job.fps, job.speed, job.eta_seconds, job.progress_at), (0, None, None, None, None)
+        )
+        # Claimed again, it is not stale before reporting any progress of its own
+        claim_next_job()
+        self.assertEqual(requeue_stale_jobs(60), 0)
+
+    def test_lost_job_is_requeued_until_out_of_attempts(self):
+        job = self.job()
+        claim_next_job()
+        self.assertEqual(requeue_job(job.pk, 'died'), Video.STATUS_QUEUED)
+        claim_next_job()
+        self.assertEqual(requeue_job(job.pk, 'died'), Video.STATUS_FAILED)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), (Video.STATUS_FAILED, 2, 'died'))
+
+    def test_unstarted_claim_is_handed_back_without_an_attempt(self):
+        job = self.job()
+        claim_next_job()
+        self.assertEqual(requeue_job(job.pk, attempted=False), Video.STATUS_QUEUED)
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 0)
+
+
+class SplitMergeTests(SimpleTestCase):
+    @mock.patch('video.parallel.subprocess.check_output', return_value=(
+        'packet,1.400000,K__\npacket,1.433333,___\npacket,3.400000,K__\npacket,N/A,K__\nformat,1.400000\n'
+    ))
+    def test_keyframe_times_count_from_the_file_start(self, check_output):
+        self.assertEqual([round(t, 6) for t in keyframe_times('clip.ts')], [0.0, 2.0])
+
+    def test_split_points_snap_to_keyframes(self):
+        keyframes = [i * 2.5 for i in range(17)]
+        self.assertEqual(split_points(keyframes, 40.0, 4, min_chunk=4), [0.0, 10.0, 20.0, 30.0, 40.0])
+        self.assertEqual(split_points([0.0, 9.0, 21.0], 40.0, 4, min_chunk=4), [0.0, 9.0, 21.0, 40.0])
+
+    def test_split_points_drop_short_slices(self):
+        self.assertEqual(split_points([0.0, 1.0, 39.0], 40.0, 2, min_chunk=4), [0.0, 40.0])
+        self.assertEqual(split_points([], 40.0, 4), [0.0, 40.0])
+
+    def test_merge_playlists_renumbers_segments(self):
+        stream_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, stream_dir)
+        chunks = [[('chunk_000_000.ts', 4.0), ('chunk_000_001.ts', 2.5)], [('chunk_001_000.ts', 6.2)]]
+        for i, segments in enumerate(chunks):
+            lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:7']
+            for name, extinf in segments:
+                lines += [f'#EXTINF:{extinf},', name]
+                (Path(stream_dir) / name).write_bytes(name.encode())
+            (Path(stream_dir) / f'chunk_{i:03d}.m3u8').write_text('\n'.join(lines + ['#EXT-X-ENDLIST']))
+
+        merge_playlists(stream_dir, 2)
+        playlist = (Path(stream_dir) / 'playlist.m3u8').read_text().splitlines()
+        self.assertIn('#EXT-X-TARGETDURATION:7', playlist)
+        self.assertEqual([line for line in playlist if not line.startswith('#')],
+                         ['segment_000.ts', 'segment_001.ts', 'segment_002.ts'])
+        self.assertEqual(playlist[-1], '#EXT-X-ENDLIST')
+        self.assertEqual((Path(stream_dir) / 'segment_002.ts').read_bytes(), b'chunk_001_000.ts')
+        self.assertEqual(sorted(p.name for p in Path(stream_dir).iterdir()),
+                         ['playlist.m3u8', 'segment_000.ts', 'segment_001.ts', 'segment_002.ts'])
+
+
+class ProcessedMediaTests(SimpleTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root, MEDIA_SENDFILE_HEADER=None)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        segment = Path(self.media_root) / 'processed' / 'ab' / 'segment_000.ts'
+        segment.parent.mkdir(parents=True)
+        segment.write_bytes(bytes(range(100)))
+        response = serve_processed(RequestFactory().get('/'), 'ab/segment_000.ts')
+        response.close()
+        self.etag = response['ETag']
+        self.last_modified = http_date(int(segment.stat().st_mtime))
+
+    def get(self, **headers):
+        response = serve_processed(RequestFactory().get('/', headers=headers), 'ab/segment_000.ts')
+        self.addCleanup(response.close)
+        return response
+
+    def test_parse_range(self):
+        self.assertEqual(_parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(_parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(_parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(_parse_range('bytes=50-500', 100), (50, 99))
+        self.assertIs(_parse_range('bytes=100-', 100), False)
+        self.assertIs(_parse_range('bytes=9-0', 100), False)
+        self.assertIsNone(_parse_range('bytes=0-1,5-9', 100))
+        self.assertIsNone(_parse_range('items=0-9', 100))
+        self.assertIsNone(_parse_range('bytes=-', 100))
+
+    def test_if_none_match(self):
+        self.assertEqual(self.get(if_none_match=self.etag).status_code, 304)
+        self.assertEqual(self.get(if_none_match=f'"other", W/{self.etag}').status_code, 304)
+        self.assertEqual(self.get(if_none_match='*').status_code, 304)
+        self.assertEqual(self.get(if_none_match='"other"').status_code, 200)
+        self.assertEqual(self.get(if_none_match='"other"', if_modified_since=self.last_modified).status_code, 200)
+
+    def test_range(self):
+        response = self.get(range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(self.get(range='bytes=200-').status_code, 416)
+
+    def test_range_is_honoured_only_while_if_range_matches(self):
+        self.assertEqual(self.get(range='bytes=10-19', if_range=self.etag).status_code, 206)
+        self.assertEqual(self.get(range='bytes=10-19', if_range=self.last_modified).status_code, 206)
+        for stale in ['"other"', f'W/{self.etag}', http_date(0)]:
+            response = self.get(range='bytes=10-19', if_range=stale)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), bytes(range(100)))
+
+
+class SearchTests(TestCase):
+    def test_fts_query_quotes_every_word_as_a_prefix(self):
+        self.assertEqual(fts_query('Cat videos'), '"Cat"* "videos"*')
+        self.assertEqual(fts_query('cat" OR caption:dog*'), '"cat"* "OR"* "caption"* "dog"*')
+        self.assertEqual(fts_query('déjà-vu'), '"déjà"* "vu"*')
+        self.assertIsNone(fts_query(' -*" '))
+
+    def test_search_matches_word_prefixes(self):
+        videos = [saved_video(caption=caption) for caption in ['Cats at play', 'A dog', 'Category theory', 'Cat']]
+        index_videos(videos)
+        total, found = search(Video.objects.all(), 'cat')
+        self.assertEqual(total, 3)
+        self.assertEqual({video.caption for video in found}, {'Cats at play', 'Category theory', 'Cat'})
+        if fts_enabled():
+            total, found = search(Video.objects.exclude(caption='Cat'), 'cat play')
+            self.assertEqual((total, [video.caption for video in found]), (1, ['Cats at play']))
+            self.assertEqual(search(Video.objects.all(), 'cat"')[0], 3)
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    def test_compare_flags_regressions_beyond_the_tolerance(self):
+        baseline = {'results': [
+            {'name': '720p-10s', 'wall_s': 10.0, 'cpu_s': 20.0, 'peak_rss_mb': 100.0, 'speed': 1.0},
+            {'name': 'dropped', 'wall_s': 5.0},
+        ]}
+        report = {'results': [
+            {'name': '720p-10s', 'wall_s': 10.4, 'cpu_s': 25.0, 'peak_rss_mb': 80.0, 'speed': 0.8},
+            {'name': 'new', 'wall_s': 1.0},
+            {'name': 'broken', 'error': 'ffmpeg failed'},
+        ]}
+        rows, regressions = compare(report, baseline, tolerance=0.1)
+        self.assertEqual([(metric, round(change, 2)) for _, metric, _, _, change in rows],
+                         [('wall_s', 0.04), ('cpu_s', 0.25), ('peak_rss_mb', -0.2), ('speed', -0.2)])
+        self.assertEqual([metric for _, metric, _, _, _ in regressions], ['cpu_s', 'speed'])
+
+    def test_compare_skips_metrics_missing_from_the_baseline(self):
+        baseline = {'results': [{'name': 'a', 'wall_s': 0, 'speed': 2.0}]}
+        rows, regressions = compare({'results': [{'name': 'a', 'wall_s': 3.0}]}, baseline, tolerance=0.1)
+        self.assertEqual((rows, regressions), ([], []))
+
+
+class FFmpegProgressTests(SimpleTestCase):
+    def test_parse_progress(self):
+        block = {'frame': '250', 'fps': '49.8', 'out_time_us': '10000000', 'speed': '1.99x', 'progress': 'continue'}
+        self.assertEqual(_parse_progress(block), (10.0, 49.8, 1.99))
+        # Before the first frame is out FFmpeg reports N/A; older builds only have out_time_ms (in microseconds too)
+        self.assertEqual(_parse_progress({'out_time_us': 'N/A', 'fps': '0.00', 'speed': 'N/A'}), (None, 0.0, None))
+        self.assertEqual(_parse_progress({'out_time_ms': '2500000'}), (2.5, None, None))
+
+    def watch(self, lines, stall_timeout=1):
+        updates = []
+
+        async def watch():
+            stdout = asyncio.StreamReader()
+            for line in lines:
+                stdout.feed_data(line)
+            if lines[-1].startswith(b'progress=end'):
+                stdout.feed_eof()
+            await _watch_progress(mock.Mock(stdout=stdout), lambda *update: updates.append(update), 10, stall_timeout)
+
+        asyncio.run(watch())
+        return updates
+
+    def test_watch_progress_reports_every_block(self):
+        updates = self.watch([
+            b'out_time_us=1000000\n', b'speed=1.0x\n', b'progress=continue\n',
+            b'out_time_us=2000000\n', b'speed=2.0x\n', b'progress=end\n',
+        ])
+        self.assertEqual(updates, [(1.0, None, 1.0), (2.0, None, 2.0)])
+
+    def test_watch_progress_gives_up_on_a_stalled_encode(self):
+        with self.assertRaisesMessage(TranscodeError, 'stalled'):
+            self.watch([b'out_time_us=1000000\n', b'progress=continue\n'], stall_timeout=0.05)
+
+
+@override_settings(COLD_AFTER_DAYS=None, STORAGE_MIN_FREE_PERCENT=10)
+class SourceRetentionTests(TestCase):
+    def setUp(self):
+        long_ago = timezone.now() - timedelta(days=400)
+        self.video = saved_video(
+            status=Video.STATUS_DONE, processed_video='/media/processed/ab/playlist.m3u8',
+            encoded_at=long_ago, source_bytes=10 ** 9
+        )
+
+    def source_actions(self, free):
+        with mock.patch('video.lifecycle.disk_usage', return_value=(100 * 10 ** 9, free)):
+            return [(action.kind, action.reason) for action in plan() if action.target == self.video.video.name]
+
+    def test_sources_are_kept_by_default(self):
+        with override_settings(SOURCE_RETENTION_DAYS=None):
+            self.assertEqual(self.source_actions(free=50 * 10 ** 9), [])
+            self.assertEqual(self.source_actions(free=10 ** 9), [])
+
+    def test_retention_period_opts_into_deletion(self):
+        with override_settings(SOURCE_RETENTION_DAYS=30, SOURCE_RETENTION_ACTION='delete'):
+            self.assertEqual(self.source_actions(free=50 * 10 ** 9), [(DELETE_SOURCE, 'encoded over 30 days ago')])
+        with override_settings(SOURCE_RETENTION_DAYS=3650):
+            self.assertEqual(self.source_actions(free=10 ** 9), [(DELETE_SOURCE, 'free space below watermark')])
+
+
+
+class CompressSourceTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.source = Path(self.media_root, 'video/26/clip.mp4')
+        self.source.parent.mkdir(parents=True)
+        self.source.write_bytes(bytes(1000))
+
+    def video(self, **fields):
+        return saved_video(status=Video.STATUS_DONE, processed_video='/media/processed/ab/master.m3u8', **fields)
+
+    @staticmethod
+    def fake_ffmpeg(cmd):
+        Path(cmd[-1]).write_bytes(b'mezzanine')
+
+    def test_mezzanine_never_replaces_an_existing_file(self):
+        taken = self.source.with_name('clip_mezz.mp4')
+        taken.write_bytes(b'someone else')
+        video = self.video()
+        with mock.patch('video.lifecycle.run_ffmpeg', side_effect=self.fake_ffmpeg):
+            self.assertEqual(compress_source('video/26/clip.mp4'), 1000 - len(b'mezzanine'))
+        video.refresh_from_db()
+        self.assertNotEqual(video.video.name, 'video/26/clip_mezz.mp4')
+        self.assertTrue(video.video.name.startswith('video/26/clip_mezz'))
+        self.assertEqual(Path(video.video.path).read_bytes(), b'mezzanine')
+        self.assertEqual(video.source_state, Video.SOURCE_COMPRESSED)
+        self.assertEqual(taken.read_bytes(), b'someone else')
+        self.assertFalse(self.source.exists())
+        # No partial encode left behind
+        self.assertEqual(
+            sorted(p.name for p in self.source.parent.iterdir()), sorted([taken.name, Path(video.video.name).name])
+        )
+
+    def test_mezzanine_is_not_compressed_again(self):
+        self.video(source_state=Video.SOURCE_COMPRESSED)
+        with mock.patch('video.lifecycle.run_ffmpeg') as run_ffmpeg:
+            self.assertEqual(compress_source('video/26/clip.mp4'), 0)
+        run_ffmpeg.assert_not_called()
+        self.assertEqual(self.source.read_bytes(), bytes(1000))
+
+class FakeVodConnection:
+    """Stands in for a pooled MySQL connection; titles in ``refuse`` fail the INSERT they are part of."""
+
+    def __init__(self, refuse=(), error=DataError):
+        self.refuse, self.error = set(refuse), error
+        self.committed, self.pending = [], []
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params):
+        pass
+
+    def fetchall(self):
+        return []
+
+    def executemany(self, query, values):
+        if self.refuse & {judul for judul, *_ in values}:
+            raise self.error('Data too long for column')
+        self.pending += [judul for judul, *_ in values]
+
+    def commit(self):
+        self.committed += self.pending
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        pass
+
+
+class VodSyncTests(TestCase):
+    def setUp(self):
+        for caption in ['one', 'bad', 'two']:
+            VodSyncOutbox.objects.create(idempotency_key=caption, payload={
+                'judul': caption, 'link': f'https://vod.example/{caption}', 'status': 'Aktif',
+                'created_at': '2026-01-01 00:00:00', 'updated_at': '2026-01-01 00:00:00', 'kategori_id': 2, 'views': 0,
+            })
+
+    def drain(self, conn):
+        with mock.patch('video.vod_sync.get_pool') as get_pool:
+            get_pool.return_value.get_connection.return_value = conn
+            return drain_outbox()
+
+    def test_refused_row_does_not_hold_back_the_batch(self):
+        conn = FakeVodConnection(refuse={'bad'})
+        self.assertEqual(self.drain(conn), (2, 1))
+        self.assertEqual(conn.committed, ['one', 'two'])
+        statuses = dict(VodSyncOutbox.objects.values_list('idempotency_key', 'status'))
+        self.assertEqual(statuses, {'one': 'sent', 'bad': 'pending', 'two': 'sent'})
+        bad = VodSyncOutbox.objects.get(idempotency_key='bad')
+        self.assertEqual(bad.attempts, 1)
+        self.assertIn('Data too long', bad.last_error)
+        self.assertGreater(bad.next_attempt_at, timezone.now())
+
+    @override_settings(VOD_SYNC_MAX_ATTEMPTS=1)
+    def test_refused_row_fails_after_its_last_attempt(self):
+        self.drain(FakeVodConnection(refuse={'bad'}))
+        self.assertEqual(VodSyncOutbox.objects.get(idempotency_key='bad').status, VodSyncOutbox.STATUS_FAILED)
+
+    def test_connection_error_retries_the_whole_batch(self):
+        conn = FakeVodConnection(refuse={'one', 'bad', 'two'}, error=InterfaceError)
+        self.assertEqual(self.drain(conn), (0, 3))
+        self.assertEqual(list(VodSyncOutbox.objects.values_list('attempts', flat=True).distinct()), [1])
+
+
+def fake_ffmpeg(cmd, on_progress=None):
+    """Stands in for ``run_ffmpeg``: writes the playlist the command would produce."""
+    playlist = Path([arg for arg in cmd if str(arg).endswith('.m3u8')][-1])
+    playlist.write_text('#EXTM3U\n#EXT-X-ENDLIST\n')
+
+
+@override_settings(TRANSCODE_PASSTHROUGH=False, TRANSCODE_THUMBNAILS=False, TRANSCODE_CHUNKS=1)
+@mock.patch('video.transcode.run_ffmpeg', side_effect=fake_ffmpeg)
+@mock.patch('video.transcode.probe_video')
+class ReprocessOutputTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        source = Path(self.media_root) / 'video' / '26' / 'clip.mp4'
+        source.parent.mkdir(parents=True)
+        source.write_bytes(b'source')
+        self.video = saved_video(source_sha256='ab' * 32, status=Video.STATUS_DONE, duration=30.0)
+
+    def output_dir(self):
+        self.video.refresh_from_db()
+        return Path(self.media_root) / self.video.output_path().rsplit('/', 1)[0]
+
+    def test_replaced_output_outlives_an_immediate_prune(self, probe, run_ffmpeg):
+        transcode_video(self.video)
+        old = self.output_dir()
+        finished = time.time() - 30 * 24 * 60 * 60  # encoded long before the reprocess
+        os.utime(old, (finished, finished))
+        transcode_video(self.video, version=7)
+        new = self.output_dir()
+        self.assertNotEqual(old, new)
+
+        self.assertEqual(prune_unreferenced_outputs(60 * 60), 0)
+        self.assertTrue((old / 'playlist.m3u8').exists())
+        self.assertFalse((new / SUPERSEDED_MARKER).exists())
+
+        past = time.time() - 2 * 60 * 60
+        os.utime(old / SUPERSEDED_MARKER, (past, past))
+        self.assertEqual(prune_unreferenced_outputs(60 * 60), 1)
+        self.assertFalse(old.exists())
+        self.assertTrue(new.exists())
+
+    def test_encode_over_an_existing_output_is_published_next_to_it(self, probe, run_ffmpeg):
+        transcode_video(self.video)
+        first = self.output_dir()
+        transcode_video(self.video)  # e.g. a retry after the first encode was published
+        second = self.output_dir()
+        self.assertEqual(second.parent, first.parent)
+        self.assertNotEqual(second, first)
+        self.assertTrue((first / 'playlist.m3u8').exists())
+        self.assertTrue((first / SUPERSEDED_MARKER).exists())
+
+    def test_unmarked_orphan_gets_a_grace_period(self, probe, run_ffmpeg):
+        orphan = Path(self.media_root) / 'processed' / '25' / 'stream_orphan'
+        orphan.mkdir(parents=True)
+        past = time.time() - 30 * 24 * 60 * 60
+        os.utime(orphan, (past, past))
+        self.assertEqual(prune_unreferenced_outputs(60 * 60), 0)
+        self.assertTrue((orphan / SUPERSEDED_MARKER).exists())
+
+
+class EncodeSettingsKeyTests(TestCase):
+    def setUp(self):
+        self.profile = EncodingProfile.objects.create(name='web', crf=23)
+        self.original = saved_video(
+            source_sha256='ab' * 32, status=Video.STATUS_DONE, processed_video='/media/processed/ab/playlist.m3u8',
+            encoding_profile=self.profile, settings_key=self.profile.settings_key()
+        )
+
+    def upload(self):
+        video = Video(source_sha256='ab' * 32, encoding_profile=self.profile)
+        video.settings_key = video.current_settings_key()
+        return video
+
+    def test_same_settings_share_the_output(self):
+        upload = self.upload()
+        self.assertEqual(upload.find_duplicate(), self.original)
+        self.assertEqual(upload.output_key(), self.original.output_key())
+
+    def test_edited_profile_does_not_reuse_old_output(self):
+        for field, value in [('crf', 28), ('container', 'fmp4'), ('segment_duration', 4)]:
+            with self.subTest(field=field):
+                setattr(self.profile, field, value)
+                self.profile.save()
+                upload = self.upload()
+                self.assertIsNone(upload.find_duplicate())
+                self.assertNotEqual(upload.output_key(), self.original.output_key())
+
+    def test_videos_without_a_profile_follow_the_default_profile(self):
+        video = Video()
+        builtin = video.current_settings_key()
+        self.assertEqual(builtin, self.profile.settings_key())  # the profile has the built-in settings
+        self.profile.is_default, self.profile.crf = True, 20
+        self.profile.save()
+        self.assertEqual(video.current_settings_key(), self.profile.settings_key())
+        self.assertNotEqual(video.current_settings_key(), builtin)
+
+
+def body(*blocks):
+    """``read(n)`` over ``blocks``, one per call; an exception instance is raised when reached."""
+    blocks = list(blocks)
+
+    async def read(n):
+        block = blocks.pop(0) if blocks else b''
+        if isinstance(block, Exception):
+            raise block
+        return block
+    return read
+
+
+class AppendChunkTests(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        settings = override_settings(FILE_UPLOAD_TEMP_DIR=self.temp_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    async def test_concurrent_chunk_for_the_same_offset_does_not_touch_the_file(self):
+        upload = await ChunkedUpload.objects.acreate(filename='a.mp4', size=4)
+        racer = await ChunkedUpload.objects.aget(pk=upload.pk)
+        sent = asyncio.Event()
+
+        async def slow_read(n):
+            await sent.wait()
+            return b'AAAA'
+
+        first = asyncio.create_task(append_chunk(upload, 0, slow_read, 4))
+        await asyncio.sleep(0.05)  # the first request holds the upload, waiting for its body
+        with self.assertRaises(UploadOffsetConflict):
+            await append_chunk(racer, 0, body(b'BBBB'), 4)
+        sent.set()
+        self.assertEqual(await first, 4)
+        self.assertEqual(upload.temp_path.read_bytes(), b'AAAA')
+        self.assertEqual(upload.sha256, hashlib.sha256(b'AAAA').hexdigest())
+
+    async def test_failed_chunk_leaves_the_digest_alone(self):
+        upload = await ChunkedUpload.objects.acreate(filename='a.mp4', size=12)
+        await append_chunk(upload, 0, body(b'AAAA'), 4)
+        with self.assertRaises(OSError):
+            await append_chunk(upload, 4, body(b'XXXX', OSError('connection reset')), 8)
+        self.assertEqual(await append_chunk(upload, 4, body(b'BBBB', b'CCCC'), 8), 12)
+        self.assertEqual(upload.temp_path.read_bytes(), b'AAAABBBBCCCC')
+        self.assertEqual(upload.sha256, hashlib.sha256(b'AAAABBBBCCCC').hexdigest())
+
+    async def test_stale_offset_is_refused(self):
+        upload = await ChunkedUpload.objects.acreate(filename='a.mp4', size=8)
+        stale = await ChunkedUpload.objects.aget(pk=upload.pk)
+        await append_chunk(upload, 0, body(b'AAAA'), 4)
+        with self.assertRaises(UploadOffsetConflict):
+            await append_chunk(stale, 0, body(b'BBBB'), 4)
+        self.assertEqual(upload.temp_path.read_bytes(), b'AAAA')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client(HTTP_HOST='localhost')
+        self.videos = [
+            saved_video(
+                caption=f'clip {i}', status=Video.STATUS_DONE, processed_video=f'/media/processed/{i}/playlist.m3u8'
+            )
+            for i in range(3)
+        ]
+        saved_video(caption='still encoding', status=Video.STATUS_RUNNING)
+
+    def get(self, url='/api/videos/', **headers):
+        return self.client.get(url, headers=headers)
+
+    def test_repeated_request_is_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(if_none_match=response['ETag']).status_code, 304)
+        self.assertEqual(self.get(if_modified_since=response['Last-Modified']).status_code, 304)
+
+    def test_saving_or_deleting_a_video_changes_the_etag(self):
+        etag = self.get()['ETag']
+        self.videos[0].caption = 'renamed'
+        self.videos[0].save(update_fields=['caption'])
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][-1]['caption'], 'renamed')
+
+        etag = response['ETag']
+        self.videos[1].delete()
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([video['caption'] for video in response.json()['results']], ['clip 2', 'renamed'])
+
+    def test_pages_follow_the_cursor_newest_first(self):
+        first = self.get('/api/videos/?page_size=2').json()
+        self.assertEqual([video['caption'] for video in first['results']], ['clip 2', 'clip 1'])
+        self.assertIsNone(first['previous'])
+        second = self.get(first['next']).json()
+        self.assertEqual([video['caption'] for video in second['results']], ['clip 0'])
+        self.assertIsNone(second['next'])
+
+
+def option(cmd, name):
+    """The value following ``name`` in an FFmpeg command."""
+    return cmd[cmd.index(name) + 1]
+
+
+class AbrCommandTests(SimpleTestCase):
+    def test_rungs_above_the_source_are_dropped(self):
+        self.assertEqual(abr_rungs(1080), ['360p', '480p', '720p', '1080p'])
+        self.assertEqual(abr_rungs(720), ['360p', '480p', '720p'])
+        self.assertEqual(abr_rungs(600), ['360p', '480p'])
+        self.assertEqual(abr_rungs(240), ['360p'])  # smaller sources still get the lowest rung
+
+    def test_one_decode_split_into_every_rung(self):
+        cmd = build_abr_command('in.mp4', '/out', 720, has_audio=True)
+        graph = option(cmd, '-filter_complex').split(';')
+        self.assertEqual(graph[0], '[0:v]split=3[s0][s1][s2]')
+        self.assertEqual(len(graph), 4)
+        self.assertEqual(cmd.count('-i'), 1)
+        self.assertEqual(option(cmd, '-var_stream_map'), 'v:0,a:0,name:360p v:1,a:1,name:480p v:2,a:2,name:720p')
+        self.assertEqual([cmd[i + 1] for i, arg in enumerate(cmd) if arg == '-map'],
+                         ['[v0]', '0:a:0', '[v1]', '0:a:0', '[v2]', '0:a:0'])
+        self.assertEqual(option(cmd, '-master_pl_name'), 'master.m3u8')
+        self.assertEqual(cmd[-1], '/out/%v/playlist.m3u8')
+
+    def test_maxrate_per_rung(self):
+        encoding = dict(DEFAULT_ENCODING, maxrate_scale=1.5)
+        cmd = build_abr_command('in.mp4', '/out', 1080, has_audio=False, encoding=encoding)
+        self.assertEqual([option(cmd, f'-maxrate:v:{i}') for i in range(4)], ['1200k', '1800k', '3750k', '6000k'])
+        self.assertEqual(option(cmd, '-bufsize:v:3'), '12000k')
+        self.assertNotIn('-maxrate:v:4', cmd)
+        self.assertEqual(option(cmd, '-var_stream_map'), 'v:0,name:360p v:1,name:480p v:2,name:720p v:3,name:1080p')
+        self.assertNotIn('0:a:0', cmd)
+
+    def test_thumbnail_outputs_share_the_split(self):
+        cmd = build_abr_command('in.mp4', '/out', 480, has_audio=True, thumbnails=True, poster_at=3.0)
+        self.assertTrue(option(cmd, '-filter_complex').startswith('[0:v]split=4[s0][s1]'))
+
+
+class HlsArgsTests(SimpleTestCase):
+    def test_mpegts_segments(self):
+        args = hls_args(DEFAULT_ENCODING, '/out/720p', '/out/720p/playlist.m3u8')
+        self.assertEqual(option(args, '-hls_segment_type'), 'mpegts')
+        self.assertEqual(option(args, '-hls_flags'), 'independent_segments')
+        self.assertEqual(option(args, '-hls_segment_filename'), '/out/720p/segment_%03d.ts')
+        self.assertEqual(option(args, '-hls_time'), '6')
+        self.assertNotIn('-hls_fmp4_init_filename', args)
+        self.assertEqual(args[-3:], ['-f', 'hls', '/out/720p/playlist.m3u8'])
+
+    def test_fmp4_segments_share_an_init_segment(self):
+        encoding = dict(DEFAULT_ENCODING, container=CONTAINER_FMP4, segment_duration=4)
+        args = hls_args(encoding, '/out/720p', '/out/720p/playlist.m3u8', segment_prefix='part')
+        self.assertEqual(option(args, '-hls_segment_type'), 'fmp4')
+        self.assertEqual(option(args, '-hls_fmp4_init_filename'), 'init.mp4')
+        self.assertEqual(option(args, '-hls_flags'), 'independent_segments')
+        self.assertEqual(option(args, '-hls_segment_filename'), '/out/720p/part_%03d.m4s')
+        self.assertEqual(option(args, '-hls_time'), '4')
+
+    def test_single_file_is_addressed_by_byte_range(self):
+        encoding = dict(DEFAULT_ENCODING, container=CONTAINER_SINGLE_FILE)
+        args = hls_args(encoding, '/out/720p', '/out/720p/playlist.m3u8')
+        self.assertEqual(option(args, '-hls_flags'), 'independent_segments+single_file')
+        self.assertEqual(option(args, '-hls_segment_type'), 'fmp4')
+        self.assertEqual(option(args, '-hls_segment_filename'), '/out/720p/segment.mp4')
+        self.assertNotIn('-hls_fmp4_init_filename', args)
+
+
+@mock.patch('video.thumbnails.run_ffmpeg')
+@mock.patch.multiple('video.thumbnails', SPRITE_COLUMNS=3, SPRITE_ROWS=2, SPRITE_INTERVAL=5, SPRITE_TILE_SIZE='160x90')
+class SpriteTests(SimpleTestCase):
+    def setUp(self):
+        self.stream_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.stream_dir)
+
+    def thumbnails(self, prefix, count):
+        for i in range(count):
+            (self.stream_dir / f'{prefix}_{i:05d}.jpg').write_bytes(b'jpeg')
+
+    def cues(self):
+        blocks = (self.stream_dir / THUMBNAILS_VTT_NAME).read_text().split('\n\n')
+        self.assertEqual(blocks[0], 'WEBVTT')
+        return [tuple(block.strip().split('\n')) for block in blocks[1:] if block.strip()]
+
+    def test_cues_map_each_interval_to_its_tile(self, run_ffmpeg):
+        self.thumbnails('thumb', 8)
+        build_sprites(self.stream_dir, [('thumb', 0.0, 37.5)])
+        cues = self.cues()
+        self.assertEqual(len(cues), 8)
+        self.assertEqual(cues[0], ('00:00:00.000 --> 00:00:05.000', 'sprite_000.jpg#xywh=0,0,160,90'))
+        self.assertEqual(cues[4], ('00:00:20.000 --> 00:00:25.000', 'sprite_000.jpg#xywh=160,90,160,90'))
+        self.assertEqual(cues[5], ('00:00:25.000 --> 00:00:30.000', 'sprite_000.jpg#xywh=320,90,160,90'))
+        # The seventh tile starts the second sheet; the last cue ends with the video
+        self.assertEqual(cues[6], ('00:00:30.000 --> 00:00:35.000', 'sprite_001.jpg#xywh=0,0,160,90'))
+        self.assertEqual(cues[7], ('00:00:35.000 --> 00:00:37.500', 'sprite_001.jpg#xywh=160,0,160,90'))
+        run_ffmpeg.assert_called_once()
+        self.assertEqual(list(self.stream_dir.glob('thumb_*.jpg')), [])
+
+    def test_slices_continue_the_timeline(self, run_ffmpeg):
+        self.thumbnails('thumb_000', 2)
+        self.thumbnails('thumb_001', 3)
+        build_sprites(self.stream_dir, [('thumb_000', 0.0, 10.0), ('thumb_001', 10.0, 3600 - 10.0)])
+        self.assertEqual([cue[0] for cue in self.cues()][2:], [
+            '00:00:10.000 --> 00:00:15.000', '00:00:15.000 --> 00:00:20.000', '00:00:20.000 --> 00:00:25.000'
+        ])
+        self.assertEqual(self.cues()[2][1], 'sprite_001_000.jpg#xywh=0,0,160,90')
+        self.assertEqual(run_ffmpeg.call_count, 2)
+
+
+class PosterTimeTests(SimpleTestCase):
+    def test_poster_time(self):
+        self.assertEqual(poster_time(None), 0.0)
+        self.assertEqual(poster_time(0), 0.0)
+        self.assertAlmostEqual(poster_time(0.5), 0.05)
+        self.assertAlmostEqual(poster_time(4), 0.4)
+        self.assertEqual(poster_time(100), 10.0)
+        self.assertEqual(poster_time(3600), 10.0)
+
+
+class StagingTests(SimpleTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.final_dir = Path(self.media_root) / 'processed' / '26' / 'stream_ab'
+        self.final_dir.parent.mkdir(parents=True)
+
+    def encode(self, content):
+        staged = staged_output(self.final_dir)
+        with staged as staging_dir:
+            self.assertEqual(staging_dir.parent, staging_root())
+            (staging_dir / 'playlist.m3u8').write_text(content)
+        return staged.final_dir
+
+    def test_output_is_published_in_place(self):
+        self.assertEqual(self.encode('first'), self.final_dir)
+        self.assertEqual((self.final_dir / 'playlist.m3u8').read_text(), 'first')
+        self.assertEqual(list(staging_root().iterdir()), [])
+
+    def test_existing_output_is_never_replaced(self):
+        self.encode('first')
+        published = self.encode('second')
+        self.assertNotEqual(published, self.final_dir)
+        self.assertEqual(published.parent, self.final_dir.parent)
+        self.assertTrue(published.name.startswith('stream_ab_'))
+        self.assertEqual((published / 'playlist.m3u8').read_text(), 'second')
+        self.assertEqual((self.final_dir / 'playlist.m3u8').read_text(), 'first')
+
+    def test_publish_takes_over_an_empty_directory(self):
+        self.final_dir.mkdir()
+        staging_dir = staging_root() / 'stream_ab.x1'
+        staging_dir.mkdir(parents=True)
+        self.assertEqual(publish(staging_dir, self.final_dir), self.final_dir)
+
+    def test_failed_encode_publishes_nothing(self):
+        with self.assertRaises(RuntimeError):
+            with staged_output(self.final_dir) as staging_dir:
+                (staging_dir / 'segment_000.ts').write_bytes(b'ts')
+                raise RuntimeError('ffmpeg failed')
+        self.assertFalse(self.final_dir.exists())
+        self.assertEqual(list(staging_root().iterdir()), [])
+
+    def test_collect_staging_removes_only_abandoned_directories(self):
+        root = staging_root()
+        abandoned, active = root / 'stream_old.a1', root / 'stream_new.b2'
+        for staging_dir in (abandoned, active):
+            (staging_dir / 'hd').mkdir(parents=True)
+            (staging_dir / 'hd' / 'segment_000.ts').write_bytes(b'ts')
+        past = time.time() - 2 * 60 * 60
+        for path in (abandoned, abandoned / 'hd', abandoned / 'hd' / 'segment_000.ts', active, active / 'hd'):
+            os.utime(path, (past, past))  # active still has a freshly written segment
+
+        self.assertEqual(collect_staging(60 * 60), 1)
+        self.assertEqual([path.name for path in root.iterdir()], ['stream_new.b2'])
+
+
+class ViewCountTests(TestCase):
+    def setUp(self):
+        self.vod = mock.Mock()
+        sinks = mock.patch.dict(SINKS, {'vod': self.vod})
+        sinks.start()
+        self.addCleanup(sinks.stop)
+        self.counter = ViewCounter(interval=3600)
+        self.addCleanup(self.counter._stopped.set)
+        self.played = saved_video(
+            status=Video.STATUS_DONE, processed_video='/media/processed/26/stream_a/playlist.m3u8'
+        )
+        self.other = saved_video(status=Video.STATUS_DONE, processed_video='/media/processed/26/stream_b/master.m3u8')
+
+    def test_flush_adds_the_plays_in_one_go(self):
+        for _ in range(3):
+            self.counter.add('processed/26/stream_a/playlist.m3u8')
+        self.counter.add('processed/26/stream_b/master.m3u8')
+        self.assertEqual(self.counter.flush(), 4)
+        self.played.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.played.view_count, self.other.view_count), (3, 1))
+        self.assertIsNotNone(self.played.last_viewed_at)
+        self.vod.assert_called_once_with(
+            {'processed/26/stream_a/playlist.m3u8': 3, 'processed/26/stream_b/master.m3u8': 1}
+        )
+        self.assertEqual(self.counter.flush(), 0)  # nothing pending any more
+
+    def test_failed_sink_retries_without_double_counting_the_others(self):
+        self.vod.side_effect = [OSError('VOD database down'), None]
+        self.counter.add('processed/26/stream_a/playlist.m3u8')
+        self.counter.flush()
+        self.counter.add('processed/26/stream_a/playlist.m3u8')
+        self.counter.flush()
+        self.played.refresh_from_db()
+        self.assertEqual(self.played.view_count, 2)
+        self.assertEqual(self.vod.call_args.args[0], {'processed/26/stream_a/playlist.m3u8': 2})
+
+    def test_only_top_level_playlists_count(self):
+        with mock.patch('video.viewcount.counter') as counter:
+            for path in [
+                '26/stream_a/segment_000.ts', '26/stream_a/sprite_000.jpg', '26/stream_a/thumbnails.vtt',
+                '26/stream_a/poster.jpg', '26/stream_b/720p/playlist.m3u8', '26/stream_b/720p/segment_000.ts',
+            ]:
+                count_view(path)
+            counter.add.assert_not_called()
+            count_view('26/stream_a/playlist.m3u8')
+            count_view('26/stream_b/master.m3u8')
+            self.assertEqual([c.args[0] for c in counter.add.call_args_list], [
+                'processed/26/stream_a/playlist.m3u8', 'processed/26/stream_b/master.m3u8'
+            ])
+
+    @mock.patch('video.viewcount.VOD_UPDATE_BATCH', 2)
+    def test_vod_views_are_updated_in_batches(self):
+        conn = mock.Mock()
+        with mock.patch('video.viewcount.get_pool') as get_pool, \
+                override_settings(WEB_MEDIA_URL='https://cdn.example/media'):
+            get_pool.return_value.get_connection.return_value = conn
+            _flush_vod({'processed/a/playlist.m3u8': 3, 'processed/b/playlist.m3u8': 1, 'processed/c/master.m3u8': 2})
+        cursor = conn.cursor.return_value
+        self.assertEqual(cursor.execute.call_count, 2)
+        a, b, c = (f'https://cdn.example/media/processed/{name}' for name in [
+            'a/playlist.m3u8', 'b/playlist.m3u8', 'c/master.m3u8'
+        ])
+        sql, params = cursor.execute.call_args_list[0].args
+        self.assertEqual(sql.count('WHEN %s THEN %s'), 2)
+        self.assertEqual(params, [a, 3, b, 1, a, b])
+        self.assertEqual(cursor.execute.call_args_list[1].args[1], [c, 2, c])
+        conn.commit.assert_called_once()
+
+
+class StreamingUploadTests(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        settings = override_settings(FILE_UPLOAD_TEMP_DIR=self.temp_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # As the test client does: the request signals would close the test's connection
+        for signal in (signals.request_started, signals.request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+        user = User.objects.create(username='editor', is_staff=True)
+        client = Client()
+        client.force_login(user)
+        self.session = client.cookies['sessionid'].value
+        self.csrf_token = _get_new_csrf_string()
+        self.upload = ChunkedUpload.objects.create(user=user, filename='a.mp4', size=100)
+        self.app = StreamingUploads(ASGIHandler())
+
+    async def patch(self, messages, session=True, csrf=True, length=8):
+        cookies = [f'csrftoken={self.csrf_token}'] + ([f'sessionid={self.session}'] if session else [])
+        headers = [
+            (b'host', b'localhost'), (b'cookie', '; '.join(cookies).encode()),
+            (b'upload-offset', b'0'), (b'content-length', str(length).encode()),
+        ]
+        if csrf:
+            headers.append((b'x-csrftoken', self.csrf_token.encode()))
+        path = f'/uploads/{self.upload.pk}/'
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'PATCH', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '', 'headers': headers,
+            'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+        }
+        messages = list(messages)
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.app(scope, receive, send)
+        await self.upload.arefresh_from_db()
+        body = b''.join(m.get('body', b'') for m in sent if m['type'] == 'http.response.body')
+        return (sent[0]['status'], body) if sent else (None, b'')
+
+    async def test_body_is_appended_as_it_streams_in(self):
+        status, _ = await self.patch([
+            {'type': 'http.request', 'body': b'AAAA', 'more_body': True},
+            {'type': 'http.request', 'body': b'BBBB', 'more_body': False},
+        ])
+        self.assertEqual(status, 200)
+        self.assertEqual(self.upload.offset, 8)
+        self.assertEqual(self.upload.temp_path.read_bytes(), b'AAAABBBB')
+
+    async def test_patch_without_csrf_token_is_rejected(self):
+        status, body = await self.patch([{'type': 'http.request', 'body': b'AAAABBBB'}], csrf=False)
+        self.assertEqual(status, 403)
+        self.assertIn(b'CSRF', body)
+        self.assertEqual(self.upload.offset, 0)
+
+    async def test_anonymous_patch_is_rejected(self):
+        status, body = await self.patch([{'type': 'http.request', 'body': b'AAAABBBB'}], session=False)
+        self.assertEqual(status, 403)
+        self.assertIn(b'Staff login required', body)
+        self.assertEqual(self.upload.offset, 0)
+
+    async def test_disconnect_commits_the_bytes_received(self):
+        status, _ = await self.patch([
+            {'type': 'http.request', 'body': b'AAAA', 'more_body': True},
+            {'type': 'http.disconnect'},
+        ])
+        self.assertIsNone(status)  # nobody left to answer
+        self.assertEqual(self.upload.offset, 4)
+        self.assertEqual(self.upload.temp_path.read_bytes(), b'AAAA')
+
+
+@mock.patch('video.probe.run_ffprobe', return_value=PROBED)
+@mock.patch('video.validation.run_ffprobe_head', return_value=PROBED)
+class ChunkedUploadProtocolTests(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(
+            FILE_UPLOAD_TEMP_DIR=os.path.join(root, 'tmp'), MEDIA_ROOT=os.path.join(root, 'media'),
+            UPLOAD_MAX_LOAD=None, UPLOAD_MIN_FREE_BYTES=0,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(User.objects.create(username='editor', is_staff=True))
+
+    def patch(self, location, offset, data):
+        return self.client.generic(
+            'PATCH', location, data, content_type='application/offset+octet-stream',
+            headers={'Upload-Offset': str(offset)}
+        )
+
+    def test_create_append_resume_and_complete(self, probe_head, probe):
+        data = FTYP + MOOV + MDAT
+        response = self.client.post('/uploads/', {'filename': 'clip.mp4', 'size': len(data)})
+        self.assertEqual(response.status_code, 201)
+        location = response['Location']
+
+        self.assertEqual(self.patch(location, 0, data[:500]).status_code, 200)
+        # The connection dropped: ask where to resume
+        response = self.client.head(location)
+        self.assertEqual(response['Upload-Offset'], '500')
+
+        response = self.patch(location, 0, data[:500])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '500')
+
+        response = self.patch(location, 500, data[500:])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Upload-Offset'], str(len(data)))
+
+        upload = ChunkedUpload.objects.get()
+        self.assertEqual(upload.sha256, hashlib.sha256(data).hexdigest())
+        inode = upload.temp_path.stat().st_ino
+
+        response = self.client.post(f'{location}complete/', {'caption': 'Clip'})
+        self.assertEqual(response.status_code, 201)
+        video = Video.objects.get(pk=response.json()['id'])
+        self.assertEqual(video.status, Video.STATUS_QUEUED)
+        self.assertEqual(video.source_sha256, upload.sha256)
+        # Attached by a rename, not a copy
+        self.assertFalse(upload.temp_path.exists())
+        self.assertEqual(os.stat(video.video.path).st_ino, inode)
+        self.assertEqual(Path(video.video.path).read_bytes(), data)
+        self.assertTrue(TranscodeJob.objects.filter(video=video).exists())
+
+
+class PerTitleTests(SimpleTestCase):
+    profile = EncodingProfile(
+        per_title=True, target_ssim=0.97, crf_min=18, crf_max=30, sample_count=3, sample_duration=4
+    )
+
+    @staticmethod
+    def trial(source, offset, sample_duration, crf, encoding, size, workdir):
+        # Quality falls and the bitrate drops as CRF rises
+        return 250_000 * (31 - crf), 0.991 - (crf - 18) * 0.004
+
+    def test_highest_crf_reaching_the_target_is_chosen(self):
+        with mock.patch('video.per_title.trial_encode', side_effect=self.trial) as trial:
+            encoding = choose_encoding('in.mp4', 60, self.profile, '1280x720', 6_000_000)
+        self.assertEqual(encoding['crf'], 23)
+        # 2 Mbit/s sampled at CRF 23, with 1.5x headroom, against a 6 Mbit/s ladder cap
+        self.assertEqual(encoding['maxrate_scale'], 0.5)
+        self.assertEqual(encoding['per_title'], {'ssim': 0.971, 'sample_bitrate': 2_000_000})
+        # Every sample of each probed CRF, each encoded once
+        crfs = [c.args[3] for c in trial.call_args_list]
+        self.assertEqual(len(crfs), 3 * len(set(crfs)))
+
+    def test_maxrate_scale_stays_within_the_profile_and_floor(self):
+        with mock.patch('video.per_title.trial_encode', side_effect=self.trial):
+            self.assertEqual(choose_encoding('in.mp4', 60, self.profile, None, 1_000_000)['maxrate_scale'], 1.0)
+            self.assertEqual(choose_encoding('in.mp4', 60, self.profile, None, 100_000_000)['maxrate_scale'], 0.25)
+
+    def test_source_shorter_than_a_sample_is_measured_over_its_length(self):
+        def fake_ffmpeg(cmd):
+            if cmd[-1].endswith('.mp4'):
+                Path(cmd[-1]).write_bytes(bytes(100_000))
+                return ''
+            return 'SSIM Y:0.99 All:0.99 (20.0)'
+
+        with mock.patch('video.per_title.run_ffmpeg', side_effect=fake_ffmpeg):
+            encoding = choose_encoding('in.mp4', 2, self.profile, None, 3_000_000)
+        self.assertEqual(encoding['crf'], 30)
+        self.assertEqual(encoding['per_title']['sample_bitrate'], 400_000)
+
+
+def fake_probe(path):
+    return {} if Path(path).stem == 'broken' else PROBED
+
+
+@mock.patch('video.ingest.run_ffprobe', side_effect=fake_probe)
+class IngestCommandTests(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.sources = Path(root, 'sources')
+        self.media_root = Path(root, 'media')
+        self.sources.mkdir()
+        settings = override_settings(MEDIA_ROOT=str(self.media_root))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for name, data in [('a.mp4', b'same'), ('b.mp4', b'same'), ('c.mp4', b'other'), ('broken.mp4', b'junk')]:
+            (self.sources / name).write_bytes(data)
+
+    def ingest(self, *args):
+        out = StringIO()
+        call_command('ingest_videos', str(self.sources), '--workers', '1', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_identical_sources_in_one_batch_are_encoded_once(self, probe):
+        output = self.ingest()
+        self.assertIn('Queued 3, 0 duplicates, 1 rejected', output)
+        a, b, c = Video.objects.order_by('caption')
+        self.assertEqual(a.source_sha256, b.source_sha256)
+        self.assertEqual(
+            sorted(job.video.caption for job in TranscodeJob.objects.select_related('video')), ['a', 'c']
+        )
+        self.assertEqual(TranscodeJob.objects.get(video=a).kind, TranscodeJob.KIND_INGEST)
+
+    def test_source_encoded_before_reuses_its_output(self, probe):
+        original = saved_video(
+            source_sha256=hashlib.sha256(b'other').hexdigest(), status=Video.STATUS_DONE,
+            processed_video='hls/clip/master.m3u8', settings_key=Video().current_settings_key(),
+        )
+        output = self.ingest()
+        self.assertIn('Queued 2, 1 duplicates, 1 rejected', output)
+        c = Video.objects.get(caption='c')
+        self.assertEqual(c.status, Video.STATUS_DONE)
+        self.assertEqual(c.processed_video, original.processed_video)
+        self.assertEqual(c.video.name, original.video.name)  # never copied into MEDIA_ROOT
+        self.assertFalse(TranscodeJob.objects.filter(video=c).exists())
+
+    def test_resume_skips_ingested_files_and_retries_rejected_ones(self, probe):
+        self.ingest()
+        (self.sources / 'd.mp4').write_bytes(b'new')
+        output = self.ingest('--resume')
+        self.assertIn('Found 2 files to ingest (3 skipped)', output)
+        self.assertIn('Queued 1, 0 duplicates, 1 rejected', output)
+        self.assertEqual(Video.objects.count(), 4)
+        probed = [Path(call.args[0]).name for call in probe.call_args_list[4:]]
+        self.assertEqual(probed, ['broken.mp4', 'd.mp4'])
+
+    def test_dry_run_writes_nothing(self, probe):
+        output = self.ingest('--dry-run')
+        self.assertIn('Would queue 3, 0 duplicates, 1 rejected', output)
+        self.assertFalse(Video.objects.exists())
+        self.assertFalse(TranscodeJob.objects.exists())
+        self.assertFalse((self.sources / '.ingest_state.jsonl').exists())
+        self.assertFalse(self.media_root.exists())
+
+
+@override_settings(METRICS_TOKEN='s3cret')
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST='localhost')
+
+    def get(self, **headers):
+        return self.client.get('/metrics/', headers=headers)
+
+    def test_bearer_token_is_required(self):
+        self.assertEqual(self.get().status_code, 403)
+        self.assertEqual(self.get(Authorization='Bearer wrong').status_code, 403)
+        self.assertEqual(self.get(Authorization='s3cret').status_code, 403)
+        response = self.get(Authorization='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+
+    @override_settings(METRICS_TOKEN='')
+    def test_empty_token_matches_nothing(self):
+        self.assertEqual(self.get(Authorization='Bearer ').status_code, 403)
+
+    def test_staff_session_needs_no_token(self):
+        self.client.force_login(User.objects.create(username='viewer'))
+        self.assertEqual(self.get().status_code, 403)
+        self.client.force_login(User.objects.create(username='editor', is_staff=True))
+        self.assertEqual(self.get().status_code, 200)
+
+    def test_recorded_stages_in_exposition_format(self):
+        record('encode', duration=2.0, bytes_in=1000, bytes_out=400)
+        record('encode', duration=0.3, error='ffmpeg exited 1')
+        lines = self.get(Authorization='Bearer s3cret').content.decode().splitlines()
+        self.assertIn('# TYPE video_pipeline_stage_seconds histogram', lines)
+        self.assertIn('video_pipeline_stage_seconds_bucket{stage="encode",le="0.1"} 0', lines)
+        self.assertIn('video_pipeline_stage_seconds_bucket{stage="encode",le="0.5"} 1', lines)
+        self.assertIn('video_pipeline_stage_seconds_bucket{stage="encode",le="5"} 2', lines)
+        self.assertIn('video_pipeline_stage_seconds_bucket{stage="encode",le="+Inf"} 2', lines)
+        self.assertIn('video_pipeline_stage_seconds_sum{stage="encode"} 2.300', lines)
+        self.assertIn('video_pipeline_stage_seconds_count{stage="encode"} 2', lines)
+        self.assertIn('# TYPE video_pipeline_stage_failed_total counter', lines)
+        self.assertIn('video_pipeline_stage_failed_total{stage="encode"} 1', lines)
+        self.assertIn('video_pipeline_stage_bytes_in_total{stage="encode"} 1000', lines)
+        self.assertIn('video_pipeline_stage_bytes_out_total{stage="encode"} 400', lines)
@@ -0,0 +1,61 @@
+"""Poster images, sprite sheets and WebVTT scrub-preview tracks.
+
+The thumbnails are extra branches of the encode's own filter graph (see
+``ffmpeg.thumbnail_filters``), so the source is decoded once for both the
+HLS renditions and the previews. Afterwards the small per-interval JPEGs are
+tiled into sprite sheets and ``thumbnails.vtt`` maps each time range to its
+tile with a ``#xywh=`` media fragment.
+"""
+from pathlib import Path
+
+from .ffmpeg import (
+    SPRITE_COLUMNS, SPRITE_INTERVAL, SPRITE_ROWS, SPRITE_TILE_SIZE, build_sprite_command, run_ffmpeg
+)
+
+THUMBNAILS_VTT_NAME = 'thumbnails.vtt'
+
+
+def poster_time(duration):
+    """Where the poster frame is taken: a tenth of the way in, past any fade from black."""
+    return min(duration * 0.1, 10.0) if duration else 0.0
+
+
+def _timestamp(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f'{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}'
+
+
+def build_sprites(stream_dir, series):
+    """Tile the thumbnails of every encode in ``series`` into sheets and write ``thumbnails.vtt``.
+
+    ``series`` lists ``(thumbnail_prefix, start, duration)`` for each FFmpeg
+    run that wrote thumbnails: one for a whole-file encode, one per slice of a
+    parallel encode. The individual thumbnails are removed afterwards.
+    """
+    stream_dir = Path(stream_dir)
+    width, height = (int(n) for n in SPRITE_TILE_SIZE.split('x'))
+    per_sheet = SPRITE_COLUMNS * SPRITE_ROWS
+    lines = ['WEBVTT', '']
+    for prefix, start, duration in series:
+        thumbs = sorted(stream_dir.glob(f'{prefix}_[0-9][0-9][0-9][0-9][0-9].jpg'))
+        if not thumbs:
+            continue
+        sheet_prefix = prefix.replace('thumb', 'sprite', 1)
+        run_ffmpeg(build_sprite_command(stream_dir, prefix, sheet_prefix))
+        for thumb in thumbs:
+            thumb.unlink()
+
+        for i in range(len(thumbs)):
+            begin = start + i * SPRITE_INTERVAL
+            end = min(begin + SPRITE_INTERVAL, start + duration)
+            if end <= begin:
+                break
+            tile = i % per_sheet
+            x, y = tile % SPRITE_COLUMNS * width, tile // SPRITE_COLUMNS * height
+            lines.extend([
+                f'{_timestamp(begin)} --> {_timestamp(end)}',
+                f'{sheet_prefix}_{i // per_sheet:03d}.jpg#xywh={x},{y},{width},{height}',
+                '',
+            ])
+    (stream_dir / THUMBNAILS_VTT_NAME).write_text('\n'.join(lines))
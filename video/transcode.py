@@ -0,0 +1,242 @@
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .ffmpeg import (
+    DEFAULT_ENCODING, POSTER_NAME, RESOLUTION_SETTINGS, TranscodeError, abr_rungs, build_abr_command,
+    build_remux_command, build_single_command, build_thumbnail_command, run_ffmpeg
+)
+from .hashing import file_sha256
+from .metrics import stage, tree_size
+from .models import EncodingProfile, Video
+from .parallel import parallel_encode, use_parallel_encode
+from .passthrough import COPY, passthrough_mode
+from .per_title import choose_encoding
+from .probe import probe_video
+from .staging import STAGING_DIR_NAME, staged_output
+from .thumbnails import THUMBNAILS_VTT_NAME, build_sprites, poster_time
+from .vod_sync import enqueue_vod_sync
+
+logger = logging.getLogger(__name__)
+
+# Written into an output directory when its video moves to a new one; its mtime starts the grace period
+SUPERSEDED_MARKER = '.superseded'
+
+
+def resolve_encoding(video, original_height, job=None, per_title=True):
+    """Encoder settings for ``video``: its profile, the default profile, or DEFAULT_ENCODING.
+
+    Per-title profiles are tuned to the source with trial encodes first,
+    unless ``per_title`` is false (the video is not going to be encoded).
+    """
+    profile = video.encoding_profile or EncodingProfile.objects.filter(is_default=True).first()
+    if profile is None:
+        return dict(DEFAULT_ENCODING)
+    if not (per_title and profile.per_title and video.duration):
+        return profile.as_encoding()
+
+    # Tune against the largest rendition that will be produced
+    if video.target_resolution == 'abr':
+        rung = RESOLUTION_SETTINGS[abr_rungs(original_height)[-1]]
+    else:
+        rung = RESOLUTION_SETTINGS[video.target_resolution]
+    try:
+        with stage('per_title', video, job, bytes_in=video.video.size):
+            return choose_encoding(
+                video.video.path, video.duration, profile, rung['size'], int(rung['bitrate'].rstrip('k')) * 1000
+            )
+    except TranscodeError as e:
+        logger.warning("Per-title analysis failed for video %s, using profile settings: %s", video.pk, e)
+        return profile.as_encoding()
+
+
+def transcode_video(video, progress=None, version=None):
+    """Encode ``video`` to HLS under MEDIA_ROOT/processed and queue it for the VOD database.
+
+    Runs in a worker process (see ``video.jobs``), never on the request thread.
+    ``progress`` is an optional ``video.progress.ProgressReporter``; each
+    step is timed as a pipeline stage (see ``video.metrics``). The encode is
+    written to a staging directory and renamed into place only once it is
+    complete, next to any earlier output of the same key rather than over
+    it (see ``video.staging``). With a
+    ``version`` the encode goes to a directory of its own and replaces the
+    video's current output in one UPDATE once it is complete; the old
+    directory is removed later by ``prune_unreferenced_outputs``.
+    """
+    # Ensure the video file exists
+    if not video.video or not os.path.exists(video.video.path):
+        raise TranscodeError("Video file not found")
+
+    job = progress.job_id if progress else None
+
+    # Create necessary directories in web folder
+    year = datetime.now().strftime('%y')
+    media_root = Path(settings.MEDIA_ROOT)
+    web_output_dir = media_root / 'processed' / year
+    web_output_dir.mkdir(parents=True, exist_ok=True)
+
+    if not video.source_sha256:
+        # Uploads that bypassed the hashing upload handlers are hashed here, once
+        with stage('hash', video, job, bytes_in=video.video.size):
+            video.source_sha256 = file_sha256(video.video.path)
+        video.save(update_fields=['source_sha256'])
+        original = video.find_duplicate() if version is None else None
+        if original:
+            logger.info("Reusing the output of identical video %s for video %s", original.pk, video.pk)
+            video.reuse_output_of(original)
+            video.save()
+            return
+
+    if version is not None:
+        # A re-encode picks up profile edits made since the last one, and is keyed to them
+        video.settings_key = video.current_settings_key()
+        video.save(update_fields=['settings_key'])
+
+    # Content-addressed directory for the HLS segments, written through a staging directory
+    stream_name = f"stream_{video.output_key()}" + (f"_v{version}" if version is not None else "")
+    stream_dir = web_output_dir / stream_name
+
+    staged = staged_output(stream_dir)
+    with staged as staging_dir:
+        # Source metadata comes from the cached probe; ffprobe only runs if the file changed
+        try:
+            with stage('probe', video, job):
+                probe_video(video)
+        except Exception as e:
+            logger.warning("Error getting resolution of video %s: %s", video.pk, e)
+        original_width, original_height = video.width or 1280, video.height or 720  # Default to 720p if can't detect
+        has_audio = bool(video.audio_codec) if video.probe_data else True
+        duration = video.duration
+        # Compatible sources are segmented as they are instead of encoded (see video.passthrough)
+        with stage('passthrough', video, job):
+            passthrough = passthrough_mode(video)
+        encoding = resolve_encoding(video, original_height, job, per_title=not passthrough)
+        if progress:
+            progress.duration = duration
+        on_progress = progress.callback() if progress else None
+        # Sprite sheets are laid out against the duration, so unprobed sources go without
+        thumbnails = getattr(settings, 'TRANSCODE_THUMBNAILS', True) and bool(duration)
+        parallel = not passthrough and video.target_resolution != 'abr' and use_parallel_encode(duration, encoding)
+
+        with stage('encode', video, job, bytes_in=video.video.size) as encode:
+            if video.target_resolution == 'abr':
+                playlist_name = "master.m3u8"
+                run_ffmpeg(
+                    build_abr_command(
+                        video.video.path, staging_dir, original_height, has_audio, encoding,
+                        thumbnails=thumbnails, poster_at=poster_time(duration) if thumbnails else None
+                    ),
+                    on_progress=on_progress
+                )
+            elif passthrough:
+                playlist_name = "playlist.m3u8"
+                run_ffmpeg(
+                    build_remux_command(video.video.path, staging_dir, passthrough == COPY, encoding),
+                    on_progress=on_progress
+                )
+            elif parallel:
+                playlist_name = "playlist.m3u8"
+                parallel_encode(
+                    video.video.path, staging_dir, video.target_resolution, original_width, original_height, duration,
+                    encoding, progress, thumbnails
+                )
+            else:
+                playlist_name = "playlist.m3u8"
+                ffmpeg_cmd = build_single_command(
+                    video.video.path, staging_dir, video.target_resolution, original_width, original_height, encoding,
+                    thumbnail_prefix='thumb' if thumbnails else None,
+                    poster_at=poster_time(duration) if thumbnails else None
+                )
+                run_ffmpeg(ffmpeg_cmd, on_progress=on_progress)
+            encode.bytes_out = tree_size(staging_dir)
+        if thumbnails and not parallel:  # parallel_encode writes its own
+            with stage('thumbnails', video, job):
+                if passthrough:
+                    # Nothing was decoded for the copy, so the thumbnails need a pass of their own
+                    run_ffmpeg(build_thumbnail_command(video.video.path, staging_dir, poster_time(duration)))
+                build_sprites(staging_dir, [('thumb', 0.0, duration)])
+        has_poster = (staging_dir / POSTER_NAME).exists()
+        output_bytes = tree_size(staging_dir)
+
+    # An earlier output at the same path stays for the players reading it; this one went next to it
+    stream_dir = staged.final_dir
+    stream_name = stream_dir.name
+    if progress:
+        progress.finish()
+    logger.info("Encoded video %s to %s", video.pk, stream_dir)
+    with stage('publish', video, job):
+        # Set the processed_video URL using the media URL
+        relative_path = f'processed/{year}/{stream_name}/{playlist_name}'
+        previous_path = video.output_path()
+        stream_url = f"{settings.MEDIA_URL.rstrip('/')}/{relative_path.rsplit('/', 1)[0]}"
+        video.processed_video = f"{stream_url}/{playlist_name}"
+        video.poster_url = f"{stream_url}/{POSTER_NAME}" if has_poster else None
+        video.thumbnails_vtt_url = f"{stream_url}/{THUMBNAILS_VTT_NAME}" if thumbnails else None
+        video.encode_settings = dict(encoding, passthrough=passthrough) if passthrough else encoding
+        video.source_bytes = video.video.size
+        video.output_bytes = output_bytes
+        video.encoded_at = timezone.now()
+        with transaction.atomic():
+            video.save(update_fields=[
+                'processed_video', 'poster_url', 'thumbnails_vtt_url', 'encode_settings', 'source_bytes',
+                'output_bytes', 'encoded_at'
+            ])
+            # Picked up by `manage.py sync_vod`
+            enqueue_vod_sync(video, relative_path, replaces=previous_path if previous_path != relative_path else None)
+        if previous_path and previous_path.rsplit('/', 1)[0] != relative_path.rsplit('/', 1)[0]:
+            mark_superseded(media_root / previous_path.rsplit('/', 1)[0])
+
+
+def mark_superseded(stream_dir):
+    """Record that ``stream_dir`` stopped being served now, unless already recorded."""
+    marker = Path(stream_dir) / SUPERSEDED_MARKER
+    if marker.parent.is_dir() and not marker.exists():
+        marker.touch()
+
+
+def prune_unreferenced_outputs(older_than):
+    """Delete stream directories no video points at, ``older_than`` seconds after they were replaced.
+
+    A re-encode swaps its video to a new directory and marks the old one
+    superseded; the old one is kept for this grace period so players that
+    already loaded its playlists can finish. Unreferenced directories
+    without a mark get one, so their grace period starts when first seen.
+    Returns the number of directories removed.
+    """
+    referenced = set()
+    for url in Video.objects.exclude(processed_video__isnull=True).exclude(processed_video='').values_list(
+        'processed_video', flat=True
+    ).iterator():
+        path = Video(processed_video=url).output_path()
+        if path:
+            referenced.add(path.rsplit('/', 1)[0])
+
+    media_root = Path(settings.MEDIA_ROOT)
+    cutoff = time.time() - older_than
+    removed = 0
+    for stream_dir in media_root.glob('processed/*/stream_*'):
+        # Encodes in progress live under the staging directory (see video.staging.collect_staging)
+        if stream_dir.parent.name == STAGING_DIR_NAME:
+            continue
+        marker = stream_dir / SUPERSEDED_MARKER
+        if stream_dir.relative_to(media_root).as_posix() in referenced:
+            marker.unlink(missing_ok=True)  # served again, e.g. by a duplicate upload
+            continue
+        try:
+            superseded_at = marker.stat().st_mtime
+        except FileNotFoundError:
+            mark_superseded(stream_dir)
+            continue
+        if superseded_at > cutoff:
+            continue
+        logger.info("Removing unreferenced output %s", stream_dir)
+        shutil.rmtree(stream_dir, ignore_errors=True)
+        removed += 1
+    return removed
@@ -0,0 +1,107 @@
+"""Upload handlers that check and hash files while Django receives them.
+
+``ValidatingUploadHandler`` runs first and stops an upload as soon as its
+head shows it will be refused (see ``video.validation``), before the rest
+is received. The hashing handlers expose the digest as
+``uploaded_file.sha256`` so ``Video.save()`` can store it without reading
+the file a second time.
+"""
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import (
+    FileUploadHandler, MemoryFileUploadHandler, StopUpload, TemporaryFileUploadHandler
+)
+
+from .admission import AdmissionRejected, check_upload
+from .models import VALID_VIDEO_EXTENSIONS, Video
+from .validation import MAGIC_BYTES, sniff_bytes, sniff_container, validate_head
+
+
+def upload_error(request):
+    """Why ``ValidatingUploadHandler`` stopped the file upload of ``request``, or None."""
+    return getattr(request, '_upload_error', None)
+
+
+class ValidatingUploadHandler(FileUploadHandler):
+    """Refuses video uploads from the request headers and the head of the file stream.
+
+    Passes every chunk on unchanged. On refusal the reason is kept for
+    ``upload_error()`` and the upload is stopped without reading the rest of
+    the request body.
+    """
+
+    request_length = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.request_length = content_length
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.head = bytearray()
+        self.validated = False
+        if os.path.splitext(file_name)[1].lower() not in VALID_VIDEO_EXTENSIONS:
+            self.reject('Unsupported file format. Please upload a video file (MP4, MKV, AVI, MOV, or WEBM)')
+        # The request carries the file and at most DATA_UPLOAD_MAX_MEMORY_SIZE of other fields
+        limit = Video.MAX_VIDEO_SIZE_MB * 1024 * 1024 + (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0)
+        if self.request_length and self.request_length > limit:
+            self.reject(f'Video size cannot exceed {Video.MAX_VIDEO_SIZE_MB}MB')
+        try:
+            check_upload(self.request.user, self.request_length)
+        except AdmissionRejected as e:
+            self.reject(str(e))
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > Video.MAX_VIDEO_SIZE_MB * 1024 * 1024:
+            self.reject(f'Video size cannot exceed {Video.MAX_VIDEO_SIZE_MB}MB')
+        if not self.validated:
+            self.head += raw_data[:sniff_bytes() - len(self.head)]
+            # An unknown container is refused from its magic bytes, without waiting for the whole head
+            if len(self.head) >= sniff_bytes() or (
+                    len(self.head) >= MAGIC_BYTES and sniff_container(bytes(self.head[:MAGIC_BYTES])) is None):
+                self.validate(complete=False)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not self.validated:
+            self.validate(complete=True)
+        return None
+
+    def validate(self, complete):
+        self.validated = True
+        try:
+            validate_head(bytes(self.head), complete)
+        except ValidationError as e:
+            self.reject(e.messages[0])
+        finally:
+            self.head = None
+
+    def reject(self, message):
+        self.request._upload_error = message
+        raise StopUpload(connection_reset=True)
+
+
+class HashingMixin:
+    def new_file(self, *args, **kwargs):
+        self.hasher = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.sha256 = self.hasher.hexdigest()
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(HashingMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingMixin, TemporaryFileUploadHandler):
+    pass
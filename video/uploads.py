@@ -0,0 +1,138 @@
+import asyncio
+import fcntl
+import os
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .hashing import forget_upload_hasher, remember_upload_hasher, upload_hasher
+from .models import ChunkedUpload
+
+# Size of each read from the request stream; bounds memory per upload
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class UploadOffsetConflict(Exception):
+    """Raised when a chunk does not start at the upload's current offset."""
+
+
+def _open_locked(path):
+    """Open the partial file of an upload holding its write lock, or raise ``UploadOffsetConflict``.
+
+    The ``flock`` keeps a second request for the same upload, on this or
+    another worker process, from writing while the first one is.
+    """
+    f = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), 'r+b')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        raise UploadOffsetConflict('Another request is writing to this upload')
+    return f
+
+
+def _seek_to(f, offset):
+    # Drop anything a previous, interrupted request wrote past the committed offset
+    f.truncate(offset)
+    f.seek(offset)
+
+
+async def append_chunk(upload, offset, read, length):
+    """Append ``length`` bytes from ``await read(n)`` at ``offset`` and return the new offset.
+
+    The chunk is copied in STREAM_BLOCK_SIZE blocks, so at most one block of
+    the request body is held in memory at a time. File access runs in worker
+    threads, so while a client is slow to send, the event loop serves other
+    uploads. If the body ends early, the bytes received so far are committed
+    and the client resumes from there. One request writes to an upload at a
+    time; a concurrent one gets ``UploadOffsetConflict`` without touching
+    the file.
+    """
+    if offset != upload.offset:
+        raise UploadOffsetConflict(f'Expected offset {upload.offset}, got {offset}')
+    if offset + length > upload.size:
+        raise ValueError('Chunk runs past the declared upload size')
+
+    path = upload.temp_path
+    await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+    f = await asyncio.to_thread(_open_locked, path)
+    try:
+        # The request that held the lock before may have moved the offset on
+        committed = await ChunkedUpload.objects.filter(pk=upload.pk).values_list('offset', flat=True).aget()
+        if committed != offset:
+            raise UploadOffsetConflict(f'Expected offset {committed}, got {offset}')
+        # A copy, so the remembered digest only ever covers committed bytes
+        hasher = (await asyncio.to_thread(upload_hasher, upload)).copy()
+        await asyncio.to_thread(_seek_to, f, offset)
+        written = 0
+        while written < length:
+            block = await read(min(STREAM_BLOCK_SIZE, length - written))
+            if not block:
+                break
+            await asyncio.to_thread(f.write, block)
+            # Hash as the bytes arrive so the finished file never has to be re-read
+            hasher.update(block)
+            written += len(block)
+        await asyncio.to_thread(f.flush)
+
+        new_offset = offset + written
+        # updated_at is set explicitly: QuerySet.update() skips auto_now, and it marks the upload as live
+        if not await ChunkedUpload.objects.filter(pk=upload.pk, offset=offset).aupdate(
+                offset=new_offset, updated_at=timezone.now()):
+            raise UploadOffsetConflict('Upload was modified concurrently')
+    finally:
+        await asyncio.to_thread(f.close)  # releases the lock
+    upload.offset = new_offset
+    if upload.is_complete:
+        upload.sha256 = hasher.hexdigest()
+        await upload.asave(update_fields=['sha256', 'updated_at'])
+        forget_upload_hasher(upload)
+    else:
+        remember_upload_hasher(upload, hasher)
+    return new_offset
+
+
+def attach_upload(upload):
+    """Move a completed upload into MEDIA_ROOT/video/<yy>/ and return its storage name.
+
+    FILE_UPLOAD_TEMP_DIR and MEDIA_ROOT are expected to share a filesystem, in
+    which case this is a rename and the data is never copied.
+    """
+    name = default_storage.get_available_name(
+        f"video/{datetime.now().strftime('%y')}/{os.path.basename(upload.filename)}"
+    )
+    destination = Path(default_storage.path(name))
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.rename(upload.temp_path, destination)
+    except OSError:
+        # Different filesystems: fall back to a copy
+        shutil.move(upload.temp_path, destination)
+    os.chmod(destination, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+    return name
+
+
+def discard_upload(upload):
+    forget_upload_hasher(upload)
+    if upload.temp_path.exists():
+        upload.temp_path.unlink()
+    upload.delete()
+
+
+def stale_upload_cutoff():
+    """Chunked uploads not appended to since this time are abandoned; see UPLOAD_STALE_AFTER."""
+    return timezone.now() - timedelta(seconds=getattr(settings, 'UPLOAD_STALE_AFTER', 24 * 60 * 60))
+
+
+def collect_stale_uploads():
+    """Discard abandoned chunked uploads and their partial files. Returns how many were removed."""
+    stale = ChunkedUpload.objects.filter(video__isnull=True, updated_at__lt=stale_upload_cutoff())
+    removed = 0
+    for upload in stale:
+        discard_upload(upload)
+        removed += 1
+    return removed
@@ -5,4 +5,12 @@ app_name = 'video'
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('api/videos/', views.catalogue, name='catalogue'),
+    path('api/videos/search/', views.search_videos, name='search'),
+    path('uploads/', views.upload_create, name='upload_create'),
+    path('uploads/<uuid:upload_id>/', views.upload_detail, name='upload_detail'),
+    path('uploads/<uuid:upload_id>/complete/', views.upload_complete, name='upload_complete'),
+    path('jobs/<int:job_id>/status/', views.job_status, name='job_status'),
+    path('jobs/<int:job_id>/events/', views.job_events, name='job_events'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
\ No newline at end of file
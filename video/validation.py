@@ -0,0 +1,98 @@
+"""Validation of uploads from the head of the incoming stream.
+
+The first UPLOAD_SNIFF_BYTES of an upload are enough to reject most files we
+would refuse anyway, before the rest is received and stored: the container
+is recognised from its magic bytes (MP4/MOV, Matroska/WebM, AVI), and
+ffprobe reads the stream headers from the head on stdin to check that there
+is a decodable video stream and that the duration is within
+Video.MAX_DURATION_SECONDS.
+
+An MP4 whose ``moov`` box follows the media data (no ``+faststart``) cannot
+be probed from its head unless the head is the whole file; otherwise only
+its magic bytes are checked, and ``Video.clean()`` probes the complete file.
+"""
+import subprocess
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from .models import Video
+from .probe import metadata_from_probe, run_ffprobe_head
+
+MP4 = 'mp4'
+MATROSKA = 'matroska'
+AVI = 'avi'
+
+# Top-level box types an MP4/MOV file may open with
+MP4_LEADING_BOXES = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot'}
+EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+# Bytes sniff_container needs to tell the containers apart
+MAGIC_BYTES = 12
+
+
+def sniff_bytes():
+    """Size of the head probed before the rest of an upload is accepted."""
+    return getattr(settings, 'UPLOAD_SNIFF_BYTES', 4 * 1024 * 1024)
+
+
+def sniff_container(head):
+    """MP4, MATROSKA or AVI from the magic bytes of ``head``, or None."""
+    if head[4:8] in MP4_LEADING_BOXES:
+        return MP4
+    if head.startswith(EBML_MAGIC):
+        return MATROSKA
+    if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return AVI
+    return None
+
+
+def _mp4_header_in(head):
+    """True if a complete ``moov`` box lies within ``head``, walking the top-level boxes."""
+    position = 0
+    while position + 8 <= len(head):
+        size = int.from_bytes(head[position:position + 4], 'big')
+        kind = head[position + 4:position + 8]
+        if size == 1:
+            if position + 16 > len(head):
+                return False
+            size = int.from_bytes(head[position + 8:position + 16], 'big')
+        elif size == 0:
+            size = len(head) - position  # the box runs to the end of the file
+        if size < 8:
+            return False
+        if kind == b'moov':
+            return position + size <= len(head)
+        position += size
+    return False
+
+
+def validate_head(head, complete=False):
+    """Raise ``ValidationError`` if the upload starting with ``head`` is not an acceptable video.
+
+    ``complete`` says that ``head`` is the whole file. Returns the probed
+    metadata fields (see ``video.probe.metadata_from_probe``), or None when
+    the head alone cannot be probed.
+    """
+    container = sniff_container(head)
+    if container is None:
+        raise ValidationError('Unsupported file format. Please upload a video file (MP4, MKV, AVI, MOV, or WEBM)')
+    if container == MP4 and not complete and not _mp4_header_in(head):
+        return None  # moov after the media data: undecided until the whole file is in
+
+    try:
+        data = run_ffprobe_head(head)
+    except (subprocess.SubprocessError, OSError):
+        return None  # ffprobe itself failed; the full-file probe gets another chance
+    metadata = metadata_from_probe(data)
+    if not metadata['video_codec']:
+        raise ValidationError('The file is not a readable video')
+    if metadata['duration'] and metadata['duration'] > Video.MAX_DURATION_SECONDS:
+        raise ValidationError('Video duration cannot exceed 10 minutes')
+    return metadata
+
+
+def validate_upload_head(upload):
+    """``validate_head`` for a ``ChunkedUpload`` whose committed bytes cover the head."""
+    with open(upload.temp_path, 'rb') as f:
+        head = f.read(min(upload.offset, sniff_bytes()))
+    return validate_head(head, complete=len(head) == upload.size)
@@ -0,0 +1,129 @@
+"""Play counting without a database write per view.
+
+``serve_processed`` calls ``count_view`` for every request of a top-level
+playlist (``master.m3u8``, or ``playlist.m3u8`` of a single rendition), which
+only bumps an in-process counter. A background thread flushes the deltas
+every VIEW_COUNT_FLUSH_INTERVAL seconds: one UPDATE of ``Video.view_count``
+(and ``last_viewed_at``) and one ``UPDATE multimedia ... CASE`` in the VOD
+database per interval, however many plays there were. A crash loses at most
+the counts of the current interval; deltas whose write failed are retried
+with the next flush.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import BigIntegerField, Case, F, Value, When
+from django.utils import timezone
+
+from .models import Video
+from .vod_sync import get_pool, vod_link
+
+logger = logging.getLogger(__name__)
+
+TOP_LEVEL_PLAYLISTS = {'master.m3u8', 'playlist.m3u8'}
+# Links per UPDATE statement sent to the VOD database
+VOD_UPDATE_BATCH = 500
+
+
+def _flush_local(counts):
+    """Add ``counts`` (playlist path relative to MEDIA_ROOT -> plays) to ``Video.view_count``."""
+    media_url = settings.MEDIA_URL.rstrip('/')
+    urls = {f'{media_url}/{path}': n for path, n in counts.items()}
+    Video.objects.filter(processed_video__in=urls).update(
+        view_count=F('view_count') + Case(
+            *[When(processed_video=url, then=Value(n)) for url, n in urls.items()],
+            default=Value(0),
+            output_field=BigIntegerField()
+        ),
+        last_viewed_at=timezone.now()
+    )
+
+
+def _flush_vod(counts):
+    """Add ``counts`` to ``multimedia.views``, one UPDATE per VOD_UPDATE_BATCH links."""
+    items = [(vod_link(path), n) for path, n in counts.items()]
+    conn = get_pool().get_connection()
+    try:
+        cursor = conn.cursor()
+        try:
+            for i in range(0, len(items), VOD_UPDATE_BATCH):
+                batch = items[i:i + VOD_UPDATE_BATCH]
+                cursor.execute(
+                    f"UPDATE multimedia SET views = views + CASE link {' '.join(['WHEN %s THEN %s'] * len(batch))} "
+                    f"ELSE 0 END WHERE link IN ({', '.join(['%s'] * len(batch))})",
+                    [value for item in batch for value in item] + [link for link, _ in batch]
+                )
+            conn.commit()
+        finally:
+            cursor.close()
+    finally:
+        conn.close()  # returns the connection to the pool
+
+
+# Every sink keeps its own pending deltas, so a failing VOD database never double-counts locally
+SINKS = {'local': _flush_local, 'vod': _flush_vod}
+
+
+class ViewCounter:
+    """Process-local play counts, flushed to the sinks by a daemon thread."""
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = {name: Counter() for name in SINKS}
+        self._thread = None
+        self._pid = None
+        self._stopped = threading.Event()
+
+    def add(self, playlist, n=1):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked (e.g. a gunicorn worker): counts copied from the parent are the parent's to flush
+                self._pending = {name: Counter() for name in SINKS}
+                self._thread = None
+                self._pid = os.getpid()
+            for counts in self._pending.values():
+                counts[playlist] += n
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        interval = self.interval or getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 30)
+        while not self._stopped.wait(interval):
+            self.flush()
+
+    def flush(self):
+        """Write the pending deltas now. Returns the number of plays written to the local database."""
+        with self._lock:
+            batches, self._pending = self._pending, {name: Counter() for name in SINKS}
+        if not any(batches.values()):
+            return 0
+        close_old_connections()
+        for name, counts in batches.items():
+            if not counts:
+                continue
+            try:
+                SINKS[name](counts)
+            except Exception:
+                logger.exception("Could not flush %d view counts to %s; retrying next interval", len(counts), name)
+                with self._lock:
+                    self._pending[name].update(counts)
+        return sum(batches['local'].values())
+
+
+counter = ViewCounter()
+atexit.register(counter.flush)
+
+
+def count_view(path):
+    """Count a play if ``path`` (relative to MEDIA_ROOT/processed) is a top-level playlist."""
+    parts = Path(path).parts
+    if len(parts) == 3 and parts[2] in TOP_LEVEL_PLAYLISTS:
+        counter.add(f'processed/{path}')
@@ -1,6 +1,317 @@
-from django.shortcuts import render
-from .models import Video
+import asyncio
+import json
+import hmac
+import os
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, render
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.http import condition, require_http_methods
+from rest_framework import generics
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+
+from .admission import AdmissionRejected, check_upload
+from .catalogue import catalogue_version, page_cache_key, page_etag, page_last_modified
+from .metrics import prometheus_text, record
+from .models import VALID_VIDEO_EXTENSIONS, ChunkedUpload, TranscodeJob, Video
+from .search import search
+from .serializers import CATALOGUE_FIELDS, CatalogueVideoSerializer
+from .uploads import UploadOffsetConflict, append_chunk, attach_upload, discard_upload
+from .validation import sniff_bytes, validate_upload_head
 
 def index(request):
-    videos = Video.objects.all()
+    key = f"video:index:{catalogue_version()['version']}"
+    videos = cache.get(key)
+    if videos is None:
+        videos = list(Video.objects.only('caption', 'processed_video', 'poster_url', 'thumbnails_vtt_url'))
+        cache.set(key, videos, settings.CATALOGUE_CACHE_TIMEOUT)
     return render(request, 'index.html', {'video': videos})
+
+
+class CataloguePagination(CursorPagination):
+    page_size = settings.CATALOGUE_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-id'  # unique and increasing, so cursors stay stable as videos are added
+
+
+class CatalogueView(generics.ListAPIView):
+    """Playable videos, newest first, paginated by cursor and cached per page."""
+
+    serializer_class = CatalogueVideoSerializer
+    pagination_class = CataloguePagination
+    permission_classes = [AllowAny]
+    queryset = (
+        Video.objects
+        .exclude(processed_video__isnull=True)
+        .exclude(processed_video='')
+        .only(*CATALOGUE_FIELDS)
+    )
+
+    def list(self, request, *args, **kwargs):
+        key = page_cache_key(request)
+        data = cache.get(key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, settings.CATALOGUE_CACHE_TIMEOUT)
+        return Response(data)
+
+
+catalogue = condition(etag_func=page_etag, last_modified_func=page_last_modified)(CatalogueView.as_view())
+
+
+@require_http_methods(['GET'])
+def search_videos(request):
+    """Playable videos whose caption matches ``q``, best match first, paginated by ``page``.
+
+    ``resolution`` narrows the results to one target resolution.
+    """
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+        page_size = min(max(1, int(request.GET.get('page_size', settings.CATALOGUE_PAGE_SIZE))), 100)
+    except ValueError:
+        return JsonResponse({'error': 'page and page_size must be integers'}, status=400)
+    videos = CatalogueView.queryset.all()
+    if request.GET.get('resolution'):
+        videos = videos.filter(target_resolution=request.GET['resolution'])
+
+    total, results = search(videos, request.GET.get('q', ''), (page - 1) * page_size, page_size)
+    return JsonResponse({
+        'count': total,
+        'page': page,
+        'next': page + 1 if page * page_size < total else None,
+        'previous': page - 1 if page > 1 else None,
+        'results': CatalogueVideoSerializer(results, many=True).data,
+    })
+
+
+def staff_required(view):
+    """Like ``staff_member_required`` but answers API clients with JSON instead of a redirect."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            user = await request.auser()
+            if not (user.is_authenticated and user.is_staff):
+                return JsonResponse({'error': 'Staff login required'}, status=403)
+            return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not (request.user.is_authenticated and request.user.is_staff):
+            return JsonResponse({'error': 'Staff login required'}, status=403)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _admission_response(error):
+    """JSON answer to an upload refused by ``video.admission``."""
+    response = JsonResponse({'error': str(error)}, status=error.status)
+    if error.retry_after:
+        response['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def _upload_response(upload, status=200, error=None):
+    data = {
+        'id': str(upload.id),
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': upload.offset,
+        'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+        'video': upload.video_id,
+    }
+    if error:
+        data['error'] = error
+    response = JsonResponse(data, status=status)
+    response['Upload-Offset'] = str(upload.offset)
+    response['Upload-Length'] = str(upload.size)
+    response['Location'] = reverse('video:upload_detail', args=[upload.id])
+    return response
+
+
+@staff_required
+@require_http_methods(['POST'])
+def upload_create(request):
+    """Start a resumable upload: POST ``filename`` and total ``size`` in bytes."""
+    filename = request.POST.get('filename', '')
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': 'size must be an integer'}, status=400)
+
+    if os.path.splitext(filename)[1].lower() not in VALID_VIDEO_EXTENSIONS:
+        return JsonResponse({'error': 'Unsupported file format. Please upload a video file (MP4, MKV, AVI, MOV, or WEBM)'}, status=400)
+    if not 0 < size <= Video.MAX_VIDEO_SIZE_MB * 1024 * 1024:
+        return JsonResponse({'error': f'Video size cannot exceed {Video.MAX_VIDEO_SIZE_MB}MB'}, status=413)
+
+    try:
+        check_upload(request.user, size)
+    except AdmissionRejected as e:
+        return _admission_response(e)
+
+    upload = ChunkedUpload.objects.create(user=request.user, filename=filename, size=size)
+    return _upload_response(upload, status=201)
+
+
+async def receive_chunk(request, upload, read):
+    """Append the chunk a PATCH ``request`` carries to ``upload``, reading its body with ``await read(n)``."""
+    try:
+        offset = int(request.headers['Upload-Offset'])
+        length = int(request.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Upload-Offset and Content-Length headers are required'}, status=400)
+    if length > settings.UPLOAD_CHUNK_SIZE:
+        return JsonResponse({'error': f'Chunks may not exceed {settings.UPLOAD_CHUNK_SIZE} bytes'}, status=413)
+    try:
+        new_offset = await append_chunk(upload, offset, read, length)
+    except UploadOffsetConflict as e:
+        await upload.arefresh_from_db()
+        return _upload_response(upload, status=409, error=str(e))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Once the head is in, a file we would refuse is dropped before the rest is sent
+    if offset < sniff_bytes() and (new_offset >= sniff_bytes() or upload.is_complete):
+        try:
+            await asyncio.to_thread(validate_upload_head, upload)
+        except ValidationError as e:
+            await sync_to_async(discard_upload)(upload)
+            return JsonResponse({'error': e.messages}, status=422)
+    return _upload_response(upload)
+
+
+@staff_required
+@require_http_methods(['GET', 'HEAD', 'PATCH', 'DELETE'])
+async def upload_detail(request, upload_id):
+    """Report the committed offset (GET/HEAD), append a chunk (PATCH) or abort (DELETE).
+
+    A PATCH carries the chunk as its raw body and the offset it starts at in
+    the ``Upload-Offset`` header. After a dropped connection the client asks
+    for the offset with HEAD and resumes from there. Under ASGI, PATCHes are
+    normally taken over by ``video.asgi.StreamingUploads`` before Django reads
+    the body.
+    """
+    upload = await aget_object_or_404(ChunkedUpload, pk=upload_id, video__isnull=True)
+
+    if request.method == 'DELETE':
+        await sync_to_async(discard_upload)(upload)
+        return HttpResponse(status=204)
+
+    if request.method == 'PATCH':
+        return await receive_chunk(request, upload, lambda n: asyncio.to_thread(request.read, n))
+
+    return _upload_response(upload)
+
+
+@staff_required
+@require_http_methods(['POST'])
+def upload_complete(request, upload_id):
+    """Turn a fully received upload into a ``Video`` and queue it for transcoding."""
+    upload = get_object_or_404(ChunkedUpload, pk=upload_id, video__isnull=True)
+    if not upload.is_complete:
+        return _upload_response(upload, status=409, error='Upload is not complete')
+
+    video = Video(
+        caption=request.POST.get('caption') or os.path.splitext(upload.filename)[0][:100],
+        target_resolution=request.POST.get('target_resolution', '720p'),
+        source_sha256=upload.sha256,
+        uploaded_by=upload.user,
+    )
+    if video.target_resolution not in dict(Video.RESOLUTION_CHOICES):
+        return JsonResponse({'error': 'Unknown target_resolution'}, status=400)
+
+    video.video = attach_upload(upload)
+    try:
+        video.save()
+    except ValidationError as e:
+        video.video.delete(save=False)
+        upload.delete()
+        return JsonResponse({'error': e.messages}, status=400)
+
+    upload.video = video
+    upload.save(update_fields=['video', 'updated_at'])
+    record('upload', video, (timezone.now() - upload.created_at).total_seconds(), upload.created_at, bytes_in=upload.size)
+    return JsonResponse({'id': video.pk, 'caption': video.caption, 'status': video.status}, status=201)
+
+
+JOB_STATE_FIELDS = [
+    'id', 'video_id', 'status', 'progress', 'fps', 'speed', 'eta_seconds', 'attempts', 'error',
+    'started_at', 'finished_at', 'progress_at'
+]
+
+# Seconds between database polls of a job watched over server-sent events
+JOB_EVENTS_POLL_INTERVAL = 1
+# Comment lines keep idle event streams open through proxies
+JOB_EVENTS_KEEPALIVE = 15
+
+
+@staff_required
+@require_http_methods(['GET'])
+async def job_status(request, job_id):
+    """Current state and encoder progress of a transcode job, for polling clients."""
+    state = await TranscodeJob.objects.filter(pk=job_id).values(*JOB_STATE_FIELDS).afirst()
+    if state is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    return JsonResponse(state)
+
+
+async def job_events(request, job_id):
+    """Stream a job's state as server-sent events until it finishes.
+
+    The view is async so an open stream costs a coroutine rather than a
+    worker thread; serve it through ``project.asgi``.
+    """
+    user = await request.auser()
+    if not (user.is_authenticated and user.is_staff):
+        return JsonResponse({'error': 'Staff login required'}, status=403)
+    if not await TranscodeJob.objects.filter(pk=job_id).aexists():
+        return JsonResponse({'error': 'Job not found'}, status=404)
+
+    async def events():
+        last, quiet = None, 0
+        while True:
+            state = await TranscodeJob.objects.filter(pk=job_id).values(*JOB_STATE_FIELDS).afirst()
+            if state is None:
+                break
+            data = json.dumps(state, cls=DjangoJSONEncoder)
+            if data != last:
+                yield f'event: progress\ndata: {data}\n\n'
+                last, quiet = data, 0
+            elif quiet >= JOB_EVENTS_KEEPALIVE:
+                yield ': keepalive\n\n'
+                quiet = 0
+            if state['status'] in (Video.STATUS_DONE, Video.STATUS_FAILED):
+                yield f'event: end\ndata: {data}\n\n'
+                break
+            await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+            quiet += JOB_EVENTS_POLL_INTERVAL
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx would otherwise hold events back
+    return response
+
+
+@require_http_methods(['GET'])
+def metrics(request):
+    """Pipeline stage timings, job queue and VOD outbox state in the Prometheus text format.
+
+    Scrapers authenticate with ``Authorization: Bearer <METRICS_TOKEN>``;
+    staff sessions may read it without a token.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorization = request.headers.get('Authorization', '')
+    authorized = bool(token) and hmac.compare_digest(authorization, f'Bearer {token}')
+    if not (authorized or (request.user.is_authenticated and request.user.is_staff)):
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,197 @@
+"""Outbox-based sync of processed streams into the external VOD MySQL database."""
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+import mysql.connector
+from mysql.connector import pooling
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from project.vod_settings import VOD_DB
+
+from .metrics import record, stage
+from .models import VodSyncOutbox
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+
+def vod_link(relative_path):
+    """Public URL stored in ``multimedia.link`` for a path under MEDIA_ROOT."""
+    return f"{settings.WEB_MEDIA_URL.rstrip('/')}/{relative_path}"
+
+
+def enqueue_vod_sync(video, relative_path, replaces=None):
+    """Record that ``video``'s stream must be inserted into ``multimedia``.
+
+    Call inside the transaction that stores the encode result. The link is the
+    idempotency key, so reprocessing into the same location never produces a
+    second row. When a re-encode moved the stream, ``replaces`` is the old
+    relative path and the existing row is pointed at the new link instead.
+    """
+    link = vod_link(relative_path)
+    extra = {'replaces': vod_link(replaces)} if replaces else {}
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    VodSyncOutbox.objects.get_or_create(
+        idempotency_key=hashlib.sha256(link.encode()).hexdigest(),
+        defaults={
+            'video': video,
+            'payload': {
+                'judul': video.caption,
+                'link': link,
+                'status': 'Aktif',
+                'created_at': current_time,
+                'updated_at': current_time,
+                'kategori_id': 2,  # default to 2 - adjust as needed
+                'views': 0,
+                **extra,
+            },
+        }
+    )
+
+
+def get_pool():
+    """Process-wide MySQL connection pool for VOD_DB."""
+    global _pool
+    if _pool is None:
+        _pool = pooling.MySQLConnectionPool(
+            pool_name='vod_sync',
+            pool_size=getattr(settings, 'VOD_SYNC_POOL_SIZE', 4),
+            host=VOD_DB['host'],
+            port=VOD_DB['port'],
+            database=VOD_DB['database'],
+            user=VOD_DB['user'],
+            password=VOD_DB['password']
+        )
+    return _pool
+
+
+def _insert_batch(conn, rows):
+    """Insert the rows whose link is not in ``multimedia`` yet, in one multi-row INSERT.
+
+    Rows that replace an existing link update that row instead, keeping its
+    id and view count.
+    """
+    links = [row.payload['link'] for row in rows]
+    links += [row.payload['replaces'] for row in rows if row.payload.get('replaces')]
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"SELECT link FROM multimedia WHERE link IN ({', '.join(['%s'] * len(links))})",
+            links
+        )
+        existing = {link for (link,) in cursor.fetchall()}
+        values, moved = [], []
+        for row in rows:
+            p = row.payload
+            if p['link'] in existing:
+                continue
+            existing.add(p['link'])
+            if p.get('replaces') in existing:
+                existing.discard(p['replaces'])
+                moved.append((p['link'], p['updated_at'], p['replaces']))
+                continue
+            values.append((p['judul'], p['link'], p['status'], p['created_at'], p['updated_at'], p['kategori_id'], p['views']))
+        if values:
+            cursor.executemany("""
+                INSERT INTO multimedia
+                (judul, link, status, created_at, updated_at, kategori_id, views)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, values)
+        if moved:
+            cursor.executemany("UPDATE multimedia SET link = %s, updated_at = %s WHERE link = %s", moved)
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return len(values) + len(moved)
+
+
+def _backoff(attempts):
+    base = getattr(settings, 'VOD_SYNC_RETRY_DELAY', 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 3600))
+
+
+# Errors that concern the connection or server rather than the rows being written
+CONNECTION_ERRORS = (mysql.connector.InterfaceError, mysql.connector.OperationalError)
+
+
+def _send(conn, rows, sent):
+    """Write ``rows``, appending those written to ``sent``; returns the others as ``(row, error)`` pairs.
+
+    If the batch is refused, the rows are written one at a time, so a row
+    the database rejects cannot hold back the rest. Connection errors are
+    raised: no further row would get through.
+    """
+    try:
+        _insert_batch(conn, rows)
+        sent.extend(rows)
+        return []
+    except CONNECTION_ERRORS:
+        raise
+    except mysql.connector.Error as err:
+        if len(rows) == 1:
+            return [(rows[0], err)]
+        logger.warning("VOD batch of %d rows refused, writing them one at a time: %s", len(rows), err)
+    failed = []
+    for row in rows:
+        try:
+            _insert_batch(conn, [row])
+        except CONNECTION_ERRORS:
+            raise
+        except mysql.connector.Error as err:
+            failed.append((row, err))
+        else:
+            sent.append(row)
+    return failed
+
+
+def drain_outbox(batch_size=None):
+    """Send one batch of due outbox rows. Returns ``(sent, failed)`` row counts."""
+    batch_size = batch_size or getattr(settings, 'VOD_SYNC_BATCH_SIZE', 100)
+    rows = list(
+        VodSyncOutbox.objects
+        .filter(status=VodSyncOutbox.STATUS_PENDING, next_attempt_at__lte=timezone.now())
+        .order_by('next_attempt_at', 'pk')[:batch_size]
+    )
+    if not rows:
+        return 0, 0
+
+    sent, failed = [], []
+    try:
+        with stage('vod_insert'):
+            conn = get_pool().get_connection()
+            try:
+                failed = _send(conn, rows, sent)
+            finally:
+                conn.close()  # returns the connection to the pool
+    except mysql.connector.Error as err:
+        # Rows written one at a time before the connection failed stay sent
+        failed = [(row, err) for row in rows if row not in sent]
+
+    max_attempts = getattr(settings, 'VOD_SYNC_MAX_ATTEMPTS', 10)
+    with transaction.atomic():
+        for row, err in failed:
+            logger.error("Error updating VOD database with %s: %s", row.payload.get('link'), err)
+            row.attempts += 1
+            row.last_error = str(err)
+            row.next_attempt_at = timezone.now() + _backoff(row.attempts)
+            if row.attempts >= max_attempts:
+                row.status = VodSyncOutbox.STATUS_FAILED
+            row.save(update_fields=['attempts', 'last_error', 'next_attempt_at', 'status'])
+
+    sent_at = timezone.now()
+    VodSyncOutbox.objects.filter(pk__in=[row.pk for row in sent]).update(
+        status=VodSyncOutbox.STATUS_SENT,
+        sent_at=sent_at,
+        last_error=''
+    )
+    for row in sent:
+        # Time from the encode being published to it reaching the VOD database
+        record('vod_sync', row.video_id, (sent_at - row.created_at).total_seconds(), row.created_at)
+    return len(sent), len(failed)